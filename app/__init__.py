@@ -1,4 +1,5 @@
 import os
+import functools
 import logging
 from celery import Celery
 from config import config, Config
@@ -14,6 +15,8 @@ from flask_tinyclients.nessus import Nessus
 from flask_tinyclients.vxstream import VxStream
 from flask_tinyclients.fireeye import FireEye
 from app.core import FlaskApi, ApiException
+from app.core.audit import AuditLog
+from app.core.caching import cache
 from app.utils import JSONEncoder
 from .utils.mixins import Anonymous
 
@@ -68,7 +71,15 @@ def create_app(config_name):
         _audit_log.addHandler(shandler)
 
     _audit_log.setLevel(logging.INFO)
-    app.audit_log = _audit_log
+    app.audit_log = AuditLog(
+        _audit_log,
+        max_data=app.config['AUDIT_LOG_MAX_DATA'],
+        batch_size=app.config['AUDIT_LOG_BATCH_SIZE'],
+        queue_size=app.config['AUDIT_LOG_QUEUE_SIZE'],
+        background=app.config['AUDIT_LOG_BACKGROUND'])
+    if app.config['AUDIT_LOG_STORE']:
+        from .models import AuditEntry
+        app.audit_log.store = functools.partial(AuditEntry.store, app)
 
     if not app.config['DEBUG'] and not app.config['TESTING']:
         # configure logging for production
@@ -122,6 +133,7 @@ def init_extensions(app):
     gpg.init_app(app)
     ldap3_manager.init_app(app)
     migrate.init_app(app, db, directory=app.config['MIGRATIONS_DIR'])
+    cache.init_app(app)
     vxstream.init_app(app)
     nessus.init_app(app)
     fireeye.init_app(app)
@@ -1,8 +1,6 @@
 """
     https://en.wikipedia.org/wiki/Representational_state_transfer
 """
-import datetime
-
 from flask import Blueprint, request, current_app
 from flask_login import login_required, current_user
 
@@ -11,11 +9,17 @@ from . import routes  # noqa
 from . import organizations, organization_groups, ip_ranges, lists  # noqa
 from . import asns, emails, fqdns, gnupg_keys, samples  # noqa
 from . import deliverables, deliverable_files, reports, tags  # noqa
-from . import vulnerabilities  # noqa
+from . import vulnerabilities, batch, audit_log  # noqa
 from .analysis import av, static, vxstream, nessus, fireeye  # noqa
 from . import errors
 from .decorators import rate_limit, admin_required
-from app.utils import addslashes, _HTTP_METHOD_TO_AUDIT_MAP
+from app.core.api import NDJSON_MIMETYPE
+
+#: Collection endpoints which stream NDJSON, see
+#: :func:`~app.core.api.wants_ndjson`
+NDJSON_ENDPOINTS = frozenset([
+    'api.get_organizations', 'api.get_asns', 'api.get_fqdns',
+    'api.get_ip_ranges'])
 
 
 @api.before_request
@@ -23,8 +27,12 @@ from app.utils import addslashes, _HTTP_METHOD_TO_AUDIT_MAP
 @login_required
 @admin_required
 def before_api_request():
-    if 'application/json' not in request.accept_mimetypes:
-        return errors.not_acceptable()
+    if 'application/json' in request.accept_mimetypes:
+        return None
+    if request.endpoint in NDJSON_ENDPOINTS and \
+            NDJSON_MIMETYPE in request.accept_mimetypes:
+        return None
+    return errors.not_acceptable()
 
 
 @api.after_request
@@ -34,23 +42,5 @@ def api_audit_log(response):
     :param response: Server :class:`~flask.Response`
     :return: :class:`~flask.Response`
     """
-    kwargs = {
-        'module': api.name,
-        'user': current_user.name,
-        'email': current_user.email,
-        'action': _HTTP_METHOD_TO_AUDIT_MAP[request.method.lower()],
-        'data': addslashes(request.data.decode()),
-        'url': request.url,
-        'endpoint': request.endpoint,
-        'ip': request.remote_addr,
-        'status': response.status,
-        'timestamp': datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-    }
-    if not request.view_args and request.method.lower() == 'put':
-        kwargs['action'] = _HTTP_METHOD_TO_AUDIT_MAP['post']
-    entry = []
-    for k, v in kwargs.items():
-        entry.append('{0!s}="{1!s}"'.format(k, v))
-    entry = ' '.join(entry)
-    current_app.audit_log.info('{0!s}'.format(entry))
+    current_app.audit_log.record(api.name, current_user, response)
     return response
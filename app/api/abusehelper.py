@@ -1,6 +1,7 @@
 from flask import request, current_app, url_for
 from flask_jsonschema import validate
 from .. import db
+from ..core import caching
 from ..models import AHBot as Bot
 from .decorators import json_response
 from . import api
@@ -36,6 +37,8 @@ def get_abusehelper():
           ]
         }
 
+    :query fields: Comma separated list of attributes to return
+    :query expand: Comma separated list of relationships to return
     :reqheader Accept: Content type(s) accepted by the client
     :resheader Content-Type: this depends on `Accept` header or request
 
@@ -46,8 +49,8 @@ def get_abusehelper():
     :status 200: Deliverable endpoint found, response may be empty
     :status 404: Not found
     """
-    bots = Bot.query.filter().all()
-    return {'abusehelper': [a.serialize() for a in bots]}
+    bots = caching.cached_query(Bot.query)
+    return {'abusehelper': bots}
 
 
 @api.route('/abusehelper/<int:bot_id>', methods=['GET'])
@@ -1,9 +1,11 @@
 from flask import request, redirect, url_for
 from flask_jsonschema import validate
-from app.core import ApiResponse
+from app.core import ApiResponse, ApiStreamResponse, wants_ndjson
+from app.core import query_etag
 from app import db
 from app.models import Asn
 from . import api
+from .bulk import validate_bulk, bulk_create
 
 
 @api.route('/asns', methods=['GET'])
@@ -34,7 +36,13 @@ def get_asns():
           ]
         }
 
-    :reqheader Accept: Content type(s) accepted by the client
+    :query fields: Comma separated list of attributes to return
+    :query expand: Comma separated list of relationships to return
+    :reqheader Accept: Content type(s) accepted by the client.
+        With ``application/x-ndjson`` items are streamed, one JSON
+        object per line.
+    :reqheader If-None-Match: ``ETag`` of a previously returned list
+    :resheader ETag: Weak entity tag of the list
     :resheader Content-Type: this depends on `Accept` header or request
 
     :>json array asns: List of available ASN objects
@@ -42,10 +50,14 @@ def get_asns():
     :>jsonobj integer asn: AS number
 
     :status 200: Deliverable endpoint found, response may be empty
+    :status 304: Not modified since the previous request
     :status 404: Not found
     """
-    asns = Asn.query.filter().all()
-    return ApiResponse({'asns': [a.serialize() for a in asns]})
+    asns = Asn.query.filter()
+    if wants_ndjson():
+        return ApiStreamResponse(asns)
+    etag = query_etag(asns)
+    return ApiResponse({'asns': asns.all()}, etag=etag)
 
 
 @api.route('/asns/<int:asn_id>', methods=['GET'])
@@ -88,10 +100,13 @@ def get_asn(asn_id):
 
 
 @api.route('/asns', methods=['POST', 'PUT'])
-@validate('asns', 'add_asn')
+@validate_bulk('asns', 'add_asn')
 def add_asn():
     """Create new ASN entry
 
+    Send an array of objects to add several ASNs at once. Invalid
+    items are skipped and reported in ``errors``.
+
     **Example request**:
 
     .. sourcecode:: http
@@ -122,6 +137,7 @@ def add_asn():
           "message": "Asn added"
         }
 
+    :query strict: Add nothing if any item of an array is invalid
     :reqheader Accept: Content type(s) accepted by the client
     :resheader Content-Type: this depends on `Accept` header or request
 
@@ -135,7 +151,10 @@ def add_asn():
 
     :status 201: ASN successfully saved
     :status 400: Bad request
+    :status 422: No item of the array could be added
     """
+    if isinstance(request.json, list):
+        return bulk_create(Asn, request.json, 'asns', 'add_asn')
     a = Asn().from_json(request.json)
     db.session.add(a)
     db.session.commit()
@@ -0,0 +1,114 @@
+"""
+    Audit log endpoint module
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+"""
+from flask import request
+from app.constituency import parse_timestamp
+from app.core import ApiPagedResponse, ApiException
+from app.models import AuditEntry
+from . import api
+
+#: Query arguments matching :class:`~app.models.AuditEntry` columns
+FILTERS = ('module', 'user', 'email', 'action', 'endpoint', 'ip', 'status')
+
+
+@api.route('/audit-log', methods=['GET'])
+def get_audit_log():
+    """Search the audit log. Entries are returned newest first.
+
+    Use keyset pagination to browse long periods: pass an empty ``after``
+    argument for the first page, then the ``next`` cursor of each page,
+    with the same filters.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+        GET /api/1.0/audit-log?action=edit&since=2019-01-01&after= HTTP/1.1
+        Host: do.cert.europa.eu
+        Accept: application/json
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {
+          "items": [
+            {
+              "action": "edit",
+              "created": "2019-01-14T09:31:02",
+              "data": "{\\"abbreviation\\": \\"CERT-EU\\"}",
+              "email": "cert-eu@ec.europa.eu",
+              "endpoint": "api.update_organization",
+              "id": 13,
+              "ip": "127.0.0.1",
+              "module": "api",
+              "status": 200,
+              "url": "http://do.cert.europa.eu/api/1.0/organizations/1",
+              "user": "cert-eu"
+            }
+          ],
+          "next": "WzEzXQ"
+        }
+
+    :query module: Blueprint: ``api``, ``cp`` or ``auth``
+    :query user: User name
+    :query email: User e-mail
+    :query action: ``add``, ``edit``, ``view``, ``delete`` or ``options``
+    :query endpoint: Endpoint name, e.g. ``api.update_organization``
+    :query ip: Client IP address
+    :query status: Response status code
+    :query since: Only entries logged at or after this UTC time,
+        e.g. ``2019-01-01`` or ``2019-01-01T12:00:00``
+    :query until: Only entries logged before this UTC time
+    :query after: Keyset pagination cursor
+    :query page: Page number, if ``after`` is not given
+    :query per_page: Number of items per page
+
+    :reqheader Accept: Content type(s) accepted by the client
+    :resheader Content-Type: this depends on `Accept` header or request
+    :resheader Link: First and next page links, without filters
+
+    :>json array items: Audit log entries
+    :>jsonarr integer id: Entry unique ID
+    :>jsonarr string created: Request time (UTC)
+    :>jsonarr string module: Blueprint
+    :>jsonarr string user: User name
+    :>jsonarr string email: User e-mail
+    :>jsonarr string action: Action
+    :>jsonarr string data: Request body, or its SHA-256 digest and size
+        for large bodies
+    :>jsonarr string url: Request URL
+    :>jsonarr string endpoint: Endpoint name
+    :>jsonarr string ip: Client IP address
+    :>jsonarr integer status: Response status code
+    :>json string next: Cursor of the next page, ``null`` on the last page
+
+    :status 200: Audit log entries, may be empty
+    :status 400: Invalid filter or cursor
+    """
+    query = AuditEntry.query
+    for name in FILTERS:
+        value = request.args.get(name)
+        if value is None:
+            continue
+        if name == 'status':
+            try:
+                value = int(value)
+            except ValueError:
+                raise ApiException('Invalid status: {}'.format(value))
+        query = query.filter(getattr(AuditEntry, name) == value)
+    try:
+        if request.args.get('since'):
+            query = query.filter(
+                AuditEntry.created >= parse_timestamp(request.args['since']))
+        if request.args.get('until'):
+            query = query.filter(
+                AuditEntry.created < parse_timestamp(request.args['until']))
+    except ValueError as ve:
+        raise ApiException(str(ve))
+    return ApiPagedResponse(query, max_per_page=100)
@@ -0,0 +1,187 @@
+"""
+    Batch requests
+    ~~~~~~~~~~~~~~
+
+    Run several API requests in one round-trip.
+
+"""
+import json
+import sys
+from flask import request, current_app
+from flask_jsonschema import validate
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from werkzeug.test import EnvironBuilder
+from app import db
+from app.core import ApiResponse
+from . import api, errors
+
+
+def _item(response):
+    """Return the batch response item of sub-request ``response``"""
+    item = {'status': response.status_code, 'body': None}
+    data = response.get_data(as_text=True)
+    if data and response.mimetype == 'application/json':
+        item['body'] = json.loads(data)
+    if 'Location' in response.headers:
+        item['location'] = response.headers['Location']
+    return item
+
+
+def _dispatch(method, url, body, user):
+    """Dispatch sub-request ``method`` ``url`` to its API view.
+
+    The sub-request is not authenticated again: it runs as ``user``, the
+    user of the batch request, and skips the ``before_request`` handlers
+    of the API. Responses are processed as usual, so sub-requests are
+    recorded in the audit log.
+
+    :return: :class:`~flask.Response`
+    """
+    builder = EnvironBuilder(
+        path=url, method=method, base_url=request.host_url,
+        headers={'Accept': 'application/json'},
+        environ_base={'REMOTE_ADDR': request.remote_addr},
+        data=json.dumps(body) if body is not None else None,
+        content_type='application/json')
+    ctx = current_app.request_context(builder.get_environ())
+    # Flask-Login loads the user once per request context
+    ctx.user = user
+    with ctx:
+        sub = ctx.request
+        if sub.routing_exception is not None or \
+                sub.blueprint != api.name or sub.endpoint == 'api.batch':
+            return errors.not_found('Resource not found')
+        try:
+            rv = current_app.view_functions[sub.endpoint](**sub.view_args)
+        except Exception as e:
+            try:
+                rv = current_app.handle_user_exception(e)
+            except Exception:
+                current_app.log_exception(sys.exc_info())
+                rv = ApiResponse({'message': 'Internal server error'}, 500)
+        response = current_app.make_response(rv)
+        return current_app.process_response(response)
+
+
+@api.route('/batch', methods=['POST'])
+@validate('batch', 'batch')
+def batch():
+    """Run several API requests in one round-trip.
+
+    Sub-requests are run in order, as the user of the batch request, and
+    return one item each. With ``atomic``, all sub-requests run in one
+    database transaction, which is committed only if all of them succeed.
+    Sub-requests following a failed one are not run and return
+    ``424 Failed Dependency``.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+        POST /api/1.0/batch HTTP/1.1
+        Host: do.cert.europa.eu
+        Accept: application/json
+        Content-Type: application/json
+
+        {
+          "atomic": true,
+          "requests": [
+            {
+              "method": "POST",
+              "url": "/api/1.0/asns",
+              "body": {"asn": 64512, "organization_id": 1}
+            },
+            {
+              "method": "GET",
+              "url": "/api/1.0/asns/1"
+            }
+          ]
+        }
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {
+          "committed": true,
+          "responses": [
+            {
+              "status": 201,
+              "body": {
+                "asn": {"asn": 64512, "id": 2},
+                "message": "ASN added"
+              },
+              "location": "http://do.cert.europa.eu/api/1.0/asns/2"
+            },
+            {
+              "status": 200,
+              "body": {"asn": 12345, "id": 1}
+            }
+          ]
+        }
+
+    :reqheader Accept: Content type(s) accepted by the client
+    :resheader Content-Type: this depends on `Accept` header or request
+
+    :<json boolean atomic: Run all sub-requests in one transaction.
+        Defaults to false.
+    :<json array requests: Sub-requests
+    :<jsonarr string method: HTTP method: GET, POST, PUT or DELETE
+    :<jsonarr string url: API URL, e.g. ``/api/1.0/asns``
+    :<jsonarr object body: JSON body of POST and PUT requests
+    :>json boolean committed: ``false`` if an atomic batch was rolled back
+    :>json array responses: One item per sub-request, in request order
+    :>jsonarr integer status: HTTP status code of the sub-request
+    :>jsonarr object body: JSON body of the sub-request response
+    :>jsonarr string location: ``Location`` header, if any
+
+    :status 200: Batch processed, see the status of each item
+    :status 422: Invalid batch request
+    """
+    atomic = request.json.get('atomic', False)
+    user = current_user._get_current_object()
+    responses = []
+    failed = False
+    if atomic:
+        db.session.info['atomic_batch'] = True
+        db.session.begin_nested()
+    try:
+        for sub in request.json['requests']:
+            if failed:
+                responses.append({'status': 424, 'body': {
+                    'message': 'A previous request of the batch failed'}})
+                continue
+            response = _dispatch(sub['method'], sub['url'], sub.get('body'),
+                                 user)
+            responses.append(_item(response))
+            if response.status_code >= 500 or \
+                    atomic and response.status_code >= 400:
+                failed = atomic
+                db.session.rollback()
+    except Exception:
+        failed = atomic
+        raise
+    finally:
+        if atomic:
+            db.session.info.pop('atomic_batch', None)
+            end = db.session.rollback if failed else db.session.commit
+            while db.session.transaction.nested:
+                end()
+            end()
+    return ApiResponse({'committed': not failed, 'responses': responses})
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _restart_savepoint(session, transaction):
+    """Views commit their changes. In atomic batches, these commits only
+    release a savepoint, which is started again so that the batch
+    transaction is never committed by a view.
+    """
+    if session.info.get('atomic_batch') and transaction.nested and \
+            not transaction._parent.nested:
+        session.begin_nested()
@@ -0,0 +1,99 @@
+"""
+    Bulk creation
+    ~~~~~~~~~~~~~
+
+    Helpers for endpoints that add one object, or an array of objects in
+    one request.
+
+"""
+import functools
+from flask import request, current_app
+from flask_jsonschema import validate
+from jsonschema import Draft4Validator
+from jsonschema.exceptions import best_match
+from app import db
+from app.core import ApiResponse, counts
+from app.models import Organization, touch_organizations
+
+
+def validate_bulk(*path):
+    """Same as :func:`flask_jsonschema.validate`, but array payloads are
+    validated with the schema named after ``path`` with an ``s`` appended,
+    e.g. ``add_ip_ranges`` for ``add_ip_range``.
+    Items are validated by :func:`bulk_create`.
+    """
+    bulk_path = path[:-1] + (path[-1] + 's', )
+
+    def decorator(f):
+        single = validate(*path)(f)
+        bulk = validate(*bulk_path)(f)
+
+        @functools.wraps(f)
+        def wrapped(*args, **kwargs):
+            if isinstance(request.json, list):
+                return bulk(*args, **kwargs)
+            return single(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def _values(model, item):
+    """Column values of ``item``, as set by
+    :meth:`~app.models.Model.from_json`
+    """
+    columns = model.__table__.columns
+    return {k: v for k, v in item.items()
+            if k in columns and not columns[k].primary_key and
+            isinstance(v, (str, int))}
+
+
+def bulk_create(model, items, *path):
+    """Validate ``items`` and insert the valid ones in one transaction,
+    with a single multi-row ``INSERT``.
+
+    Invalid items are reported in ``errors`` with their index. With
+    ``?strict=1``, nothing is added if any item is invalid.
+
+    :param model: Model class, e.g. :class:`~app.models.IpRange`
+    :param items: List of JSON objects
+    :param path: Schema of a single item, e.g.
+        ``('ip_ranges', 'add_ip_range')``
+    :return: :class:`~app.core.ApiResponse`
+    """
+    schema = current_app.extensions['jsonschema'].get_schema(path)
+    validator = Draft4Validator(
+        schema,
+        format_checker=current_app.config.get('JSONSCHEMA_FORMAT_CHECKER'))
+    org_ids = {i.get('organization_id') for i in items} - {None}
+    if org_ids:
+        org_ids = {o for o, in db.session.query(Organization.id).filter(
+            Organization.id.in_(org_ids), Organization.deleted == 0)}
+
+    rows, errors = [], []
+    for index, item in enumerate(items):
+        error = best_match(validator.iter_errors(item))
+        if error is not None:
+            errors.append({'index': index, 'message': error.message,
+                           'validator': error.validator})
+        elif item.get('organization_id') is not None and \
+                item['organization_id'] not in org_ids:
+            errors.append({'index': index,
+                           'message': 'No such organization',
+                           'validator': 'organization_id'})
+        else:
+            rows.append(_values(model, item))
+
+    strict = request.args.get('strict', '').lower() in ('1', 'true', 'yes')
+    if not rows or errors and strict:
+        return ApiResponse({'message': 'Nothing added', 'added': 0,
+                            'errors': errors}, 422)
+    db.session.bulk_insert_mappings(model, rows)
+    touched = {r['organization_id'] for r in rows
+               if r.get('organization_id')}
+    if touched:
+        touch_organizations(db.session, touched)
+    db.session.commit()
+    # Bulk inserts do not emit flush events
+    counts.invalidate({model.__tablename__})
+    return ApiResponse({'message': '{} added'.format(len(rows)),
+                        'added': len(rows), 'errors': errors}, 201)
@@ -4,13 +4,15 @@ Copyright (c) 2015 Alexandru Ciobanu
 """
 from datetime import timedelta
 import functools
-from time import time
 from threading import Thread
 from werkzeug.wrappers import Response
 from flask import jsonify, url_for, request, make_response, current_app
 from flask import g, abort
 from flask_login import current_user
 from app.models import Permission
+from app.core import counts, encoding, ratelimit
+from app.core.api import keyset_paginate, wants_count
+from app.utils.mixins import get_fieldset
 
 
 def json_response(f):
@@ -45,10 +47,11 @@ def json_response(f):
         # if the response was a database model, then convert it to a
         # dictionary
         if not isinstance(rv, dict):
-            rv = rv.serialize()
+            rv = rv.serialize(**get_fieldset())
 
         # generate the JSON response
-        rv = jsonify(rv)
+        rv = current_app.response_class(encoding.dumps(rv),
+                                        mimetype='application/json')
         if status_or_headers is not None:
             rv.status_code = status_or_headers
         if headers is not None:
@@ -58,21 +61,52 @@ def json_response(f):
     return wrapped
 
 
-def paginate(f=None, *, max_per_page=20, headers_prefix='DO-'):
+def paginate(f=None, *, max_per_page=20, headers_prefix='DO-',
+             keyset=('id',), estimate_count=False):
     """Pagination decorator.
     Generate a paginated response for a resource collection.
     Routes that use this decorator must return a SQLAlchemy query as a
     response.
+    Keyset pagination is used when the ``after`` argument is present, see
+    :class:`~app.core.ApiPagedResponse`.
 
     :param f: function to be decorated
     :param max_per_page: Items per page
     :param headers_prefix: Prefix for custom headers
+    :param keyset: Attributes used for keyset pagination
+    :param estimate_count: Estimate total counts of large collections,
+        see :func:`app.core.counts.total`
     :return: tuple as (response, headers)
     """
     if f is None:
         return functools.partial(paginate,
                                  max_per_page=max_per_page,
-                                 headers_prefix=headers_prefix)
+                                 headers_prefix=headers_prefix,
+                                 keyset=keyset,
+                                 estimate_count=estimate_count)
+
+    def keyset_page(query, after, per_page, kwargs):
+        items, cursor = keyset_paginate(query, keyset, after, per_page)
+        rv = {'per_page': per_page}
+        if wants_count():
+            rv['count'], estimated = counts.total(query, estimate_count)
+            if estimated:
+                rv['estimated'] = True
+        if cursor:
+            rv['next'] = url_for(request.endpoint, after=cursor,
+                                 per_page=per_page,
+                                 _external=True, **kwargs)
+        else:
+            rv['next'] = None
+        rv['first'] = url_for(request.endpoint, after='',
+                              per_page=per_page, _external=True,
+                              **kwargs)
+        fieldset = get_fieldset()
+        rv['items'] = [item.serialize(**fieldset) for item in items]
+        headers = {headers_prefix + 'Page-Next': rv['next']}
+        if 'count' in rv:
+            headers[headers_prefix + 'Page-Item-Count'] = rv['count']
+        return rv, headers
 
     @functools.wraps(f)
     def wrapped(*args, **kwargs):
@@ -80,8 +114,13 @@ def paginate(f=None, *, max_per_page=20, headers_prefix='DO-'):
         per_page = min(request.args.get('per_page', max_per_page,
                                         type=int), max_per_page)
         query = f(*args, **kwargs)
-        p = query.paginate(page, per_page)
+        after = request.args.get('after')
+        if after is not None:
+            return keyset_page(query, after, per_page, kwargs)
+        p, estimated = counts.paginate(query, page, per_page, estimate_count)
         rv = {'page': page, 'per_page': per_page, 'count': p.total}
+        if estimated:
+            rv['estimated'] = True
         if p.has_prev:
             rv['prev'] = url_for(request.endpoint, page=p.prev_num,
                                  per_page=per_page,
@@ -100,7 +139,8 @@ def paginate(f=None, *, max_per_page=20, headers_prefix='DO-'):
         rv['last'] = url_for(request.endpoint, page=p.pages,
                              per_page=per_page, _external=True,
                              **kwargs)
-        rv['items'] = [item.serialize() for item in p.items]
+        fieldset = get_fieldset()
+        rv['items'] = [item.serialize(**fieldset) for item in p.items]
         headers = {
             headers_prefix + 'Page-Current': page,
             headers_prefix + 'Page-Prev': rv['prev'],
@@ -119,78 +159,28 @@ def async(f):
     return wrapper
 
 
-_limiter = None
-
-
-class MemRateLimit(object):
-    """Rate limiter that uses a Python dictionary as storage."""
-    def __init__(self):
-        self.counters = {}
-
-    def is_allowed(self, key, limit, period):
-        """Check if the client's request should be allowed, based on the
-        hit counter. Returns a 3-element tuple with a True/False result,
-        the number of remaining hits in the period, and the time the
-        counter resets for the next period.
-
-        :param period:
-        :param limit:
-        :param key:
-        """
-        now = int(time())
-        begin_period = now // period * period
-        end_period = begin_period + period
-
-        self.cleanup(now)
-        if key in self.counters:
-            self.counters[key]['hits'] += 1
-        else:
-            self.counters[key] = {'hits': 1, 'reset': end_period}
-        allow = True
-        remaining = limit - self.counters[key]['hits']
-        if remaining < 0:
-            remaining = 0
-            allow = False
-        return allow, remaining, self.counters[key]['reset']
-
-    def cleanup(self, now):
-        """Eliminate expired keys."""
-        for key, value in list(self.counters.items()):
-            if value['reset'] < now:
-                del self.counters[key]
-
-
 def rate_limit(limit, period):
     """Limits the rate at which clients can send requests to 'limit' requests
-    per 'period' seconds. Once a client goes over the limit all requests are
-    answered with a status code 429 Too Many Requests for the remaining of
-    that period.
+    per 'period' seconds, with a token bucket, see :mod:`app.core.ratelimit`.
+    Clients over the limit are answered with a status code 429 Too Many
+    Requests until their bucket refills.
 
     :param period:
     :param limit:
     """
     def decorator(f):
+        # Counters are maintained for each decorated function and client
+        scope = '{0}.{1}'.format(f.__module__, f.__name__)
+
         @functools.wraps(f)
         def wrapped(*args, **kwargs):
-            # initialize the rate limiter the first time here
-            global _limiter
-            if _limiter is None:
-                _limiter = MemRateLimit()
-
-            # generate a unique key to represent the decorated function and
-            # the IP address of the client. Rate limiting counters are
-            # maintained on each unique key.
-            key = '{0}/{1}'.format(f.__name__, request.remote_addr)
-            allowed, remaining, reset = _limiter.is_allowed(key, limit,
-                                                            period)
-
-            # set the rate limit headers in g, so that they are picked up
-            # by the after_request handler and attached to the response
-            g.headers = {
-                'DO-RateLimit-Remaining': str(remaining),
-                'DO-RateLimit-Limit': str(limit),
-                'DO-RateLimit-Reset': str(reset)
-            }
+            if not current_app.config.get('RATELIMIT_ENABLED', True):
+                return f(*args, **kwargs)
+            allowed, headers = ratelimit.hit(scope, limit, period)
+
+            # set the rate limit headers in g, so that they are attached
+            # to the response by FlaskApi.process_response
+            g.rate_limit_headers = headers
 
             # if the client went over the limit respond with a 429 status
             # code, else invoke the wrapped function
@@ -1,7 +1,7 @@
 from flask import request, redirect, url_for
 from flask_jsonschema import validate
 from app import db
-from app.core import ApiResponse
+from app.core import ApiResponse, caching
 from app.models import Deliverable
 from . import api
 
@@ -38,6 +38,8 @@ def get_deliverables():
           ]
         }
 
+    :query fields: Comma separated list of attributes to return
+    :query expand: Comma separated list of relationships to return
     :reqheader Accept: Content type(s) accepted by the client
     :resheader Content-Type: this depends on `Accept` header or request
 
@@ -48,8 +50,8 @@ def get_deliverables():
     :status 200: Deliverable endpoint found, response may be empty
     :status 404: Not found
     """
-    deliverables = Deliverable.query.all()
-    return ApiResponse({'deliverables': [o.serialize() for o in deliverables]})
+    deliverables = caching.cached_query(Deliverable.query)
+    return ApiResponse({'deliverables': deliverables})
 
 
 @api.route('/deliverables/<int:deliverable_id>', methods=['GET'])
@@ -1,9 +1,10 @@
 from flask import request, redirect, url_for
 from flask_jsonschema import validate
 from app import db
-from app.core import ApiResponse
+from app.core import ApiResponse, ApiStreamResponse, wants_ndjson
 from app.models import Fqdn
 from . import api
+from .bulk import validate_bulk, bulk_create
 
 
 @api.route('/fqdns', methods=['GET'])
@@ -35,7 +36,11 @@ def get_fqdns():
           ]
         }
 
-    :reqheader Accept: Content type(s) accepted by the client
+    :query fields: Comma separated list of attributes to return
+    :query expand: Comma separated list of relationships to return
+    :reqheader Accept: Content type(s) accepted by the client.
+        With ``application/x-ndjson`` items are streamed, one JSON
+        object per line.
     :resheader Content-Type: this depends on `Accept` header or request
 
     :>json array fqdns: List of available fully qualified domain name objects
@@ -46,8 +51,10 @@ def get_fqdns():
     :status 404: Not found
     """
     fqdns = Fqdn.query.filter(
-        Fqdn.deleted == 0).all()
-    return ApiResponse({'fqdns': [f.serialize() for f in fqdns]})
+        Fqdn.deleted == 0)
+    if wants_ndjson():
+        return ApiStreamResponse(fqdns)
+    return ApiResponse({'fqdns': fqdns.all()})
 
 
 @api.route('/fqdns/<int:fqdn_id>', methods=['GET'])
@@ -153,10 +160,13 @@ def get_fqdn_by_name(fqdn):
 
 
 @api.route('/fqdns', methods=['POST', 'PUT'])
-@validate('fqdns', 'add_fqdn')
+@validate_bulk('fqdns', 'add_fqdn')
 def add_fqdn():
     """Add fully qualified domain name
 
+    Send an array of objects to add several FQDNs at once. Invalid
+    items are skipped and reported in ``errors``.
+
     **Example request**:
 
     .. sourcecode:: http
@@ -187,6 +197,7 @@ def add_fqdn():
           "message": "Fqdn added"
         }
 
+    :query strict: Add nothing if any item of an array is invalid
     :reqheader Accept: Content type(s) accepted by the client
     :resheader Content-Type: this depends on `Accept` header or request
 
@@ -200,7 +211,10 @@ def add_fqdn():
 
     :status 201: FQDN successfully saved
     :status 400: Bad request
+    :status 422: No item of the array could be added
     """
+    if isinstance(request.json, list):
+        return bulk_create(Fqdn, request.json, 'fqdns', 'add_fqdn')
     f = Fqdn().from_json(request.json)
     db.session.add(f)
     db.session.commit()
@@ -6,9 +6,12 @@
 from flask import request, redirect, url_for
 from flask_jsonschema import validate
 from app import db
-from app.core import ApiResponse
+from app.core import ApiResponse, ApiStreamResponse, wants_ndjson
+from app.core import query_etag
 from app.models import IpRange
+from app.constituency import ip_range_conflicts
 from . import api
+from .bulk import validate_bulk, bulk_create
 
 
 @api.route('/ip_ranges', methods=['GET'])
@@ -44,7 +47,13 @@ def get_ip_ranges():
           ]
         }
 
-    :reqheader Accept: Content type(s) accepted by the client
+    :query fields: Comma separated list of attributes to return
+    :query expand: Comma separated list of relationships to return
+    :reqheader Accept: Content type(s) accepted by the client.
+        With ``application/x-ndjson`` items are streamed, one JSON
+        object per line.
+    :reqheader If-None-Match: ``ETag`` of a previously returned list
+    :resheader ETag: Weak entity tag of the list
     :resheader Content-Type: this depends on `Accept` header or request
 
     :>json array ip_ranges: List of IP ranges
@@ -52,10 +61,14 @@ def get_ip_ranges():
     :>jsonarr string ip_range: CIDR IP range
 
     :status 200: IP ranges endpoint found, response may be empty
+    :status 304: Not modified since the previous request
     :status 404: Not found
     """
-    ips = IpRange.query.all()
-    return ApiResponse({'ip_ranges': [r.serialize() for r in ips]})
+    ips = IpRange.query
+    if wants_ndjson():
+        return ApiStreamResponse(ips)
+    etag = query_etag(ips)
+    return ApiResponse({'ip_ranges': ips.all()}, etag=etag)
 
 
 @api.route('/ip_ranges/<int:range_id>', methods=['GET'])
@@ -100,10 +113,13 @@ def get_ip_range(range_id):
 
 @api.route('/ip_ranges', methods=['POST', 'PUT'])
 @api.route('/ip-ranges', methods=['POST', 'PUT'])
-@validate('ip_ranges', 'add_ip_range')
+@validate_bulk('ip_ranges', 'add_ip_range')
 def add_ip_range():
     """Add new IP range. Accepts :http:method:`POST` or :http:method:`PUT`.
 
+    Send an array of objects to add several IP ranges at once. Invalid
+    items are skipped and reported in ``errors``.
+
     **Example request**:
 
     .. sourcecode:: http
@@ -147,6 +163,7 @@ def add_ip_range():
           "validator": "required"
         }
 
+    :query strict: Add nothing if any item of an array is invalid
     :reqheader Accept: Content type(s) accepted by the client
     :resheader Content-Type: this depends on `Accept` header or request
 
@@ -160,7 +177,10 @@ def add_ip_range():
 
     :status 200: CIDR IP range was successfully added
     :status 400: Bad request
+    :status 422: No item of the array could be added
     """
+    if isinstance(request.json, list):
+        return bulk_create(IpRange, request.json, 'ip_ranges', 'add_ip_range')
     i = IpRange().from_json(request.json)
     db.session.add(i)
     db.session.commit()
@@ -269,3 +289,95 @@ def delete_ip_range(range_id):
     db.session.add(i)
     db.session.commit()
     return ApiResponse({'message': 'IP range deleted'})
+
+
+@api.route('/ip_ranges/conflicts', methods=['GET'])
+@api.route('/ip-ranges/conflicts', methods=['GET'])
+def get_ip_range_conflicts():
+    """Return conflicting IP ranges of all organizations
+
+    When IP ranges overlap, :http:put:`/api/1.0/organizations/check`
+    attributes IP addresses to the organization registering the most
+    specific range. Identical ranges are attributed to the organization
+    with the lowest ID.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+        GET /api/1.0/ip-ranges/conflicts HTTP/1.1
+        Host: do.cert.europa.eu
+        Accept: application/json
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {
+          "duplicates": [
+            [
+              {
+                "id": 12,
+                "ip_range": "212.8.189.16/28",
+                "organization": "CERT-EU",
+                "organization_id": 1
+              },
+              {
+                "id": 34,
+                "ip_range": "212.8.189.16/28",
+                "organization": "EC",
+                "organization_id": 2
+              }
+            ]
+          ],
+          "invalid": [],
+          "nested": [
+            {
+              "enclosing": {
+                "id": 56,
+                "ip_range": "212.8.189.0/24",
+                "organization": "EC",
+                "organization_id": 2
+              },
+              "ip_range": {
+                "id": 12,
+                "ip_range": "212.8.189.16/28",
+                "organization": "CERT-EU",
+                "organization_id": 1
+              }
+            }
+          ],
+          "overlaps": [],
+          "unreachable": [
+            {
+              "ip_range": {
+                "id": 34,
+                "ip_range": "212.8.189.16/28",
+                "organization": "EC",
+                "organization_id": 2
+              },
+              "reason": "duplicate"
+            }
+          ]
+        }
+
+    :reqheader Accept: Content type(s) accepted by the client
+    :resheader Content-Type: this depends on `Accept` header or request
+
+    :>json array invalid: IP ranges which are not valid CIDR networks
+    :>json array duplicates: Groups of identical IP ranges
+    :>json array overlaps: IP ranges inside a larger IP range of the same
+        organization
+    :>json array nested: IP ranges inside a larger IP range of another
+        organization. Only the most specific enclosing range is reported.
+    :>json array unreachable: IP ranges that are never matched. ``reason``
+        is ``duplicate`` when the range is registered by an organization
+        with a lower ID, or ``covered`` when more specific ranges cover
+        all of its addresses.
+
+    :status 200: Conflicts report
+    """
+    return ApiResponse(ip_range_conflicts())
@@ -1,6 +1,6 @@
 from flask import request, redirect, url_for
 from flask_jsonschema import validate
-from app.core import ApiResponse
+from app.core import ApiResponse, caching
 from app import db
 from app.models import OrganizationGroup
 from . import api
@@ -46,6 +46,8 @@ def get_groups():
           ]
         }
 
+    :query fields: Comma separated list of attributes to return
+    :query expand: Comma separated list of relationships to return
     :reqheader Accept: Content type(s) accepted by the client
     :resheader Content-Type: this depends on `Accept` header or request
 
@@ -56,10 +58,10 @@ def get_groups():
     :status 200: Group endpoint found, response may be empty
     :status 404: Not found
     """
-    groups = OrganizationGroup.query.filter(
-        OrganizationGroup.deleted == 0).all()
+    groups = caching.cached_query(OrganizationGroup.query.filter(
+        OrganizationGroup.deleted == 0))
     return ApiResponse(
-        {'organization_groups': [o.serialize() for o in groups]})
+        {'organization_groups': groups})
 
 
 @api.route('/organization_groups/<int:group_id>', methods=['GET'])
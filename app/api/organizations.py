@@ -1,11 +1,18 @@
-import ipaddress
-from flask import request, redirect, url_for, current_app
+import os
+import uuid
+from flask import request, redirect, url_for, current_app, send_file
 from flask_jsonschema import validate
-from sqlalchemy.exc import IntegrityError
-from app.core import ApiResponse, ApiException
+from app.core import ApiResponse, ApiStreamResponse, ApiException
+from app.core import wants_ndjson
 from . import api
+from .errors import not_modified
 from ..import db
 from ..models import Organization, Email, ContactEmail
+from ..constituency import ip_index, fqdn_index, asn_index, asn_table
+from ..constituency import snapshot_index, parse_timestamp
+from ..utils.mixins import get_fieldset
+from ..utils.suffixtrie import hostname
+from ..tasks import classify
 
 
 @api.route('/organizations', methods=['GET'])
@@ -67,7 +74,11 @@ def get_organizations():
           ]
         }
 
-    :reqheader Accept: Content type(s) accepted by the client
+    :query fields: Comma separated list of attributes to return
+    :query expand: Comma separated list of relationships to return
+    :reqheader Accept: Content type(s) accepted by the client.
+        With ``application/x-ndjson`` items are streamed, one JSON
+        object per line.
     :reqheader API-Authorization: API key. If present authentication and
         authorization will be attempted.
     :resheader Content-Type: this depends on `Accept` header or request
@@ -85,8 +96,103 @@ def get_organizations():
     :status 403: Access denied. Authorization will not help and the request
         SHOULD NOT be repeated.
     """
-    orgs = Organization.query.all()
-    return ApiResponse({'organizations': [o.serialize() for o in orgs]})
+    orgs = Organization.query.options(
+        *Organization.eager_options(**get_fieldset()))
+    if wants_ndjson():
+        return ApiStreamResponse(orgs)
+    return ApiResponse({'organizations': orgs.all()})
+
+
+@api.route('/organizations/snapshot', methods=['GET'])
+def get_organizations_snapshot():
+    """Return a compact snapshot of the constituency, for clients keeping
+    a local copy of all organizations.
+
+    The response carries an ``ETag`` header. Clients polling for changes
+    should send it back in ``If-None-Match`` and will receive
+    ``304 Not Modified`` if nothing changed.
+    Use the returned ``timestamp`` as ``since`` argument of the next
+    request to only download organizations changed after it.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+        GET /api/1.0/organizations/snapshot?since=2017-01-01T10:00:00 HTTP/1.1
+        Host: do.cert.europa.eu
+        Accept: application/json
+        If-None-Match: "0b5e5fc2d3a6b3b8e7c6e7e43a3c1d3a1a4b8f0e"
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+        ETag: "8d1e0f6e94a1b0c7a5d8e7f6a5b4c3d2e1f0a9b8"
+
+        {
+          "deleted": [
+            12
+          ],
+          "organizations": [
+            {
+              "abbreviation": "CERT-EU",
+              "abuse_emails": [
+                "cert-eu@ec.europa.eu"
+              ],
+              "asns": [
+                5400
+              ],
+              "contact_emails": [
+                "cert-eu@ec.europa.eu"
+              ],
+              "fqdns": [
+                "cert.europa.eu"
+              ],
+              "full_name": "Computer Emergency Response Team",
+              "group_id": 1,
+              "id": 1,
+              "ip_ranges": [
+                "212.8.189.16/28"
+              ],
+              "is_sla": 1,
+              "mail_template": "EnglishReport",
+              "mail_times": 3600
+            }
+          ],
+          "timestamp": "2017-01-02T10:23:12"
+        }
+
+    :reqheader Accept: Content type(s) accepted by the client
+    :reqheader API-Authorization: API key. If present authentication and
+        authorization will be attempted.
+    :reqheader If-None-Match: ETag of a previously returned snapshot
+    :resheader Content-Type: this depends on `Accept` header or request
+    :resheader ETag: Snapshot content hash
+
+    :query since: Only return organizations changed since this UTC
+        timestamp (ISO 8601)
+
+    :>json array organizations: Organizations
+    :>json array deleted: IDs of organizations deleted since ``since``.
+        Only present if ``since`` was given.
+    :>json string timestamp: Time of the last change included in the
+        snapshot
+
+    :status 200: Snapshot
+    :status 304: Snapshot did not change
+    :status 400: Invalid ``since`` timestamp
+    """
+    since = request.args.get('since')
+    if since:
+        since = parse_timestamp(since)
+    body, etag = snapshot_index.export(since or None)
+    if request.if_none_match.contains_weak(etag):
+        response = not_modified()
+        response.set_etag(etag)
+        return response
+    return ApiResponse(body, headers={'ETag': '"{}"'.format(etag)})
 
 
 @api.route('/organizations/<int:org_id>', methods=['GET'])
@@ -176,7 +282,8 @@ def get_organization(org_id):
     :status 403: Access denied. Authorization will not help and the request
         SHOULD NOT be repeated.
     """
-    o = Organization.query.get_or_404(org_id)
+    o = Organization.query.options(
+        *Organization.eager_options()).get_or_404(org_id)
     return ApiResponse(o.serialize())
 
 
@@ -268,7 +375,8 @@ def get_organization_by_abbr(org_abbr):
     :status 403: Access denied. Authorization will not help and the request
         SHOULD NOT be repeated.
     """
-    o = Organization.query.filter_by(abbreviation=org_abbr).first_or_404()
+    o = Organization.query.options(*Organization.eager_options()).\
+        filter_by(abbreviation=org_abbr).first_or_404()
     return ApiResponse(o.serialize())
 
 
@@ -507,38 +615,13 @@ def update_organization(org_id):
         return redirect(url_for('api.add_organization'))
     contact_emails = request.json.pop('contact_emails', [])
     abuse_emails = request.json.pop('abuse_emails', [])
+    ip_ranges = request.json.pop('ip_ranges', None)
+    asns = request.json.pop('asns', None)
+    fqdns = request.json.pop('fqdns', None)
     o.from_json(request.json)
-    for c in o.contact_emails:
-        try:
-            Email.query.filter_by(email=c.email).delete()
-        except IntegrityError as ie:
-            #: Key constrain, this email is also used as abuse email
-            current_app.log.debug(ie)
-            current_app.log.debug(
-                'Not deleting {}. '
-                'It\'s also used as abuse email'.format(c.email))
-    o.contact_emails = []
-
-    for ac in o.abuse_emails:
-        try:
-            Email.query.filter_by(email=ac).delete()
-        except IntegrityError as ie:
-            #: Key constrain, this email is also used as contact email
-            current_app.log.debug(ie)
-            current_app.log.debug(
-                'Not deleting {}. '
-                'It\'s also used as contact email'.format(ac))
-    o.abuse_emails = []
-
-    for ac in abuse_emails:
-        o.abuse_emails.append(ac)
-
-    for e in contact_emails:
-        cp = e.get('cp', 0)
-        o.contact_emails.append(
-            ContactEmail(
-                email_=Email(email=e['email']),
-                cp=cp))
+    o.update_collections(ip_ranges=ip_ranges, asns=asns, fqdns=fqdns,
+                         abuse_emails=abuse_emails,
+                         contact_emails=contact_emails)
 
     db.session.add(o)
     db.session.commit()
@@ -611,7 +694,9 @@ def query():
 @api.route('/organizations/check', methods=['PUT'])
 @validate('organizations', 'check')
 def check_constituents():
-    """Search to which organization does a specific IP address belongs
+    """Search to which organization does a specific IP address belongs.
+    When ranges of several organizations overlap the organization owning
+    the most specific range is returned.
 
     **Example request**:
 
@@ -660,17 +745,353 @@ def check_constituents():
         SHOULD NOT be repeated.
     """
     rv = {}
-    orgs = Organization.query.all()
-    if not orgs:
+    index = ip_index.get()
+    for ip in request.json:
+        abbreviation = index.lookup(ip)
+        if abbreviation is not None:
+            rv[ip] = abbreviation
+    if rv:
+        return ApiResponse({'response': rv})
+    else:
         return ApiResponse({}, 204)
-    for o in orgs:
-        for cidr in o.ip_ranges:
-            cidr_range = ipaddress.ip_network(cidr, strict=False)
-            for ip in request.json:
-                ipa = ipaddress.ip_address(ip.strip())
-                if ipa in cidr_range:
-                    rv[ip] = o.abbreviation
+
+
+@api.route('/organizations/check/fqdns', methods=['PUT'])
+@validate('organizations', 'check')
+def check_fqdns():
+    """Search to which organization do specific hostnames or URLs belong.
+    Hostnames are matched against the registered FQDNs on whole labels;
+    the organization owning the longest matching FQDN is returned.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+        PUT /api/1.0/organizations/check/fqdns HTTP/1.1
+        Host: do.cert.europa.eu
+        Accept: application/json
+        Content-Type: application/json
+
+        [
+          "https://www.cert.europa.eu/cert/newsletter/en/latest.html",
+          "cert.europa.eu",
+          "example.com"
+        ]
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {
+          "response": {
+            "https://www.cert.europa.eu/cert/newsletter/en/latest.html":
+              "CERT-EU",
+            "cert.europa.eu": "CERT-EU"
+          }
+        }
+
+    :reqheader Accept: Content type(s) accepted by the client
+    :reqheader API-Authorization: API key. If present authentication and
+            authorization will be attempted.
+    :resheader Content-Type: this depends on `Accept` header or request
+
+    :<jsonarr string url: Hostnames or URLs to check
+    :>json object response: Dictonary of hostname or URL and organization
+        abbreviation
+
+    :status 200: Organizations or empty object
+    :status 401: Authorization failure. The client MAY repeat the request with
+        a suitable API-Authorization header field. If the request already
+        included Authorization credentials, then the 401 response indicates
+        that authorization has been refused for those credentials.
+    :status 403: Access denied. Authorization will not help and the request
+        SHOULD NOT be repeated.
+    """
+    rv = {}
+    index = fqdn_index.get()
+    for url in request.json:
+        name = hostname(url)
+        if name is None:
+            continue
+        abbreviation = index.lookup(name)
+        if abbreviation is not None:
+            rv[url] = abbreviation
     if rv:
         return ApiResponse({'response': rv})
     else:
         return ApiResponse({}, 204)
+
+
+@api.route('/organizations/check/asns', methods=['PUT'])
+@validate('organizations', 'check')
+def check_asns():
+    """Search to which AS and organization do specific IP addresses belong.
+    IP addresses are mapped to their origin AS using the prefix table set in
+    the ``ASN_DB_PATH`` configuration option, then to the organization
+    owning the AS. This allows attributing IP addresses that are not part
+    of any registered IP range.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+        PUT /api/1.0/organizations/check/asns HTTP/1.1
+        Host: do.cert.europa.eu
+        Accept: application/json
+        Content-Type: application/json
+
+        [
+          "212.8.189.19",
+          "1.1.1.1",
+          "127.0.0.1"
+        ]
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {
+          "response": {
+            "1.1.1.1": {
+              "asn": 13335,
+              "organization": null
+            },
+            "212.8.189.19": {
+              "asn": 5400,
+              "organization": "CERT-EU"
+            }
+          }
+        }
+
+    :reqheader Accept: Content type(s) accepted by the client
+    :reqheader API-Authorization: API key. If present authentication and
+            authorization will be attempted.
+    :resheader Content-Type: this depends on `Accept` header or request
+
+    :<jsonarr string ip_address: IP addresses to check
+    :>json object response: Dictonary of IP and AS details
+    :>jsonobj integer asn: Origin AS number
+    :>jsonobj string organization: Organization abbreviation or ``null``
+
+    :status 200: AS details or empty object
+    :status 401: Authorization failure. The client MAY repeat the request with
+        a suitable API-Authorization header field. If the request already
+        included Authorization credentials, then the 401 response indicates
+        that authorization has been refused for those credentials.
+    :status 403: Access denied. Authorization will not help and the request
+        SHOULD NOT be repeated.
+    :status 501: AS lookups are not configured
+    """
+    table = asn_table.get()
+    if table is None:
+        raise ApiException('AS lookups are not configured', status=501)
+    rv = {}
+    orgs = asn_index.get()
+    for ip in request.json:
+        asn = table.lookup(ip)
+        if asn is not None:
+            rv[ip] = {'asn': asn, 'organization': orgs.get(asn)}
+    if rv:
+        return ApiResponse({'response': rv})
+    else:
+        return ApiResponse({}, 204)
+
+
+@api.route('/organizations/check/jobs', methods=['POST'])
+def add_check_job():
+    """Upload a feed file to be attributed to organizations in the
+    background. Use this instead of :http:put:`/api/1.0/organizations/check`
+    for large feeds.
+
+    Each indicator (IP address, URL, hostname or e-mail address) is
+    attributed using the IP ranges, AS numbers and FQDNs of organizations.
+    Progress can be followed via
+    :http:get:`/api/1.0/organizations/check/jobs/(uuid:job_id)`.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+        POST /api/1.0/organizations/check/jobs HTTP/1.1
+        Host: do.cert.europa.eu
+        Accept: application/json
+        Content-Type: multipart/form-data; boundary=----FormBoundaryklDA9
+
+        ------FormBoundaryklDA9
+        Content-Disposition: form-data; name="format"
+
+        csv
+        ------FormBoundaryklDA9
+        Content-Disposition: form-data; name="file"; filename="feed.csv"
+        Content-Type: text/csv
+
+        212.8.189.19,2017-01-01T00:00:00
+        https://cert.europa.eu/phishing,2017-01-01T00:00:00
+        ------FormBoundaryklDA9--
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+        HTTP/1.0 202 ACCEPTED
+        Content-Type: application/json
+        Location: /api/1.0/organizations/check/jobs/3a6b3c1e-5b63-4d8e-...
+
+        {
+          "job": {
+            "id": "3a6b3c1e-5b63-4d8e-9d1e-2b1bbbd3c2a1",
+            "state": "PENDING",
+            ...
+          },
+          "message": "Job created"
+        }
+
+    :reqheader Accept: Content type(s) accepted by the client
+    :reqheader Content-Type: multipart/form-data required
+    :resheader Content-Type: this depends on `Accept` header or request
+
+    :form file: CSV or NDJSON feed file
+    :form format: ``csv`` or ``ndjson``. Default is guessed from file
+        extension (``.ndjson``, ``.jsonl``), falling back to ``csv``
+    :form field: CSV column index (default ``0``) or NDJSON object key
+        (default ``indicator``). NDJSON lines can also be plain strings.
+    :form header: ``1`` to skip the first CSV row, holding column names
+    :>json object job: Job status
+    :>json string message: Status message
+
+    :status 202: Job created
+    :status 400: Bad request
+    """
+    file = request.files.get('file')
+    if file is None:
+        raise ApiException('No file uploaded')
+    fmt = request.form.get('format')
+    if fmt is None:
+        ext = os.path.splitext(file.filename or '')[1].lower()
+        fmt = 'ndjson' if ext in ('.ndjson', '.jsonl') else 'csv'
+    if fmt not in classify.FORMATS:
+        raise ApiException('Unsupported format: {}'.format(fmt))
+    field = request.form.get('field')
+    if fmt == 'csv' and field is not None:
+        try:
+            field = int(field)
+        except ValueError:
+            field = -1
+        if field < 0:
+            raise ApiException('CSV field must be a column index')
+    header = request.form.get('header', '').lower() in ('1', 'true', 'yes')
+    job_id = str(uuid.uuid4())
+    status = classify.create_job(job_id, file, fmt, field, header)
+    classify.classify_indicators.apply_async(args=[job_id], task_id=job_id)
+    return ApiResponse(
+        {'job': classify.read_status(job_id) or status,
+         'message': 'Job created'},
+        202,
+        {'Location': url_for('api.get_check_job', job_id=job_id)})
+
+
+@api.route('/organizations/check/jobs/<uuid:job_id>', methods=['GET'])
+def get_check_job(job_id):
+    """Return status of a bulk classification job
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+        GET /api/1.0/organizations/check/jobs/3a6b3c1e-... HTTP/1.1
+        Host: do.cert.europa.eu
+        Accept: application/json
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {
+          "attributed": 1,
+          "created": "2017-01-01T10:00:00.000000",
+          "field": null,
+          "filename": "feed.csv",
+          "format": "csv",
+          "id": "3a6b3c1e-5b63-4d8e-9d1e-2b1bbbd3c2a1",
+          "organizations": {
+            "CERT-EU": 1
+          },
+          "processed": 2,
+          "read": 88,
+          "result": "https://do.cert.europa.eu/api/1.0/organizations/...",
+          "size": 88,
+          "state": "SUCCESS"
+        }
+
+    :param job_id: Job unique ID
+
+    :reqheader Accept: Content type(s) accepted by the client
+    :resheader Content-Type: this depends on `Accept` header or request
+
+    :>json string id: Job unique ID
+    :>json string state: ``PENDING``, ``PROGRESS``, ``SUCCESS`` or
+        ``FAILURE``
+    :>json integer size: Size of the feed file, in bytes
+    :>json integer read: Bytes processed so far
+    :>json integer processed: Number of indicators processed so far
+    :>json integer attributed: Number of indicators attributed so far
+    :>json object organizations: Number of indicators per organization.
+        Available when the job is done.
+    :>json string result: Result download URL. Available when the job
+        is done.
+    :>json string error: Error message if the job failed
+
+    :status 200: Job status
+    :status 404: Job not found or expired
+    """
+    status = classify.read_status(job_id)
+    if status is None:
+        raise ApiException('Job not found', 404)
+    if status['state'] == 'SUCCESS':
+        status['result'] = url_for(
+            'api.get_check_job_result', job_id=job_id, _external=True)
+    return ApiResponse(status)
+
+
+@api.route('/organizations/check/jobs/<uuid:job_id>/result', methods=['GET'])
+def get_check_job_result(job_id):
+    """Download bulk classification job results.
+    Results are a ZIP archive with one ``<abbreviation>.csv`` file
+    (columns: indicator, type) for each organization. Indicators that could
+    not be attributed are listed in ``_unattributed.csv``.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+        GET /api/1.0/organizations/check/jobs/3a6b3c1e-.../result HTTP/1.1
+        Host: do.cert.europa.eu
+        Accept: application/json
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Disposition: attachment; filename=3a6b3c1e-....zip
+        Content-Type: application/zip
+
+    :param job_id: Job unique ID
+
+    :status 200: Results archive
+    :status 404: Job not found, expired or not done yet
+    """
+    path = classify.job_path(job_id, 'zip')
+    if classify.read_status(job_id) is None or not os.path.isfile(path):
+        raise ApiException('Results not available', 404)
+    return send_file(path, as_attachment=True,
+                     attachment_filename=os.path.basename(path))
@@ -69,11 +69,13 @@ def get_reports():
     :>jsonarr string created: Report date
     :>jsonarr string type: Type of report. On of: Static analysis,
         AntiVirus scan, Dynamic analysis
+    :>json integer count: Total number of items
+    :>json boolean estimated: Present if ``count`` is an estimate
 
     :status 200: IP ranges endpoint found, response may be empty
     :status 404: Not found
     """
-    return ApiPagedResponse(Report.query)
+    return ApiPagedResponse(Report.query, estimate_count=True)
 
 
 @api.route('/reports/<int:report_id>', methods=['GET'])
@@ -105,6 +107,7 @@ def get_report(report_id):
     :param report_id: Report unique ID
 
     :reqheader Accept: Content type(s) accepted by the client
+    :resheader Cache-Control: Reports never change and may be cached
     :resheader Content-Type: this depends on `Accept` header or request
 
     :>jsonarr integer id: Report unique ID
@@ -117,7 +120,7 @@ def get_report(report_id):
     :status 404: Resource not found
     """
     i = Report.query.get_or_404(report_id)
-    return ApiResponse(i.serialize())
+    return ApiResponse(i.serialize(), immutable=True)
 
 
 @api.route('/reports/<string:sha256>', methods=['GET'])
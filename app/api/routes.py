@@ -9,8 +9,10 @@
 import os
 from app import gpg
 from app.core import ApiResponse, ApiException
+from app.core.uploads import UploadSession
 from app.tasks import send_to_ks
-from flask import current_app, request
+from app.utils import remove_file
+from flask import current_app, request, g, url_for
 from flask_jsonschema import validate
 from werkzeug.utils import secure_filename
 from . import api
@@ -117,6 +119,8 @@ def upload():
     E.i. files created by CERT-EU
 
     E.g. CITAR, CIMBL, IDS signatures, etc.
+    Large files can be sent in chunks with resumable uploads, see
+    :http:post:`/api/1.0/uploads`.
 
     **Example request**:
 
@@ -168,6 +172,112 @@ def upload():
     }, 201)
 
 
+@api.route('/uploads', methods=['POST'])
+def add_upload():
+    """Start a resumable upload of a large trusted file.
+    Chunks are sent and the upload is completed as for samples, see
+    :http:post:`/api/1.0/samples/uploads`.
+
+    :<json string filename: File name
+    :<json integer size: File size in bytes
+    :>json string id: Upload unique ID
+    :>json integer offset: Number of bytes received
+
+    :status 201: Upload started
+    :status 400: Missing file name or invalid size
+    :status 413: File larger than ``UPLOAD_MAX_SIZE``
+    """
+    upload = UploadSession.create('files', g.user.id, request.get_json())
+    return ApiResponse(
+        upload.serialize(), 201,
+        {'Location': url_for('api.get_upload', upload_id=upload.id)})
+
+
+@api.route('/uploads/<string:upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """Return the state of a resumable upload.
+    See :http:get:`/api/1.0/samples/uploads/(string:upload_id)`.
+
+    :param upload_id: Upload unique ID
+
+    :>json integer offset: Number of bytes received
+
+    :status 200: Upload found
+    :status 404: Upload not found or expired
+    """
+    upload = UploadSession.get('files', upload_id, g.user.id)
+    return ApiResponse(upload.serialize())
+
+
+@api.route('/uploads/<string:upload_id>', methods=['PUT'])
+def update_upload(upload_id):
+    """Send a chunk of a resumable upload.
+    See :http:put:`/api/1.0/samples/uploads/(string:upload_id)`.
+
+    :param upload_id: Upload unique ID
+
+    :reqheader Content-Range: Byte range of the chunk and file size
+    :>json integer offset: Number of bytes received
+
+    :status 200: Chunk saved
+    :status 400: Invalid ``Content-Range``
+    :status 404: Upload not found or expired
+    :status 409: The chunk does not start at the current offset
+    """
+    upload = UploadSession.get('files', upload_id, g.user.id)
+    offset = upload.write(request.headers.get('Content-Range'),
+                          request.stream)
+    return ApiResponse({'message': 'Chunk saved', 'offset': offset})
+
+
+@api.route('/uploads/<string:upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    """Complete a resumable upload. The file is saved as with
+    :http:post:`/api/1.0/upload`, and can then be added with
+    :http:post:`/api/1.0/files`.
+
+    :param upload_id: Upload unique ID
+
+    :>json array files: List of files saved to disk
+    :>json string message: Status message
+
+    :status 201: File saved
+    :status 400: Invalid file name
+    :status 404: Upload not found or expired
+    :status 409: Some bytes were not received yet
+    """
+    upload = UploadSession.get('files', upload_id, g.user.id)
+    filename = secure_filename(upload.filename)
+    if not filename:
+        raise ApiException('Invalid file name: {}'.format(upload.filename))
+    upload.finalize()
+    try:
+        os.replace(upload.path,
+                   os.path.join(current_app.config['APP_UPLOADS'], filename))
+    except OSError:
+        # The session is gone, so the part file could not be resumed
+        remove_file(upload.path)
+        raise
+    return ApiResponse({
+        'message': 'Files uploaded',
+        'files': [filename]
+    }, 201)
+
+
+@api.route('/uploads/<string:upload_id>', methods=['DELETE'])
+def delete_upload(upload_id):
+    """Abort a resumable upload.
+    See :http:delete:`/api/1.0/samples/uploads/(string:upload_id)`.
+
+    :param upload_id: Upload unique ID
+
+    :status 200: Upload deleted
+    :status 404: Upload not found or expired
+    """
+    UploadSession.get('files', upload_id, g.user.id).delete()
+    return ApiResponse({'message': 'Upload deleted'})
+
+
 @api.route('/search-keys', methods=['POST'])
 def search_public_ks(email=None):
     """Search GPG keys on public keyserver pool.
@@ -5,12 +5,13 @@
 """
 from sqlalchemy import or_
 import os
-from flask import request, current_app, g, send_file
+from flask import request, current_app, g, send_file, url_for
 from app.core import ApiResponse, ApiPagedResponse
+from app.core.uploads import UploadSession
 from app import db
 from app.models import Sample
 from app.tasks import analysis
-from app.utils import get_hashes
+from app.utils import save_sample, store_sample, remove_file
 from . import api
 
 
@@ -77,11 +78,12 @@ def get_samples():
     :>json integer prev: Previous page number
     :>json integer next: Next page number
     :>json integer count: Total number of items
+    :>json boolean estimated: Present if ``count`` is an estimate
 
     :status 200: Files found
     :status 404: Resource not found
     """
-    return ApiPagedResponse(Sample.query)
+    return ApiPagedResponse(Sample.query, estimate_count=True)
 
 
 @api.route('/samples/<string:digest>', methods=['GET'])
@@ -152,8 +154,11 @@ def add_sample():
 
     Uploaded files are save in :attr:`config.Config.APP_UPLOADS_SAMPLES` using
     the SHA-256 of the content as file name. Existing files are not
-    overwritten. After upload MD5, SHA1, SHA256, SHA512 and CTPH hashes
-    are calculated.
+    overwritten. MD5, SHA1, SHA256, SHA512 and CTPH hashes are calculated
+    while the upload is written to
+    :attr:`config.Config.APP_UPLOADS_SAMPLES_TMP`, in a single pass.
+    Large files can be sent in chunks with resumable uploads, see
+    :http:post:`/api/1.0/samples/uploads`.
 
     **Example request**:
 
@@ -206,30 +211,303 @@ def add_sample():
     """
     uploaded_samples = []
     for idx, file in request.files.items():
-        buf = file.stream.read()
-        digests = get_hashes(buf)
-
-        hash_path = os.path.join(
+        digests = save_sample(
+            file.stream,
             current_app.config['APP_UPLOADS_SAMPLES'],
-            digests.sha256
+            current_app.config['APP_UPLOADS_SAMPLES_TMP']
         )
-        if not os.path.isfile(hash_path):
-            file.stream.seek(0)
-            file.save(hash_path)
-
-        s = Sample(user_id=g.user.id, filename=file.filename, md5=digests.md5,
-                   sha1=digests.sha1, sha256=digests.sha256,
-                   sha512=digests.sha512, ctph=digests.ctph)
-        db.session.add(s)
-        try:
-            db.session.commit()
-            analysis.preprocess(s)
-        except Exception as e:
-            db.session.rollback()
-            db.session.flush()
-            current_app.log.error(e.args[0])
+        s = create_sample(file.filename, digests)
         uploaded_samples.append(s.serialize())
     return ApiResponse({
         'message': 'Files uploaded',
         'files': uploaded_samples
     }, 201)
+
+
+def create_sample(filename, digests):
+    """Add the :class:`~app.models.Sample` of a saved file of the current
+    user and preprocess it
+
+    :param filename: File name, as provided by the client
+    :param digests: :class:`~app.utils.Digests` of the file
+    :return: :class:`~app.models.Sample`
+    """
+    s = Sample(user_id=g.user.id, filename=filename, md5=digests.md5,
+               sha1=digests.sha1, sha256=digests.sha256,
+               sha512=digests.sha512, ctph=digests.ctph)
+    db.session.add(s)
+    try:
+        db.session.commit()
+        analysis.preprocess(s)
+    except Exception as e:
+        db.session.rollback()
+        db.session.flush()
+        current_app.log.error(e.args[0])
+    return s
+
+
+def create_uploaded_sample(upload):
+    """Complete a resumable upload of the current user, move the file to
+    :attr:`config.Config.APP_UPLOADS_SAMPLES` and add its sample. The part
+    file is removed if it cannot be moved, as the upload is already gone.
+
+    :param upload: :class:`~app.core.uploads.UploadSession`
+    :return: :class:`~app.models.Sample`
+    """
+    digests = upload.finalize()
+    try:
+        store_sample(upload.path, digests,
+                     current_app.config['APP_UPLOADS_SAMPLES'])
+    except OSError:
+        remove_file(upload.path)
+        raise
+    return create_sample(upload.filename, digests)
+
+
+@api.route('/samples/uploads', methods=['POST'])
+def add_sample_upload():
+    """Start a resumable upload of a large sample. Send the file in chunks
+    with :http:put:`/api/1.0/samples/uploads/(string:upload_id)`, then
+    create the sample with
+    :http:post:`/api/1.0/samples/uploads/(string:upload_id)/finalize`.
+    Uploads not written to for ``UPLOAD_SESSION_TTL`` seconds are removed.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+        POST /api/1.0/samples/uploads HTTP/1.1
+        Host: do.cert.europa.eu
+        Accept: application/json
+        Content-Type: application/json
+
+        {
+          "filename": "memory.dmp",
+          "size": 2147483648
+        }
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+        HTTP/1.0 201 CREATED
+        Content-Type: application/json
+        Location: http://do.cert.europa.eu/api/1.0/samples/uploads/0f6e7b...
+
+        {
+          "created": "2019-02-11T10:23:05",
+          "filename": "memory.dmp",
+          "id": "0f6e7b3c9d1a4e58b2a1",
+          "offset": 0,
+          "size": 2147483648
+        }
+
+    :reqheader Accept: Content type(s) accepted by the client
+    :reqheader Content-Type: application/json
+    :resheader Content-Type: this depends on `Accept` header or request
+    :resheader Location: Upload URL
+
+    :<json string filename: File name
+    :<json integer size: File size in bytes
+    :>json string id: Upload unique ID
+    :>json string created: Start time of the upload (UTC)
+    :>json string filename: File name
+    :>json integer size: File size in bytes
+    :>json integer offset: Number of bytes received
+
+    :status 201: Upload started
+    :status 400: Missing file name or invalid size
+    :status 413: File larger than ``UPLOAD_MAX_SIZE``
+    """
+    upload = UploadSession.create('samples', g.user.id, request.get_json())
+    return ApiResponse(
+        upload.serialize(), 201,
+        {'Location': url_for('api.get_sample_upload', upload_id=upload.id)})
+
+
+@api.route('/samples/uploads/<string:upload_id>', methods=['GET'])
+def get_sample_upload(upload_id):
+    """Return the state of a resumable upload. Interrupted uploads are
+    resumed by sending the chunk starting at ``offset``.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+        GET /api/1.0/samples/uploads/0f6e7b3c9d1a4e58b2a1 HTTP/1.1
+        Host: do.cert.europa.eu
+        Accept: application/json
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {
+          "created": "2019-02-11T10:23:05",
+          "filename": "memory.dmp",
+          "id": "0f6e7b3c9d1a4e58b2a1",
+          "offset": 52428800,
+          "size": 2147483648
+        }
+
+    :param upload_id: Upload unique ID
+
+    :reqheader Accept: Content type(s) accepted by the client
+    :resheader Content-Type: this depends on `Accept` header or request
+
+    :>json string id: Upload unique ID
+    :>json string created: Start time of the upload (UTC)
+    :>json string filename: File name
+    :>json integer size: File size in bytes
+    :>json integer offset: Number of bytes received
+
+    :status 200: Upload found
+    :status 404: Upload not found or expired
+    """
+    upload = UploadSession.get('samples', upload_id, g.user.id)
+    return ApiResponse(upload.serialize())
+
+
+@api.route('/samples/uploads/<string:upload_id>', methods=['PUT'])
+def update_sample_upload(upload_id):
+    """Send a chunk of a resumable upload. Chunks are sent in order: each
+    chunk starts at the ``offset`` returned for the previous one. Bytes
+    received before a dropped connection are kept.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+        PUT /api/1.0/samples/uploads/0f6e7b3c9d1a4e58b2a1 HTTP/1.1
+        Host: do.cert.europa.eu
+        Accept: application/json
+        Content-Type: application/octet-stream
+        Content-Length: 52428800
+        Content-Range: bytes 0-52428799/2147483648
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {
+          "message": "Chunk saved",
+          "offset": 52428800
+        }
+
+    :param upload_id: Upload unique ID
+
+    :reqheader Accept: Content type(s) accepted by the client
+    :reqheader Content-Range: Byte range of the chunk and file size
+    :resheader Content-Type: this depends on `Accept` header or request
+
+    :>json integer offset: Number of bytes received
+    :>json string message: Status message
+
+    :status 200: Chunk saved
+    :status 400: Invalid ``Content-Range``
+    :status 404: Upload not found or expired
+    :status 409: The chunk does not start at the current offset
+    """
+    upload = UploadSession.get('samples', upload_id, g.user.id)
+    offset = upload.write(request.headers.get('Content-Range'),
+                          request.stream)
+    return ApiResponse({'message': 'Chunk saved', 'offset': offset})
+
+
+@api.route('/samples/uploads/<string:upload_id>/finalize', methods=['POST'])
+def finalize_sample_upload(upload_id):
+    """Complete a resumable upload and add the sample, as
+    :http:post:`/api/1.0/samples` does.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+        POST /api/1.0/samples/uploads/0f6e7b3c9d1a4e58b2a1/finalize HTTP/1.1
+        Host: do.cert.europa.eu
+        Accept: application/json
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+        HTTP/1.0 201 CREATED
+        Content-Type: application/json
+
+        {
+          "files": [
+            {
+              "created": "2019-02-11T10:41:52",
+              "ctph": "49152:ZSe6kYbeJfRaR4qoKk0n6:ZSdkYb8RaR4B",
+              "filename": "memory.dmp",
+              "id": 33,
+              "md5": "0c0a4d2c3c1f7a3d9e5e4f9d2f0c5a71",
+              "sha1": "4e1243bd22c66e76c2ba9eddc1f91394e57f9f83",
+              "sha256": "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d",
+              "sha512": "ee26b0dd4af7e749aa1a8ee3c10ae9923f618980772e473f8819"
+            }
+          ],
+          "message": "Files uploaded"
+        }
+
+    :param upload_id: Upload unique ID
+
+    :reqheader Accept: Content type(s) accepted by the client
+    :resheader Content-Type: this depends on `Accept` header or request
+
+    :>json array files: List of saved samples
+    :>json string message: Status message
+
+    :status 201: Sample saved
+    :status 404: Upload not found or expired
+    :status 409: Some bytes were not received yet
+    """
+    upload = UploadSession.get('samples', upload_id, g.user.id)
+    s = create_uploaded_sample(upload)
+    return ApiResponse({
+        'message': 'Files uploaded',
+        'files': [s.serialize()]
+    }, 201)
+
+
+@api.route('/samples/uploads/<string:upload_id>', methods=['DELETE'])
+def delete_sample_upload(upload_id):
+    """Abort a resumable upload
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+        DELETE /api/1.0/samples/uploads/0f6e7b3c9d1a4e58b2a1 HTTP/1.1
+        Host: do.cert.europa.eu
+        Accept: application/json
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {
+          "message": "Upload deleted"
+        }
+
+    :param upload_id: Upload unique ID
+
+    :reqheader Accept: Content type(s) accepted by the client
+    :resheader Content-Type: this depends on `Accept` header or request
+
+    :>json string message: Status message
+
+    :status 200: Upload deleted
+    :status 404: Upload not found or expired
+    """
+    UploadSession.get('samples', upload_id, g.user.id).delete()
+    return ApiResponse({'message': 'Upload deleted'})
@@ -1,6 +1,6 @@
 from flask import request, redirect, url_for, g
 from flask_jsonschema import validate
-from app.core import ApiResponse
+from app.core import ApiResponse, caching
 from app import db
 from app.models import Tag
 from . import api
@@ -47,7 +47,7 @@ def get_tags():
     :status 204: No tags available
     :status 404: Not found
     """
-    tags = Tag.query.distinct(Tag.name).all()
+    tags = caching.cached_query(Tag.query.distinct(Tag.name))
     if not tags:
         return ApiResponse({}, 204)
     return ApiResponse({'tags': tags})
@@ -50,6 +50,8 @@ def get_vulnerabilities():
           ]
         }
 
+    :query fields: Comma separated list of attributes to return
+    :query expand: Comma separated list of relationships to return
     :reqheader Accept: Content type(s) accepted by the client
     :resheader Content-Type: this depends on `Accept` header or request
 
@@ -69,7 +71,7 @@ def get_vulnerabilities():
     :status 404: Not found
     """
     vulns = Vulnerability.query.all()
-    return ApiResponse({'vulnerabilities': [v.serialize() for v in vulns]})
+    return ApiResponse({'vulnerabilities': vulns})
 
 
 @api.route('/vulnerabilities/<int:vuln_id>', methods=['GET'])
@@ -0,0 +1,409 @@
+"""
+    Constituency lookups
+    ~~~~~~~~~~~~~~~~~~~~
+
+    In-memory indexes used to attribute indicators (IP addresses, hostnames,
+    etc.) to constituent organizations without querying the database for
+    each one.
+"""
+import os
+import json
+import hashlib
+import datetime
+import threading
+from flask import current_app
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Organization, IpRange, Fqdn, Asn, Email, ContactEmail
+from app.models import emails_organizations
+from app.utils.asntable import AsnTable
+from app.utils.overlaps import find_conflicts
+from app.utils.radix import RadixTree
+from app.utils.suffixtrie import SuffixTrie, hostname
+
+_indexes = []
+
+
+class LookupIndex(object):
+    """Base class for lazily built in-memory indexes.
+
+    The index is built on first use and rebuilt when:
+
+    * a session that added, changed or deleted instances of any of the
+      :attr:`__models__` is committed in this process, or
+    * the fingerprint (row count and last update) of the
+      :attr:`__models__` tables has changed, i.e. they were updated
+      by another worker process.
+    """
+    #: Models whose changes invalidate the index
+    __models__ = ()
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self._fingerprint = None
+        _indexes.append(self)
+
+    def build(self):
+        """Build and return the index data. Must be implemented by
+        subclasses.
+        """
+        raise NotImplementedError
+
+    def invalidate(self):
+        """Force a rebuild on next :meth:`get`"""
+        self._data = None
+
+    def fingerprint(self):
+        rv = []
+        for model in self.__models__:
+            rv.extend(db.session.query(
+                func.count(model.id), func.max(model.updated)).one())
+        return tuple(rv)
+
+    def get(self):
+        """Return index data, rebuilding it if stale"""
+        fingerprint = self.fingerprint()
+        with self._lock:
+            if self._data is None or self._fingerprint != fingerprint:
+                self._data = self.build()
+                self._fingerprint = fingerprint
+            return self._data
+
+    def watches(self, instances):
+        return any(isinstance(i, self.__models__) for i in instances)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_stale_indexes(session, flush_context):
+    changed = list(session.new) + list(session.dirty) + list(session.deleted)
+    stale = session.info.setdefault('stale_indexes', set())
+    for index in _indexes:
+        if index.watches(changed):
+            stale.add(index)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_stale_indexes(session):
+    for index in session.info.pop('stale_indexes', ()):
+        index.invalidate()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_stale_indexes(session, previous_transaction):
+    session.info.pop('stale_indexes', None)
+
+
+def _ip_ranges(*columns):
+    """Query ``columns`` of all IP ranges of active organizations, in
+    lookup priority order.
+    """
+    return db.session.query(*columns).\
+        join(Organization, IpRange.organization_id == Organization.id).\
+        filter(IpRange.deleted == 0, Organization.deleted == 0).\
+        order_by(Organization.id, IpRange.id)
+
+
+class IpRangeIndex(LookupIndex):
+    """Longest-prefix-match index of :class:`~app.models.IpRange` to
+    :attr:`~app.models.Organization.abbreviation`.
+    When the same range is registered by several organizations, the
+    organization with the lowest ID wins.
+    """
+    __models__ = (IpRange, Organization)
+
+    def build(self):
+        tree = RadixTree()
+        rows = _ip_ranges(IpRange.ip_range, Organization.abbreviation)
+        for cidr, abbreviation in rows:
+            try:
+                tree.add(cidr, abbreviation, replace=False)
+            except (ValueError, AttributeError):
+                current_app.log.warn(
+                    'Invalid IP range {!r} for {}'.format(cidr, abbreviation))
+        return tree
+
+
+class FqdnIndex(LookupIndex):
+    """Domain suffix index of :class:`~app.models.Fqdn` to
+    :attr:`~app.models.Organization.abbreviation`.
+    Hostnames are attributed to the organization owning the longest
+    registered domain they belong to.
+    """
+    __models__ = (Fqdn, Organization)
+
+    def build(self):
+        trie = SuffixTrie()
+        rows = db.session.query(Fqdn.fqdn, Organization.abbreviation).\
+            join(Organization, Fqdn.organization_id == Organization.id).\
+            filter(Fqdn.deleted == 0, Organization.deleted == 0).\
+            order_by(Organization.id, Fqdn.id)
+        for fqdn, abbreviation in rows:
+            name = hostname(fqdn or '')
+            if name is None:
+                current_app.log.warn(
+                    'Invalid FQDN {!r} for {}'.format(fqdn, abbreviation))
+                continue
+            trie.add(name, abbreviation, replace=False)
+        return trie
+
+
+class AsnIndex(LookupIndex):
+    """Map of :attr:`~app.models.Asn.asn` to
+    :attr:`~app.models.Organization.abbreviation`.
+    When the same AS is registered by several organizations, the
+    organization with the lowest ID wins.
+    """
+    __models__ = (Asn, Organization)
+
+    def build(self):
+        rv = {}
+        rows = db.session.query(Asn.asn, Organization.abbreviation).\
+            join(Organization, Asn.organization_id == Organization.id).\
+            filter(Asn.deleted == 0, Organization.deleted == 0).\
+            order_by(Organization.id, Asn.id)
+        for asn, abbreviation in rows:
+            rv.setdefault(asn, abbreviation)
+        return rv
+
+
+class AsnTableFile(object):
+    """Prefix to origin AS table loaded from the file set in the
+    ``ASN_DB_PATH`` configuration option. The file is reloaded when its
+    modification time changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._table = None
+        self._stamp = None
+
+    def get(self):
+        """Return :class:`~app.utils.asntable.AsnTable` or ``None`` if
+        ``ASN_DB_PATH`` is not configured.
+        """
+        path = current_app.config.get('ASN_DB_PATH')
+        if not path:
+            return None
+        stamp = (path, os.path.getmtime(path))
+        with self._lock:
+            if self._stamp != stamp:
+                self._table = AsnTable.from_file(path)
+                self._stamp = stamp
+                current_app.log.info('Loaded {} prefixes from {}'.format(
+                    len(self._table), path))
+            return self._table
+
+
+def ip_range_conflicts():
+    """Report duplicated, overlapping, nested and unreachable IP ranges of
+    all organizations. See :func:`app.utils.overlaps.find_conflicts`.
+
+    :return: Report dictionary. Each IP range is represented as a
+        dictionary with ``id``, ``ip_range``, ``organization_id`` and
+        ``organization`` keys.
+    """
+    rows = _ip_ranges(IpRange.id, IpRange.ip_range, Organization.id,
+                      Organization.abbreviation)
+    ranges = [
+        (cidr, org_id, {'id': id_, 'ip_range': cidr,
+                        'organization_id': org_id,
+                        'organization': abbreviation})
+        for id_, cidr, org_id, abbreviation in rows]
+    report = find_conflicts(ranges)
+    return {
+        'invalid': report['invalid'],
+        'duplicates': report['duplicates'],
+        'overlaps': [{'ip_range': item, 'enclosing': parent}
+                     for item, parent in report['overlaps']],
+        'nested': [{'ip_range': item, 'enclosing': parent}
+                   for item, parent in report['nested']],
+        'unreachable': [{'ip_range': item, 'reason': reason}
+                        for item, reason in report['unreachable']]
+    }
+
+
+def _etag(body):
+    return hashlib.sha1(
+        json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _latest(*stamps):
+    stamps = [s for s in stamps if s is not None]
+    return max(stamps) if stamps else None
+
+
+class SnapshotIndex(LookupIndex):
+    """Compact export of all organizations and their IP ranges, AS numbers,
+    FQDNs and e-mails, for clients keeping a local copy of the
+    constituency (e.g. AbuseHelper bots).
+
+    Organizations are marked as changed at the latest ``updated`` timestamp
+    of the organization or any of its related rows, so clients can pull
+    only the organizations changed since their last sync.
+    """
+    __models__ = (Organization, IpRange, Asn, Fqdn, ContactEmail, Email)
+
+    def build(self):
+        orgs = {}
+        changed = {}
+        deleted = {}
+        rows = db.session.query(
+            Organization.id, Organization.abbreviation,
+            Organization.full_name, Organization.group_id,
+            Organization.is_sla, Organization.mail_template,
+            Organization.mail_times, Organization.deleted,
+            Organization.updated).order_by(Organization.id)
+        for row in rows:
+            if row.deleted:
+                deleted[row.id] = row.updated
+                continue
+            orgs[row.id] = {
+                'id': row.id,
+                'abbreviation': row.abbreviation,
+                'full_name': row.full_name,
+                'group_id': row.group_id,
+                'is_sla': row.is_sla,
+                'mail_template': row.mail_template,
+                'mail_times': row.mail_times,
+                'ip_ranges': [],
+                'asns': [],
+                'fqdns': [],
+                'abuse_emails': [],
+                'contact_emails': []
+            }
+            changed[row.id] = row.updated
+
+        def collect(key, rows):
+            # Deleted rows are not exported, but still mark the
+            # organization as changed
+            for org_id, value, is_deleted, updated in rows:
+                if org_id not in orgs:
+                    continue
+                changed[org_id] = _latest(changed[org_id], updated)
+                if not is_deleted:
+                    orgs[org_id][key].append(value)
+
+        collect('ip_ranges', db.session.query(
+            IpRange.organization_id, IpRange.ip_range, IpRange.deleted,
+            IpRange.updated).order_by(IpRange.id))
+        collect('asns', db.session.query(
+            Asn.organization_id, Asn.asn, Asn.deleted,
+            Asn.updated).order_by(Asn.id))
+        collect('fqdns', db.session.query(
+            Fqdn.organization_id, Fqdn.fqdn, Fqdn.deleted,
+            Fqdn.updated).order_by(Fqdn.id))
+        collect('abuse_emails', db.session.query(
+            emails_organizations.c.organization_id, Email.email,
+            Email.deleted, Email.updated).
+            select_from(emails_organizations).
+            join(Email, Email.id == emails_organizations.c.email_id).
+            order_by(Email.id))
+        collect('contact_emails', db.session.query(
+            ContactEmail.organization_id, Email.email, Email.deleted,
+            ContactEmail.updated).
+            join(Email, ContactEmail.email_id == Email.id).
+            order_by(ContactEmail.id))
+
+        timestamp = _latest(*(list(changed.values()) +
+                              list(deleted.values())))
+        full = {
+            'organizations': list(orgs.values()),
+            'timestamp': timestamp.isoformat() if timestamp else None
+        }
+        return {
+            'organizations': orgs,
+            'changed': changed,
+            'deleted': deleted,
+            'full': (full, _etag(full))
+        }
+
+    def export(self, since=None):
+        """Return the snapshot and its ETag.
+
+        :param since: :class:`datetime.datetime`. If given, only
+            organizations changed since then are returned, together with
+            the IDs of organizations deleted since then.
+        :return: ``(body, etag)`` tuple
+        """
+        data = self.get()
+        full, etag = data['full']
+        if since is None:
+            return full, etag
+        body = {
+            'organizations': [
+                o for id_, o in data['organizations'].items()
+                if data['changed'][id_] is None or
+                data['changed'][id_] >= since],
+            'deleted': sorted(
+                id_ for id_, updated in data['deleted'].items()
+                if updated is None or updated >= since),
+            'timestamp': full['timestamp']
+        }
+        return body, _etag(body)
+
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 UTC timestamp as returned in snapshots
+
+    :raises: :class:`ValueError` on invalid timestamps
+    """
+    value = value.strip().rstrip('Z')
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError('Invalid timestamp: {}'.format(value))
+
+
+ip_index = IpRangeIndex()
+fqdn_index = FqdnIndex()
+asn_index = AsnIndex()
+asn_table = AsnTableFile()
+snapshot_index = SnapshotIndex()
+
+
+class Classifier(object):
+    """Attribute indicators (IP addresses, URLs, hostnames and e-mail
+    addresses) to organizations.
+    A snapshot of the indexes is taken on instantiation, so a single
+    instance should be used per batch of indicators.
+
+    IP addresses not part of any registered IP range are attributed through
+    their origin AS, when ``ASN_DB_PATH`` is configured.
+    """
+
+    def __init__(self):
+        self.ips = ip_index.get()
+        self.fqdns = fqdn_index.get()
+        self.asn_table = asn_table.get()
+        self.asns = asn_index.get() if self.asn_table is not None else {}
+
+    def classify(self, indicator):
+        """Return a ``(type, abbreviation)`` tuple for ``indicator``.
+        ``type`` is one of ``ip``, ``email`` or ``fqdn``, or ``None`` when
+        the indicator is not recognized. ``abbreviation`` is ``None`` when no
+        organization was found.
+
+        :param str indicator: Indicator
+        """
+        try:
+            abbreviation = self.ips.lookup(indicator)
+        except ValueError:
+            pass
+        else:
+            if abbreviation is None and self.asn_table is not None:
+                abbreviation = self.asns.get(self.asn_table.lookup(indicator))
+            return 'ip', abbreviation
+        indicator = indicator.strip()
+        if '@' in indicator and '/' not in indicator:
+            name = hostname(indicator.rpartition('@')[2])
+            type_ = 'email'
+        else:
+            name = hostname(indicator)
+            type_ = 'fqdn'
+        if not name:
+            return None, None
+        return type_, self.fqdns.lookup(name)
@@ -1,5 +1,7 @@
 from app.core.api import ApiResponse, ApiPagedResponse, FlaskApi
+from app.core.api import ApiStreamResponse, wants_ndjson, query_etag
 from app.core.api import ApiException, ApiValidationException
 
-__all__ = ['ApiResponse', 'ApiPagedResponse', 'FlaskApi',
-           'ApiException', 'ApiValidationException']
+__all__ = ['ApiResponse', 'ApiPagedResponse', 'ApiStreamResponse',
+           'FlaskApi', 'wants_ndjson', 'query_etag', 'ApiException',
+           'ApiValidationException']
@@ -1,5 +1,12 @@
+import base64
+import binascii
+import hashlib
+from datetime import datetime
 from flask import Flask
-from flask import Response, request, json, url_for
+from flask import Response, request, json, url_for, stream_with_context
+from sqlalchemy import Table, and_, or_, func
+from app.core import compression, counts, encoding, ratelimit
+from app.utils.mixins import get_fieldset
 
 
 class FlaskApi(Flask):
@@ -9,27 +16,77 @@ class FlaskApi(Flask):
             return rv.to_response()
         return Flask.make_response(self, rv)
 
+    def process_response(self, response):
+        response = Flask.process_response(self, response)
+        response = ratelimit.apply_headers(response)
+        return compression.compress(response)
+
 
 class ApiResponse:
     """Base class for API responses.
     Returns a :class:`~werkzeug.Response`.
+    The body is encoded with the configured JSON backend, see
+    :mod:`app.core.encoding`.
+
+    Successful ``GET`` responses carry a weak ``ETag``, the hash of the
+    encoded body unless ``etag`` is given, and answer ``If-None-Match``
+    and ``If-Modified-Since`` with ``304 Not Modified``. When ``etag`` or
+    ``last_modified`` are given, e.g. from :func:`query_etag`, the body is
+    not encoded at all for unmodified resources.
 
     :param body: :class:`~flask_sqlalchemy.BaseQuery` or a subclass
     :param status: Response status code as defined in RFC 2616
     :param headers: Dictionary of additional headers
+    :param last_modified: :class:`~datetime.datetime` of the last change
+    :param etag: Entity tag of the response
+    :param immutable: The resource never changes. Clients may cache it
+        and its compressed body is cached, see :mod:`app.core.compression`.
     """
-    def __init__(self, body, status=200, headers={}):
+    def __init__(self, body, status=200, headers={}, last_modified=None,
+                 etag=None, immutable=False):
         self.body = body
         self.status = status
         self.headers = headers
+        self.last_modified = last_modified
+        self.etag = etag
+        self.immutable = immutable
+
+    def _conditional(self):
+        return self.status == 200 and request.method in ('GET', 'HEAD')
+
+    def _validate(self, rv, data=None):
+        """Set validators of ``rv`` and turn it into a
+        ``304 Not Modified`` response if the client copy is current
+        """
+        if 'ETag' not in rv.headers:
+            if self.etag:
+                rv.set_etag(self.etag, weak=True)
+            elif data is not None:
+                rv.set_etag(hashlib.sha1(data).hexdigest(), weak=True)
+        if self.last_modified:
+            rv.last_modified = self.last_modified
+        return rv.make_conditional(request)
 
     def to_response(self):
-        rv = Response(json.dumps(self.body),
+        conditional = self._conditional()
+        if conditional and (self.etag or self.last_modified):
+            rv = Response(status=self.status, mimetype='application/json')
+            rv.headers.extend(self.headers)
+            rv = self._validate(rv)
+            if rv.status_code == 304:
+                return rv
+        data = encoding.dumps(self.body)
+        rv = Response(data,
                       status=self.status,
                       mimetype='application/json')
         rv.headers.extend(self.headers)
         if not self.body:
             rv.status_code = 204
+        elif conditional:
+            if self.immutable:
+                rv.headers['Cache-Control'] = \
+                    'private, max-age=31536000, immutable'
+            rv = self._validate(rv, data)
         return rv
 
     def __repr__(self):
@@ -38,9 +95,161 @@ class ApiResponse:
                           self.status, self.headers)
 
 
+def query_etag(query):
+    """Return an ``ETag`` of the items selected by ``query``, without
+    loading them. It changes with the most recent ``updated`` timestamp,
+    including soft deleted items, and with the number of items, so rows
+    which are hard deleted or no longer match the query are noticed.
+    There is no matching ``Last-Modified``, as ``max(updated)`` does not
+    change in these cases and ``If-Modified-Since`` alone would be
+    answered with a stale ``304``. Only queries over a single table are
+    supported, as changes to joined tables would go unnoticed.
+
+    :param query: :class:`~flask_sqlalchemy.BaseQuery` or a subclass
+    :return: ``None`` if ``query`` is not supported
+    """
+    entity = query.column_descriptions[0]['entity']
+    statement = query.enable_eagerloads(False).order_by(None).statement
+    froms = statement.froms
+    if len(froms) != 1 or not isinstance(froms[0], Table) or \
+            not hasattr(entity, 'updated'):
+        return None
+    validators = query.session.query(
+        func.max(entity.updated), func.count()).select_from(entity)
+    if query.whereclause is not None:
+        validators = validators.filter(query.whereclause)
+    last_modified, total = validators.one()
+    compiled = statement.compile()
+    key = '{}|{}|{}|{}|{}'.format(
+        compiled, sorted(compiled.params.items()), last_modified, total,
+        request.full_path)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+#: Newline delimited JSON, see http://ndjson.org
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def wants_ndjson():
+    """Return ``True`` if the client prefers NDJSON over JSON"""
+    return request.accept_mimetypes.best_match(
+        ['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def encode_cursor(values):
+    """Return an opaque cursor for keyset ``values``"""
+    payload = [v.isoformat() if isinstance(v, datetime) else v
+               for v in values]
+    token = base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8'))
+    return token.decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, columns):
+    """Return keyset values of cursor ``token``
+
+    :param token: Cursor returned by :func:`encode_cursor`
+    :param columns: Keyset columns
+    :raises: :class:`ApiException` if ``token`` is not a valid cursor
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(
+            token + '=' * (-len(token) % 4)).decode('utf-8'))
+        if not isinstance(payload, list) or len(payload) != len(columns):
+            raise ValueError(token)
+        values = []
+        for column, value in zip(columns, payload):
+            python_type = column.type.python_type
+            if python_type is datetime:
+                fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in value \
+                    else '%Y-%m-%dT%H:%M:%S'
+                value = datetime.strptime(value, fmt)
+            elif not isinstance(value, python_type):
+                raise ValueError(token)
+            values.append(value)
+        return values
+    except (ValueError, TypeError, NotImplementedError, binascii.Error):
+        raise ApiException('Invalid cursor')
+
+
+def _before(columns, values):
+    """Expanded row value comparison ``(columns) < (values)``"""
+    column, value = columns[0], values[0]
+    if len(columns) == 1:
+        return column < value
+    return or_(column < value,
+               and_(column == value, _before(columns[1:], values[1:])))
+
+
+def keyset_paginate(query, keyset, after, per_page):
+    """Return the page of ``query`` following cursor ``after``.
+    Items are ordered by the ``keyset`` attributes, in descending order.
+    Unlike :meth:`~flask_sqlalchemy.BaseQuery.paginate`, no ``OFFSET`` or
+    ``COUNT(*)`` is needed, so all pages are as cheap as the first one.
+
+    :param query: :class:`~flask_sqlalchemy.BaseQuery` or a subclass
+    :param keyset: Names of non-null attributes which uniquely identify
+        an item, e.g. ``('created', 'id')``
+    :param after: Cursor of the last item of the previous page. Empty for
+        the first page.
+    :param per_page: Number of items per page
+    :return: ``(items, next_cursor)`` tuple. ``next_cursor`` is ``None`` on
+        the last page.
+    """
+    entity = query.column_descriptions[0]['entity']
+    columns = [getattr(entity, k) for k in keyset]
+    query = query.order_by(None).order_by(*[c.desc() for c in columns])
+    if after:
+        query = query.filter(_before(columns, decode_cursor(after, columns)))
+    items = query.limit(per_page + 1).all()
+    if len(items) <= per_page:
+        return items, None
+    items = items[:per_page]
+    return items, encode_cursor([getattr(items[-1], k) for k in keyset])
+
+
+def iter_batches(query, batch_size=1000):
+    """Iterate over all items of ``query`` ordered by ID, fetching
+    ``batch_size`` items per query.
+    Each batch is selected by ID range instead of holding a cursor open,
+    so eager loading options and lazy loads work as usual, and only one
+    batch is kept in memory.
+
+    :param query: :class:`~flask_sqlalchemy.BaseQuery` or a subclass
+    :param batch_size: Number of items per batch
+    """
+    entity = query.column_descriptions[0]['entity']
+    query = query.order_by(None).order_by(entity.id)
+    last = None
+    while True:
+        batch = query if last is None else query.filter(entity.id > last)
+        batch = batch.limit(batch_size).all()
+        yield from batch
+        if len(batch) < batch_size:
+            return
+        last = batch[-1].id
+
+
+def wants_count():
+    """Return ``True`` if the client asked for the total number of items
+    with ``?count=1``
+    """
+    return request.args.get('count', '').lower() in ('1', 'true', 'yes')
+
+
 class ApiPagedResponse(ApiResponse):
     """Paged ApiResponse.
 
+    Pages are selected with the ``page`` argument by default. If the
+    ``after`` argument is present, keyset pagination is used instead: pass
+    an empty ``after`` for the first page, then the cursor returned in
+    ``next``. The total number of items is only returned in this mode
+    when asked for with ``count=1``.
+
+    Total counts are cached, see :mod:`app.core.counts`. With
+    ``estimate_count``, the total of large unfiltered collections is
+    estimated from table statistics and ``estimated`` is set in the
+    response.
+
     :param body: :class:`~flask_sqlalchemy.BaseQuery` or a subclass
     :param status: Response status code as defined in RFC 2616
     :param headers: Dictionary of additional headers
@@ -49,27 +258,78 @@ class ApiPagedResponse(ApiResponse):
     :param filterfn: Filter function to be applied to each item
     :param exclude: list or tuple of fields to be excluded from
                     serialization
+    :param keyset: Attributes used for keyset pagination.
+                   See :func:`keyset_paginate`.
+    :param estimate_count: Estimate total counts of large collections
     """
     def __init__(self, body, status=200, headers={}, max_per_page=20,
-                 filterfn=None, exclude=None):
+                 filterfn=None, exclude=None, keyset=('id',),
+                 estimate_count=False):
         super().__init__(body, status, headers)
         self.maxperpage = max_per_page
         self.filterfn = filterfn
         self.exclude = exclude
+        self.keyset = keyset
+        self.estimate_count = estimate_count
+
+    def _serialize_items(self, items):
+        fieldset = get_fieldset()
+        items = [i.serialize(self.exclude, **fieldset) for i in items]
+        if self.filterfn:
+            items = list(map(self.filterfn, items))
+        return items
+
+    def _keyset_response(self, after, per_page):
+        items, next_cursor = keyset_paginate(
+            self.body, self.keyset, after, per_page)
+        body = {'items': self._serialize_items(items), 'next': next_cursor}
+        if wants_count():
+            body['count'], estimated = counts.total(
+                self.body, self.estimate_count)
+            if estimated:
+                body['estimated'] = True
+        data = encoding.dumps(body)
+        rv = Response(data,
+                      status=self.status,
+                      mimetype='application/json')
+        rv.headers.extend(self.headers)
+        links = []
+        fmt = '<{}>; rel="First"'
+        links.append(fmt.format(
+            url_for(request.endpoint,
+                    after='',
+                    per_page=per_page,
+                    _external=True,
+                    **request.view_args)))
+        if next_cursor:
+            fmt = '<{}>; rel="Next"'
+            links.append(fmt.format(
+                url_for(request.endpoint,
+                        after=next_cursor,
+                        per_page=per_page,
+                        _external=True,
+                        **request.view_args)))
+        rv.headers['Link'] = ','.join(links)
+        if self._conditional():
+            rv = self._validate(rv, data)
+        return rv
 
     def to_response(self):
         page = request.args.get('page', 1, type=int)
         per_page = min(request.args.get('per_page', self.maxperpage, type=int),
                        self.maxperpage)
-        paged = self.body.paginate(page, per_page)
-
-        items = [i.serialize(self.exclude) for i in paged.items]
-
-        if self.filterfn:
-            items = list(map(self.filterfn, items))
+        after = request.args.get('after')
+        if after is not None:
+            return self._keyset_response(after, per_page)
+        paged, estimated = counts.paginate(
+            self.body, page, per_page, self.estimate_count)
 
-        rv = Response(json.dumps({'page': page, 'count': paged.total,
-                                  'items': items}),
+        body = {'page': page, 'count': paged.total,
+                'items': self._serialize_items(paged.items)}
+        if estimated:
+            body['estimated'] = True
+        data = encoding.dumps(body)
+        rv = Response(data,
                       status=self.status,
                       mimetype='application/json')
 
@@ -103,13 +363,50 @@ class ApiPagedResponse(ApiResponse):
                         _external=True)))
 
         rv.headers['Link'] = ','.join(links)
+        if self._conditional():
+            rv = self._validate(rv, data)
         return rv
 
     def __repr__(self):
-        fmt = '{}({}, status={}, max_per_page={}, filterfn={}, exclude={})'
+        fmt = '{}({}, status={}, max_per_page={}, filterfn={}, exclude={}, ' \
+              'keyset={})'
         return fmt.format(self.__class__.__name__, repr(self.body),
                           self.status, self.maxperpage, self.filterfn,
-                          self.exclude)
+                          self.exclude, self.keyset)
+
+
+class ApiStreamResponse(ApiResponse):
+    """Streamed NDJSON ApiResponse, one serialized item per line.
+    Items are fetched in batches with :func:`iter_batches` and written
+    as they are serialized, so memory usage does not depend on the size
+    of the collection.
+
+    :param body: :class:`~flask_sqlalchemy.BaseQuery` or a subclass
+    :param status: Response status code as defined in RFC 2616
+    :param headers: Dictionary of additional headers
+    :param batch_size: Number of items fetched per query
+    """
+    def __init__(self, body, status=200, headers={}, batch_size=1000):
+        super().__init__(body, status, headers)
+        self.batch_size = batch_size
+
+    def to_response(self):
+        fieldset = get_fieldset()
+
+        def generate():
+            for item in iter_batches(self.body, self.batch_size):
+                yield encoding.dumps(item.serialize(**fieldset)) + b'\n'
+
+        rv = Response(stream_with_context(generate()),
+                      status=self.status,
+                      mimetype=NDJSON_MIMETYPE)
+        rv.headers.extend(self.headers)
+        return rv
+
+    def __repr__(self):
+        fmt = '{}({}, status={}, headers={}, batch_size={})'
+        return fmt.format(self.__class__.__name__, repr(self.body),
+                          self.status, self.headers, self.batch_size)
 
 
 class ApiException(Exception):
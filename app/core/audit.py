@@ -0,0 +1,177 @@
+"""
+    Audit log
+    ~~~~~~~~~
+
+    Requests are recorded in the audit log by the ``after_request``
+    handlers of the API, customer portal and authentication blueprints.
+
+    The request thread only queues a small record: request bodies larger
+    than ``AUDIT_LOG_MAX_DATA`` bytes are replaced by their SHA-256 digest
+    and size. A background thread formats the records and writes them in
+    batches to the ``doaudit`` logger, i.e. to the rotating ``audit.log``
+    file and syslog. When the queue is full, records are written by the
+    request thread.
+
+    Records are also stored in the indexed ``audit_log`` table when
+    ``AUDIT_LOG_STORE`` is set, see :class:`app.models.AuditEntry`.
+"""
+import atexit
+import datetime
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from flask import request
+from app.utils import addslashes, _HTTP_METHOD_TO_AUDIT_MAP
+
+#: Audit log fields, in log order
+FIELDS = ('module', 'user', 'email', 'action', 'data', 'url', 'endpoint',
+          'ip', 'status', 'timestamp')
+
+
+def _data(body, mask_password):
+    """Return the ``data`` field of request ``body``"""
+    if isinstance(body, str):
+        return body
+    if mask_password:
+        try:
+            jdata = json.loads(body.decode())
+            if isinstance(jdata, dict) and 'password' in jdata:
+                jdata['password'] = '*********'
+            text = json.dumps(jdata)
+        except ValueError:
+            text = ''
+    else:
+        text = body.decode(errors='replace')
+    return addslashes(text)
+
+
+def fields(record):
+    """Return the audit log fields of queued ``record``"""
+    rv = dict(record)
+    rv['data'] = _data(record['data'], record['mask_password'])
+    rv['timestamp'] = datetime.datetime.utcfromtimestamp(
+        record['created']).strftime('%Y-%m-%d %H:%M:%S')
+    return rv
+
+
+def format_entry(record):
+    """Return the audit log message of queued ``record``"""
+    values = fields(record)
+    return ' '.join('{0!s}="{1!s}"'.format(k, values[k]) for k in FIELDS)
+
+
+class AuditLog:
+    """Write audit records to ``logger`` on a background thread.
+
+    :param logger: :class:`logging.Logger` with the audit log handlers
+    :param max_data: Request bodies above this size are hashed
+    :param batch_size: Maximum number of records written at once
+    :param queue_size: Maximum number of queued records
+    :param background: Write records on a background thread
+    :param store: Function storing a list of records, called for each
+        batch after records are logged
+    """
+    def __init__(self, logger, max_data=4096, batch_size=100,
+                 queue_size=10000, background=True, store=None):
+        self.logger = logger
+        self.store = store
+        self.max_data = max_data
+        self.batch_size = batch_size
+        self.background = background
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def record(self, module, user, response, mask_password=False):
+        """Queue the audit record of the current request
+
+        :param module: Blueprint name
+        :param user: Current user
+        :param response: :class:`~flask.Response`
+        :param mask_password: Hide the ``password`` of JSON bodies
+        """
+        body = request.data
+        if len(body) > self.max_data:
+            body = 'sha256={} size={}'.format(
+                hashlib.sha256(body).hexdigest(), len(body))
+        action = _HTTP_METHOD_TO_AUDIT_MAP[request.method.lower()]
+        if not request.view_args and request.method.lower() == 'put':
+            action = _HTTP_METHOD_TO_AUDIT_MAP['post']
+        self.put({
+            'module': module,
+            'user': user.name,
+            'email': user.email,
+            'action': action,
+            'data': body,
+            'mask_password': mask_password,
+            'url': request.url,
+            'endpoint': request.endpoint,
+            'ip': request.remote_addr,
+            'status': response.status,
+            'created': time.time()
+        })
+
+    def put(self, record):
+        if not self.background:
+            return self.write([record])
+        self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.write([record])
+
+    def _start(self):
+        # Threads do not survive forks of the worker processes
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(self._queue.maxsize)
+                self._thread = threading.Thread(
+                    target=self._run, name='audit-log', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    'Cannot write audit log')
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def write(self, records):
+        """Write ``records`` to the audit logger and store"""
+        if self.logger.isEnabledFor(logging.INFO):
+            for r in records:
+                self.logger.handle(logging.makeLogRecord({
+                    'name': self.logger.name, 'levelno': logging.INFO,
+                    'levelname': logging.getLevelName(logging.INFO),
+                    'msg': format_entry(r), 'created': r['created']}))
+        if self.store is not None:
+            try:
+                self.store(records)
+            except Exception:
+                # The log file still has the records
+                logging.getLogger(__name__).exception(
+                    'Cannot store audit log records')
+
+    def flush(self):
+        """Wait until all queued records are written"""
+        if self._pid == os.getpid():
+            self._queue.join()
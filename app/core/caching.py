@@ -0,0 +1,212 @@
+"""
+    Reference data cache
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Read-through cache of reference data which rarely changes, e.g.
+    organization groups, tags, deliverables or AbuseHelper bots.
+
+    Serialized query results are stored in the Flask-Cache backend selected
+    with ``CACHE_TYPE``: ``app.core.caching.lru`` (in-process), ``simple``,
+    ``filesystem`` or ``redis``. Each cached table has a version token,
+    which is part of the keys of entries read from that table. Committing a
+    session which writes to a table replaces its token, so that stale
+    entries are never read again. With a shared backend, writes are seen by
+    all processes at once. The in-process backends only see the writes of
+    their own process, so entries read by other processes are only
+    refreshed after ``CACHE_DEFAULT_TIMEOUT`` seconds.
+
+    Only the tables in :data:`TABLES` can be cached.
+"""
+import hashlib
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask import current_app, has_app_context
+from flask_cache import Cache
+from sqlalchemy import event, Table
+from sqlalchemy.orm import Session, object_mapper
+from sqlalchemy.orm.exc import UnmappedInstanceError
+from sqlalchemy.sql.util import find_tables
+from werkzeug.contrib.cache import BaseCache
+from app.utils.mixins import get_fieldset
+
+#: Tables of reference data
+TABLES = frozenset([
+    'organization_groups', 'tags', 'deliverables', 'report_types', 'roles',
+    'ah_bots', 'ah_bot_types', 'ah_startup_configs',
+    'ah_startup_config_params', 'ah_runtime_configs',
+    'ah_runtime_config_params'])
+
+# The Jinja2 extension of Flask-Cache does not import with Flask 1.0
+cache = Cache(with_jinja2_ext=False)
+
+
+class LRUCache(BaseCache):
+    """In-process cache dropping the least recently used entries beyond
+    ``threshold``. Values are pickled, as with
+    :class:`~werkzeug.contrib.cache.SimpleCache`.
+    """
+    def __init__(self, threshold=500, default_timeout=300):
+        BaseCache.__init__(self, default_timeout)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._threshold = threshold
+
+    def _expires(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        return time.time() + timeout if timeout > 0 else 0
+
+    def _get(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] and entry[0] <= time.time():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._get(key)
+        return pickle.loads(entry[1]) if entry is not None else None
+
+    def set(self, key, value, timeout=None):
+        entry = (self._expires(timeout),
+                 pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._cache[key] = entry
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._threshold:
+                self._cache.popitem(last=False)
+        return True
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            if self._get(key) is not None:
+                return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            return self._cache.pop(key, None) is not None
+
+    def has(self, key):
+        with self._lock:
+            return self._get(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+        return True
+
+
+def lru(app, config, args, kwargs):
+    """Flask-Cache factory of :class:`LRUCache`"""
+    kwargs.update(threshold=config['CACHE_THRESHOLD'])
+    return LRUCache(*args, **kwargs)
+
+
+def _version_key(table):
+    return 'version:' + table
+
+
+def _versions(tables):
+    """Return the version tokens of ``tables``, creating missing ones"""
+    backend = cache.cache
+    keys = [_version_key(t) for t in tables]
+    versions = list(backend.get_many(*keys))
+    for i, version in enumerate(versions):
+        if version is None:
+            version = uuid.uuid4().hex
+            if not backend.add(keys[i], version, timeout=0):
+                version = backend.get(keys[i]) or version
+            versions[i] = version
+    return versions
+
+
+def invalidate(tables):
+    """Drop cached entries read from ``tables``"""
+    backend = cache.cache
+    for table in tables:
+        backend.set(_version_key(table), uuid.uuid4().hex, timeout=0)
+
+
+def cached_query(query, timeout=None):
+    """Return the items of ``query``, serialized with the ``fields``
+    requested by the client, from cache if possible.
+
+    Expanded relationships are not cached, as they are read from other
+    tables: requests for them are passed through.
+
+    :param query: :class:`~flask_sqlalchemy.BaseQuery` or a subclass,
+        selecting from :data:`TABLES` only
+    :param timeout: Cache timeout in seconds, defaults to
+        ``CACHE_DEFAULT_TIMEOUT``
+    :return: List of dictionaries
+    """
+    fieldset = get_fieldset()
+    entity = query.column_descriptions[0]['entity']
+    relationships = set(entity.__mapper__.relationships.keys())
+    requested = (fieldset.get('fields') or set()) | \
+        (fieldset.get('expand') or set())
+    if not current_app.config.get('CACHE_ENABLED', True) or \
+            requested & relationships:
+        return [o.serialize(**fieldset) for o in query]
+
+    tables = sorted(
+        t.name for t in find_tables(query.statement, include_joins=True)
+        if isinstance(t, Table))
+    if not set(tables) <= TABLES:
+        raise ValueError('Tables {} cannot be cached'.format(
+            ', '.join(sorted(set(tables) - TABLES))))
+    compiled = query.statement.compile()
+    key = '{}|{}|{}|{}|{}'.format(
+        compiled, sorted((k, repr(v)) for k, v in compiled.params.items()),
+        sorted(fieldset.get('fields') or ()),
+        sorted(fieldset.get('expand') or ()), _versions(tables))
+    key = 'query:' + hashlib.sha1(key.encode('utf-8')).hexdigest()
+    backend = cache.cache
+    items = backend.get(key)
+    if items is None:
+        items = [o.serialize(**fieldset) for o in query]
+        backend.set(key, items, timeout=timeout)
+    return items
+
+
+def _written(session, tables):
+    tables = set(tables) & TABLES
+    if tables:
+        session.info.setdefault('cached_tables', set()).update(tables)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_written_tables(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + \
+            list(session.deleted):
+        try:
+            _written(session, (t.name for t in object_mapper(obj).tables))
+        except UnmappedInstanceError:
+            pass
+
+
+@event.listens_for(Session, 'after_bulk_update')
+@event.listens_for(Session, 'after_bulk_delete')
+def _collect_bulk_written_tables(context):
+    _written(context.session, (t.name for t in context.mapper.tables))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_written_tables(session):
+    written = session.info.pop('cached_tables', None)
+    if written and has_app_context() and \
+            current_app.config.get('CACHE_ENABLED', True):
+        invalidate(written)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_written_tables(session, previous_transaction):
+    session.info.pop('cached_tables', None)
@@ -0,0 +1,99 @@
+"""
+    Response compression
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Compress response bodies with gzip or deflate, as negotiated with the
+    ``Accept-Encoding`` request header.
+
+    Only responses with a ``COMPRESS_MIMETYPES`` content type and a body
+    of at least ``COMPRESS_MIN_SIZE`` bytes are compressed. File downloads
+    and streamed responses are passed through, as are responses that are
+    already encoded.
+
+    Responses marked ``immutable`` with ``Cache-Control`` do not change
+    for a given URL, e.g. analysis reports looked up by ID. Their
+    compressed bodies are kept in a small LRU cache, keyed on a digest of
+    the uncompressed body, so that they are compressed only once.
+"""
+import gzip
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+from flask import current_app, request
+
+#: Encodings in order of preference
+ENCODINGS = ('gzip', 'deflate')
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _compress(data, encoding, level):
+    if encoding == 'gzip':
+        return gzip.compress(data, level)
+    return zlib.compress(data, level)
+
+
+def _compressible(response):
+    cfg = current_app.config
+    if not cfg.get('COMPRESS_ENABLED', True):
+        return False
+    if response.status_code != 200 or response.direct_passthrough or \
+            response.is_streamed or 'Content-Encoding' in response.headers:
+        return False
+    if response.mimetype not in cfg.get('COMPRESS_MIMETYPES', ()):
+        return False
+    length = response.calculate_content_length()
+    return length is not None and \
+        length >= cfg.get('COMPRESS_MIN_SIZE', 1024)
+
+
+def _cached(key, data, encoding, level):
+    size = current_app.config.get('COMPRESS_CACHE_SIZE', 0)
+    if key is None or not size:
+        return _compress(data, encoding, level)
+    with _lock:
+        compressed = _cache.get(key)
+        if compressed is not None:
+            _cache.move_to_end(key)
+            return compressed
+    compressed = _compress(data, encoding, level)
+    with _lock:
+        _cache[key] = compressed
+        while len(_cache) > size:
+            _cache.popitem(last=False)
+    return compressed
+
+
+def compress(response):
+    """Compress the body of ``response`` if the client accepts it
+
+    :param response: :class:`~flask.Response`
+    :return: :class:`~flask.Response`
+    """
+    if not _compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    key = None
+    if 'immutable' in response.headers.get('Cache-Control', ''):
+        # Hashing is much cheaper than compressing
+        key = (hashlib.sha1(data).digest(), encoding)
+    response.set_data(_cached(
+        key, data, encoding, current_app.config.get('COMPRESS_LEVEL', 6)))
+    response.headers['Content-Encoding'] = encoding
+    # Strong validators must differ between encodings of a resource
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def clear_cache():
+    """Drop all cached compressed bodies"""
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,157 @@
+"""
+    Collection counts
+    ~~~~~~~~~~~~~~~~~
+
+    Total item counts for paginated collections.
+
+    Exact counts are cached for ``COUNT_CACHE_TTL`` seconds, keyed on the
+    compiled SQL and parameters of the query. Entries are dropped when a
+    session writing to any of the counted tables is committed in this
+    process. Writes by other processes are picked up when entries expire.
+
+    Estimated counts are read from the database table statistics and do
+    not scan the table.
+"""
+import time
+import threading
+from flask import current_app, abort
+from flask_sqlalchemy import Pagination
+from sqlalchemy import event, text, Table
+from sqlalchemy.orm import Session, object_mapper
+from sqlalchemy.orm.exc import UnmappedInstanceError
+from sqlalchemy.sql.util import find_tables
+
+#: Maximum number of cached counts
+CACHE_SIZE = 1024
+#: Exact counts are used below this number of estimated rows, as table
+#: statistics of small tables are often far off
+ESTIMATE_MIN_ROWS = 10000
+
+_ESTIMATE_SQL = {
+    'mysql': 'SELECT table_rows FROM information_schema.tables '
+             'WHERE table_schema = DATABASE() AND table_name = :table',
+    'postgresql': 'SELECT reltuples::bigint FROM pg_class '
+                  'WHERE oid = to_regclass(:table)'
+}
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _key(query):
+    compiled = query.statement.compile()
+    params = tuple(sorted(
+        (k, repr(v)) for k, v in compiled.params.items()))
+    return type(query).__name__, str(compiled), params
+
+
+def _tables(query):
+    return frozenset(
+        t.name for t in find_tables(query.statement, include_joins=True)
+        if isinstance(t, Table))
+
+
+def count(query):
+    """Return the number of items of ``query``, from cache if possible
+
+    :param query: :class:`~flask_sqlalchemy.BaseQuery` or a subclass
+    """
+    query = query.order_by(None)
+    ttl = current_app.config.get('COUNT_CACHE_TTL', 0)
+    if not ttl:
+        return query.count()
+    key = _key(query)
+    now = time.time()
+    entry = _cache.get(key)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    total = query.count()
+    with _lock:
+        if len(_cache) >= CACHE_SIZE:
+            for k in [k for k, e in _cache.items() if e[0] <= now] or \
+                    list(_cache):
+                _cache.pop(k, None)
+        _cache[key] = (now + ttl, total, _tables(query))
+    return total
+
+
+def estimate_count(query):
+    """Return the number of rows of the table ``query`` selects from, as
+    estimated by the database, or ``None`` if no estimate is available.
+
+    Only unfiltered queries over a single table are estimated. Soft
+    deleted rows are counted too.
+    """
+    sql = _ESTIMATE_SQL.get(query.session.get_bind().dialect.name)
+    if sql is None or query.whereclause is not None:
+        return None
+    froms = query.statement.froms
+    if len(froms) != 1 or not isinstance(froms[0], Table):
+        return None
+    rv = query.session.execute(text(sql), {'table': froms[0].name}).scalar()
+    return int(rv) if rv is not None else None
+
+
+def total(query, estimate=False):
+    """Return ``(total, estimated)`` for ``query``
+
+    :param estimate: Use the estimated count of large tables
+    """
+    if estimate:
+        rv = estimate_count(query)
+        if rv is not None and rv >= ESTIMATE_MIN_ROWS:
+            return rv, True
+    return count(query), False
+
+
+def paginate(query, page, per_page, estimate=False):
+    """Same as :meth:`flask_sqlalchemy.BaseQuery.paginate`, using
+    :func:`total` to count items.
+
+    :return: ``(pagination, estimated)`` tuple
+    """
+    if page < 1:
+        abort(404)
+    items = query.limit(per_page).offset((page - 1) * per_page).all()
+    if not items and page != 1:
+        abort(404)
+    # No need to count if we're on the first page and there are fewer
+    # items than we expected.
+    if page == 1 and len(items) < per_page:
+        rv, estimated = len(items), False
+    else:
+        rv, estimated = total(query, estimate)
+    return Pagination(query, page, per_page, rv, items), estimated
+
+
+def invalidate(tables=None):
+    """Drop cached counts of ``tables``, or all cached counts"""
+    with _lock:
+        if tables is None:
+            _cache.clear()
+            return
+        for key in [k for k, e in _cache.items() if e[2] & tables]:
+            del _cache[key]
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_written_tables(session, flush_context):
+    written = session.info.setdefault('written_tables', set())
+    for obj in list(session.new) + list(session.dirty) + \
+            list(session.deleted):
+        try:
+            written.update(t.name for t in object_mapper(obj).tables)
+        except UnmappedInstanceError:
+            pass
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_written_tables(session):
+    written = session.info.pop('written_tables', None)
+    if written:
+        invalidate(written)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_written_tables(session, previous_transaction):
+    session.info.pop('written_tables', None)
@@ -0,0 +1,82 @@
+"""
+    JSON encoding
+    ~~~~~~~~~~~~~
+
+    JSON backends used to write API responses.
+
+    ``JSON_BACKEND`` selects one of :data:`backends`. With ``auto``, the
+    default, `orjson <https://github.com/ijl/orjson>`_ is used when
+    installed and the standard library encoder otherwise. All backends
+    convert values the same way as :class:`app.utils.JSONEncoder` and
+    honour ``JSON_SORT_KEYS``, so the decoded output does not depend on
+    the backend.
+"""
+from flask import current_app, json
+from app.utils import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#: Backends tried in order with ``JSON_BACKEND = 'auto'``
+PREFERRED = ('orjson', 'json')
+
+#: Registered backends. Maps names to functions returning the JSON
+#: document of an object as UTF-8 encoded bytes.
+backends = {}
+
+_encoder = JSONEncoder()
+
+
+def register_backend(name, dumps):
+    """Register JSON backend ``name``
+
+    :param name: Value of ``JSON_BACKEND`` selecting this backend
+    :param dumps: Function returning the UTF-8 encoded JSON document of
+        an object
+    """
+    backends[name] = dumps
+
+
+def _dumps_json(obj):
+    return json.dumps(obj).encode('utf-8')
+
+
+def _dumps_orjson(obj):
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    if current_app.config.get('JSON_SORT_KEYS', True):
+        option |= orjson.OPT_SORT_KEYS
+    try:
+        return orjson.dumps(obj, default=_encoder.default, option=option)
+    except orjson.JSONEncodeError:
+        # e.g. integers larger than 64 bits
+        return _dumps_json(obj)
+
+
+register_backend('json', _dumps_json)
+if orjson is not None:
+    register_backend('orjson', _dumps_orjson)
+
+
+def get_backend(name=None):
+    """Return the ``dumps`` function of backend ``name``, by default the
+    one configured with ``JSON_BACKEND``
+
+    :raises: :class:`ValueError` if the backend is not available
+    """
+    if name is None:
+        name = current_app.config.get('JSON_BACKEND', 'auto')
+    if name == 'auto':
+        name = next(n for n in PREFERRED if n in backends)
+    try:
+        return backends[name]
+    except KeyError:
+        raise ValueError('JSON backend {} is not available'.format(name))
+
+
+def dumps(obj):
+    """Return the JSON document of ``obj`` as UTF-8 encoded bytes, using
+    the configured backend
+    """
+    return get_backend()(obj)
@@ -0,0 +1,240 @@
+"""
+    Rate limiting
+    ~~~~~~~~~~~~~
+
+    Token bucket rate limiter. Each client has a bucket of ``limit`` tokens
+    per scope, refilled at ``limit / period`` tokens per second. Requests
+    take one token and are refused when the bucket is empty. Buckets are
+    kept only while they are not full, so expiring them costs nothing.
+
+    Clients authenticated with an API key have a bucket per key, other
+    clients a bucket per IP address. ``RATELIMIT_ENDPOINTS`` sets limits of
+    single endpoints, which then have their own buckets.
+
+    Buckets are stored in the storage selected with
+    ``RATELIMIT_STORAGE_URL``:
+
+    * ``memory://``: in-process, limits apply to each worker process
+    * ``sqlite:////dev/shm/do-ratelimit.db``: SQLite file shared by the
+      worker processes of a host
+    * ``redis://host:6379/0``: Redis server shared by several hosts.
+      Requires `redis-py <https://github.com/andymccurdy/redis-py>`_.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, request, g
+from flask_login import current_user
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+#: Header prefix of rate limit headers
+HEADERS_PREFIX = 'DO-RateLimit-'
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def _take(tokens, updated, limit, period, now):
+    """Refill a bucket last updated at ``updated`` and take one token.
+
+    :return: ``(allowed, tokens)`` tuple
+    """
+    if tokens is None:
+        tokens = float(limit)
+    else:
+        tokens = min(limit, tokens + (now - updated) * limit / period)
+    if tokens < 1:
+        return False, tokens
+    return True, tokens - 1
+
+
+class MemoryStorage:
+    """Buckets of this process, least recently used first. Full buckets
+    are dropped from the front on each request.
+
+    :param size: Maximum number of buckets
+    """
+    def __init__(self, size=100000):
+        self.size = size
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, limit, period, now):
+        with self._lock:
+            tokens, updated, _ = self._buckets.pop(key, (None, None, None))
+            allowed, tokens = _take(tokens, updated, limit, period, now)
+            self._buckets[key] = (tokens, now, now + period)
+            while self._buckets:
+                oldest = next(iter(self._buckets.values()))
+                if oldest[2] > now and len(self._buckets) <= self.size:
+                    break
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+
+class SQLiteStorage:
+    """Buckets in a SQLite database shared by the processes of a host.
+    Put it on a memory file system, e.g. ``/dev/shm``.
+
+    :param path: Database file
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # Connections are not shared by threads or forked processes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets ('
+                         'key TEXT PRIMARY KEY, tokens REAL, updated REAL, '
+                         'expires REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_buckets_expires '
+                         'ON buckets (expires)')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def take(self, key, limit, period, now):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT tokens, updated FROM buckets WHERE key = ?',
+                (key, )).fetchone() or (None, None)
+            allowed, tokens = _take(row[0], row[1], limit, period, now)
+            conn.execute('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?)',
+                         (key, tokens, now, now + period))
+            conn.execute('DELETE FROM buckets WHERE expires < ?', (now, ))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, tokens
+
+
+class RedisStorage:
+    """Buckets in Redis hashes, which expire when full. Buckets are updated
+    with a Lua script, in one round-trip.
+
+    :param url: Redis URL, e.g. ``redis://localhost:6379/0``
+    """
+    SCRIPT = """
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local limit, period = tonumber(ARGV[1]), tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local tokens = tonumber(state[1])
+    if tokens == nil then
+        tokens = limit
+    else
+        tokens = math.min(
+            limit, tokens + (now - tonumber(state[2])) * limit / period)
+    end
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens),
+               'updated', ARGV[3])
+    redis.call('EXPIRE', KEYS[1], math.ceil(period))
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError('Redis rate limit storage requires redis-py')
+        self._script = redis.StrictRedis.from_url(url).register_script(
+            self.SCRIPT)
+
+    def take(self, key, limit, period, now):
+        allowed, tokens = self._script(
+            keys=['do-ratelimit:' + key], args=[limit, period, repr(now)])
+        return bool(allowed), float(tokens)
+
+
+def get_storage(url=None):
+    """Return the storage of ``url``, by default ``RATELIMIT_STORAGE_URL``
+
+    :raises: :class:`ValueError` for unknown storages
+    """
+    if url is None:
+        url = current_app.config.get('RATELIMIT_STORAGE_URL', 'memory://')
+    storage = _storages.get(url)
+    if storage is not None:
+        return storage
+    scheme, _, path = url.partition('://')
+    with _storages_lock:
+        if url not in _storages:
+            if scheme == 'memory':
+                _storages[url] = MemoryStorage()
+            elif scheme == 'sqlite':
+                _storages[url] = SQLiteStorage(path[1:])
+            elif scheme in ('redis', 'rediss', 'unix'):
+                _storages[url] = RedisStorage(url)
+            else:
+                raise ValueError(
+                    'Unknown rate limit storage: {}'.format(url))
+        return _storages[url]
+
+
+def _client():
+    """Return the bucket key part identifying the client"""
+    api_key = request.headers.get('API-Authorization') or \
+        request.args.get('api_authorization')
+    # Unknown keys must not get fresh buckets
+    if api_key and current_user.is_authenticated and \
+            getattr(current_user, 'api_key', None) == api_key:
+        return 'key:' + current_user.api_key_hash
+    return 'ip:{}'.format(request.remote_addr)
+
+
+def hit(scope, limit, period):
+    """Take a token from the bucket of the current client in ``scope``.
+    Endpoints listed in ``RATELIMIT_ENDPOINTS`` use their own limits and
+    buckets instead.
+
+    :param scope: Name of the limited group of endpoints
+    :param limit: Maximum number of requests per ``period``
+    :param period: Period in seconds
+    :return: ``(allowed, headers)`` tuple. ``headers`` are the
+        ``DO-RateLimit-*`` headers of the response.
+    """
+    override = current_app.config.get('RATELIMIT_ENDPOINTS', {}).get(
+        request.endpoint)
+    if override is not None:
+        scope = request.endpoint
+        limit, period = override
+    now = time.time()
+    allowed, tokens = get_storage().take(
+        '{}/{}'.format(scope, _client()), limit, period, now)
+    headers = {
+        HEADERS_PREFIX + 'Remaining': str(int(tokens)),
+        HEADERS_PREFIX + 'Limit': str(limit),
+        # When the bucket is full again
+        HEADERS_PREFIX + 'Reset': str(int(math.ceil(
+            now + (limit - tokens) * period / limit)))
+    }
+    if not allowed:
+        headers['Retry-After'] = str(int(math.ceil(
+            (1 - tokens) * period / limit)))
+    return allowed, headers
+
+
+def apply_headers(response):
+    """Add the rate limit headers of the current request to ``response``"""
+    headers = g.get('rate_limit_headers')
+    if headers:
+        for key, value in headers.items():
+            response.headers.setdefault(key, value)
+    return response
@@ -0,0 +1,275 @@
+"""
+    Resumable uploads
+    ~~~~~~~~~~~~~~~~~
+
+    Large files are uploaded in chunks, so a dropped connection only
+    loses the current chunk and no worker is held for the whole transfer:
+
+    1. An upload session is created with the file name and size.
+    2. Chunks are sent in order with ``PUT`` requests, each with a
+       ``Content-Range: bytes <start>-<end>/<size>`` header. A chunk must
+       start at the current offset of the session, which is returned by
+       ``GET`` to resume an interrupted upload.
+    3. The session is finalized once all bytes are received.
+
+    Chunks are appended to a part file in the temporary directory of the
+    upload kind, next to the final location, so finalized files are only
+    renamed. Sample digests are computed as chunks arrive, while the chunks
+    reach the same worker process. Otherwise the rest of the part file is
+    hashed when the session is finalized.
+
+    Sessions and other temporary files not written to for
+    ``UPLOAD_SESSION_TTL`` seconds are removed by :func:`clean`.
+"""
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from werkzeug.http import parse_content_range_header
+from app.core.api import ApiException
+from app.utils import Hashes, CHUNK_SIZE, random_ascii, remove_file
+
+#: Temporary directory configuration keys of upload kinds
+DIRECTORIES = {
+    'samples': 'APP_UPLOADS_SAMPLES_TMP',
+    'files': 'APP_UPLOADS_TMP'
+}
+#: Session IDs, which must not name other files
+ID_RE = re.compile(r'[0-9a-f]{20}')
+#: Upload kinds which are hashed
+HASHED = frozenset(['samples'])
+#: Maximum number of sessions with digests kept in memory
+HASHES_SIZE = 256
+
+#: ``(offset, hashes)`` of sessions, least recently used first
+_hashes = OrderedDict()
+_hashes_lock = threading.Lock()
+
+
+def _pop_hashes(session_id):
+    with _hashes_lock:
+        return _hashes.pop(session_id, None)
+
+
+def _put_hashes(session_id, offset, hashes):
+    with _hashes_lock:
+        _hashes[session_id] = (offset, hashes)
+        while len(_hashes) > HASHES_SIZE:
+            _hashes.popitem(last=False)
+
+
+class UploadSession:
+    """Chunked upload of a file of ``size`` bytes, see :mod:`app.core.uploads`
+
+    :param kind: Upload kind, one of :data:`DIRECTORIES`
+    :param id: Session ID
+    :param user_id: ID of the user uploading the file
+    :param filename: File name, as provided by the client
+    :param size: File size in bytes
+    :param created: Creation time (UNIX timestamp)
+    """
+    def __init__(self, kind, id, user_id, filename, size, created):
+        self.kind = kind
+        self.id = id
+        self.user_id = user_id
+        self.filename = filename
+        self.size = size
+        self.created = created
+
+    @staticmethod
+    def directory(kind):
+        """Return the temporary directory of upload ``kind``"""
+        return current_app.config[DIRECTORIES[kind]]
+
+    @property
+    def path(self):
+        """Part file of the upload"""
+        return os.path.join(self.directory(self.kind), self.id + '.part')
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.directory(self.kind), self.id + '.json')
+
+    @property
+    def offset(self):
+        """Number of bytes received"""
+        return os.path.getsize(self.path)
+
+    @classmethod
+    def create(cls, kind, user_id, data):
+        """Create an upload session
+
+        :param kind: Upload kind, one of :data:`DIRECTORIES`
+        :param user_id: ID of the user uploading the file
+        :param data: Request JSON with ``filename`` and ``size``
+        :raises: :class:`~app.core.ApiException` for invalid names or sizes
+        """
+        data = data or {}
+        filename, size = data.get('filename'), data.get('size')
+        if not filename or not isinstance(filename, str):
+            raise ApiException('A filename is required')
+        if not isinstance(size, int) or isinstance(size, bool) or size < 1:
+            raise ApiException('The size must be a positive integer')
+        if size > current_app.config['UPLOAD_MAX_SIZE']:
+            raise ApiException('File too large', 413)
+        os.makedirs(cls.directory(kind), exist_ok=True)
+        session = cls(kind, random_ascii(10), user_id, filename, size,
+                      int(time.time()))
+        open(session.path, 'xb').close()
+        with open(session._meta_path, 'x') as f:
+            json.dump({'user_id': user_id, 'filename': filename,
+                       'size': size, 'created': session.created}, f)
+        return session
+
+    @classmethod
+    def get(cls, kind, session_id, user_id):
+        """Return upload session ``session_id`` of user ``user_id``
+
+        :raises: :class:`~app.core.ApiException` if the session does not
+            exist, has expired or belongs to another user
+        """
+        if not ID_RE.fullmatch(session_id):
+            raise ApiException('Upload session not found', 404)
+        try:
+            with open(os.path.join(cls.directory(kind),
+                                   session_id + '.json')) as f:
+                meta = json.load(f)
+        except (ValueError, OSError):
+            raise ApiException('Upload session not found', 404)
+        if meta['user_id'] != user_id:
+            raise ApiException('Upload session not found', 404)
+        return cls(kind, session_id, **meta)
+
+    def write(self, content_range, stream):
+        """Append a chunk to the part file
+
+        :param content_range: ``Content-Range`` header of the chunk
+        :param stream: Request body stream
+        :return: Offset after the chunk
+        :raises: :class:`~app.core.ApiException` for invalid ranges, or
+            ranges not starting at the current offset
+        """
+        cr = parse_content_range_header(content_range)
+        if cr is None or cr.units != 'bytes' or cr.length != self.size:
+            raise ApiException('Invalid Content-Range: {}'.format(
+                content_range))
+        with open(self.path, 'ab') as f:
+            # Concurrent requests must not interleave chunks
+            fcntl.flock(f, fcntl.LOCK_EX)
+            offset = os.fstat(f.fileno()).st_size
+            if cr.start != offset:
+                raise ApiException(
+                    'Chunk must start at offset {}'.format(offset), 409)
+            hashes = None
+            if self.kind in HASHED:
+                state = _pop_hashes(self.id)
+                if state is not None and state[0] == offset:
+                    hashes = state[1]
+                elif offset == 0:
+                    hashes = Hashes()
+            try:
+                remaining = cr.stop - cr.start
+                while remaining:
+                    chunk = stream.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    if hashes is not None:
+                        hashes.update(chunk)
+                    remaining -= len(chunk)
+                    offset += len(chunk)
+            finally:
+                # Bytes received before a disconnect are kept
+                f.flush()
+                if hashes is not None:
+                    _put_hashes(self.id, offset, hashes)
+        return offset
+
+    def finalize(self):
+        """Complete the upload. The part file is kept at :attr:`path`
+        until it is moved by the caller.
+
+        :return: :class:`~app.utils.Digests` of the file, ``None`` for
+            kinds which are not hashed
+        :raises: :class:`~app.core.ApiException` if the upload is incomplete
+        """
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            raise ApiException('Upload session not found', 404)
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            offset = os.fstat(f.fileno()).st_size
+            if offset != self.size:
+                raise ApiException(
+                    'Upload incomplete: {} of {} bytes received'.format(
+                        offset, self.size), 409)
+            try:
+                os.unlink(self._meta_path)
+            except FileNotFoundError:
+                # Finalized by a concurrent request
+                raise ApiException('Upload session not found', 404)
+            if self.kind not in HASHED:
+                return None
+            # Part files are only appended to, so the digests of the
+            # chunks received by this process are completed
+            done, hashes = _pop_hashes(self.id) or (0, Hashes())
+            f.seek(done)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                hashes.update(chunk)
+            return hashes.digests()
+
+    def delete(self):
+        """Abort the upload and remove its files"""
+        _pop_hashes(self.id)
+        remove_file(self._meta_path)
+        remove_file(self.path)
+
+    def serialize(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': self.offset,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                     time.gmtime(self.created))
+        }
+
+
+def clean(ttl=None):
+    """Remove upload sessions, and other files left in the temporary upload
+    directories, which have not been written to for ``ttl`` seconds
+
+    :param ttl: Defaults to ``UPLOAD_SESSION_TTL``
+    :return: Number of removed files
+    """
+    if ttl is None:
+        ttl = current_app.config['UPLOAD_SESSION_TTL']
+    limit = time.time() - ttl
+    removed = 0
+    for kind in DIRECTORIES:
+        directory = UploadSession.directory(kind)
+        if not os.path.isdir(directory):
+            continue
+        for filename in os.listdir(directory):
+            entry = os.path.join(directory, filename)
+            if not os.path.isfile(entry):
+                continue
+            name, ext = os.path.splitext(entry)
+            # The part file is what chunks update
+            path = name + '.part' if ext == '.json' else entry
+            try:
+                try:
+                    mtime = os.path.getmtime(path)
+                except FileNotFoundError:
+                    mtime = os.path.getmtime(entry)
+                if mtime < limit:
+                    os.unlink(entry)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
@@ -4,12 +4,9 @@
 
     This package holds all endpoints that will be exposed to customers
 """
-import json
-import datetime
 from flask import Blueprint
 from flask import current_app, request, g
 from flask_login import login_required
-from app.utils import addslashes, _HTTP_METHOD_TO_AUDIT_MAP
 from app.api.decorators import rate_limit, crossdomain
 
 version_ = (0, 6, 5)
@@ -39,31 +36,6 @@ def cp_audit_log(response):
     :param response: Server :class:`~flask.Response`
     :return: :class:`~flask.Response`
     """
-    try:
-        jdata = json.loads(request.data.decode())
-        if 'password' in jdata:
-            jdata['password'] = '*********'
-        jdata_str = json.dumps(jdata)
-    except ValueError:
-        jdata_str = ''
-
-    kwargs = {
-        'module': cp.name,
-        'user': g.user.name,
-        'email': g.user.email,
-        'action': _HTTP_METHOD_TO_AUDIT_MAP[request.method.lower()],
-        'data': addslashes(jdata_str),
-        'url': request.url,
-        'endpoint': request.endpoint,
-        'ip': request.remote_addr,
-        'status': response.status,
-        'timestamp': datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-    }
-    if not request.view_args and request.method.lower() == 'put':
-        kwargs['action'] = _HTTP_METHOD_TO_AUDIT_MAP['post']
-    entry = []
-    for k, v in kwargs.items():
-        entry.append('{0!s}="{1!s}"'.format(k, v))
-    entry = ' '.join(entry)
-    current_app.audit_log.info('{0!s}'.format(entry))
+    current_app.audit_log.record(cp.name, g.user, response,
+                                 mask_password=True)
     return response
@@ -44,6 +44,8 @@ def get_fqdns():
           ]
         }
 
+    :query fields: Comma separated list of attributes to return
+    :query expand: Comma separated list of relationships to return
     :reqheader Accept: Content type(s) accepted by the client
     :resheader Content-Type: this depends on `Accept` header or request
 
@@ -58,7 +60,7 @@ def get_fqdns():
     fqdns = Fqdn.query.\
         filter(Fqdn.organization_id == g.user.organization_id).\
         all()
-    return ApiResponse({'fqdns': [f.serialize() for f in fqdns]})
+    return ApiResponse({'fqdns': fqdns})
 
 
 @cp.route('/fqdns/<int:fqdn_id>', methods=['GET'])
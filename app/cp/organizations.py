@@ -2,7 +2,7 @@ from flask import g, request
 from flask_jsonschema import validate
 from app.core import ApiResponse
 from app import db
-from app.models import Organization, Permission, ContactEmail, Email
+from app.models import Organization, Permission
 from app.api.decorators import permission_required
 from . import cp
 
@@ -90,7 +90,8 @@ def get_cp_organization():
     :status 404: Resource not found
     """
     org_id = g.user.organization_id or 0
-    o = Organization.query.get_or_404(org_id)
+    o = Organization.query.options(
+        *Organization.eager_options()).get_or_404(org_id)
     return ApiResponse(o.serialize())
 
 
@@ -194,21 +195,13 @@ def update_cp_organization():
 
     contact_emails = request.json.pop('contact_emails', [])
     abuse_emails = request.json.pop('abuse_emails', [])
+    ip_ranges = request.json.pop('ip_ranges', None)
+    asns = request.json.pop('asns', None)
+    fqdns = request.json.pop('fqdns', None)
     o.from_json(request.json)
-    o.contact_emails = []
-    o.abuse_emails = []
-
-    for ac in abuse_emails:
-        o.abuse_emails.append(ac)
-
-    for e in contact_emails:
-        cp = e.get('cp', 0)
-        fmb = e.get('fmb', 0)
-        o.contact_emails.append(
-            ContactEmail(
-                email_=Email(email=e['email']),
-                fmb=fmb,
-                cp=cp))
+    o.update_collections(ip_ranges=ip_ranges, asns=asns, fqdns=fqdns,
+                         abuse_emails=abuse_emails,
+                         contact_emails=contact_emails)
 
     db.session.add(o)
     db.session.commit()
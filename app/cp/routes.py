@@ -1,11 +1,12 @@
-import os
-from flask import request, current_app, g
+from flask import request, current_app, g, url_for
 from app import db
 from app.core import ApiResponse, ApiPagedResponse
+from app.core.uploads import UploadSession
 from app.models import Sample, Permission
 from app.api.decorators import permission_required
+from app.api.samples import create_uploaded_sample
 from app.tasks import analysis
-from app.utils import get_hashes
+from app.utils import save_sample
 from . import cp
 
 
@@ -175,18 +176,12 @@ def add_cp_sample():
     """
     uploaded_samples = []
     for idx, file_ in request.files.items():
-        buf = file_.stream.read()
-        hashes = get_hashes(buf)
-
-        hash_path = os.path.join(
+        hashes = save_sample(
+            file_.stream,
             current_app.config['APP_UPLOADS_SAMPLES'],
-            hashes.sha256
+            current_app.config['APP_UPLOADS_SAMPLES_TMP']
         )
 
-        if not os.path.isfile(hash_path):
-            file_.stream.seek(0)
-            file_.save(hash_path)
-
         s = Sample(user_id=g.user.id, filename=file_.filename, md5=hashes.md5,
                    sha1=hashes.sha1, sha256=hashes.sha256,
                    sha512=hashes.sha512, ctph=hashes.ctph)
@@ -204,3 +199,101 @@ def add_cp_sample():
         'message': 'Files uploaded',
         'files': uploaded_samples
     }, 201)
+
+
+@cp.route('/samples/uploads', methods=['POST'])
+@permission_required(Permission.SUBMITSAMPLE)
+def add_cp_sample_upload():
+    """Start a resumable upload of a large sample.
+    See :http:post:`/api/1.0/samples/uploads`.
+
+    :<json string filename: File name
+    :<json integer size: File size in bytes
+    :>json string id: Upload unique ID
+    :>json integer offset: Number of bytes received
+
+    :status 201: Upload started
+    :status 400: Missing file name or invalid size
+    :status 413: File larger than ``UPLOAD_MAX_SIZE``
+    """
+    upload = UploadSession.create('samples', g.user.id, request.get_json())
+    return ApiResponse(
+        upload.serialize(), 201,
+        {'Location': url_for('cp.get_cp_sample_upload', upload_id=upload.id)})
+
+
+@cp.route('/samples/uploads/<string:upload_id>', methods=['GET'])
+@permission_required(Permission.SUBMITSAMPLE)
+def get_cp_sample_upload(upload_id):
+    """Return the state of a resumable upload.
+    See :http:get:`/api/1.0/samples/uploads/(string:upload_id)`.
+
+    :param upload_id: Upload unique ID
+
+    :>json integer offset: Number of bytes received
+
+    :status 200: Upload found
+    :status 404: Upload not found or expired
+    """
+    upload = UploadSession.get('samples', upload_id, g.user.id)
+    return ApiResponse(upload.serialize())
+
+
+@cp.route('/samples/uploads/<string:upload_id>', methods=['PUT'])
+@permission_required(Permission.SUBMITSAMPLE)
+def update_cp_sample_upload(upload_id):
+    """Send a chunk of a resumable upload.
+    See :http:put:`/api/1.0/samples/uploads/(string:upload_id)`.
+
+    :param upload_id: Upload unique ID
+
+    :reqheader Content-Range: Byte range of the chunk and file size
+    :>json integer offset: Number of bytes received
+
+    :status 200: Chunk saved
+    :status 400: Invalid ``Content-Range``
+    :status 404: Upload not found or expired
+    :status 409: The chunk does not start at the current offset
+    """
+    upload = UploadSession.get('samples', upload_id, g.user.id)
+    offset = upload.write(request.headers.get('Content-Range'),
+                          request.stream)
+    return ApiResponse({'message': 'Chunk saved', 'offset': offset})
+
+
+@cp.route('/samples/uploads/<string:upload_id>/finalize', methods=['POST'])
+@permission_required(Permission.SUBMITSAMPLE)
+def finalize_cp_sample_upload(upload_id):
+    """Complete a resumable upload and add the sample.
+    See :http:post:`/api/1.0/samples/uploads/(string:upload_id)/finalize`.
+
+    :param upload_id: Upload unique ID
+
+    :>json array files: List of saved samples
+    :>json string message: Status message
+
+    :status 201: Sample saved
+    :status 404: Upload not found or expired
+    :status 409: Some bytes were not received yet
+    """
+    upload = UploadSession.get('samples', upload_id, g.user.id)
+    s = create_uploaded_sample(upload)
+    return ApiResponse({
+        'message': 'Files uploaded',
+        'files': [s.serialize()]
+    }, 201)
+
+
+@cp.route('/samples/uploads/<string:upload_id>', methods=['DELETE'])
+@permission_required(Permission.SUBMITSAMPLE)
+def delete_cp_sample_upload(upload_id):
+    """Abort a resumable upload.
+    See :http:delete:`/api/1.0/samples/uploads/(string:upload_id)`.
+
+    :param upload_id: Upload unique ID
+
+    :status 200: Upload deleted
+    :status 404: Upload not found or expired
+    """
+    UploadSession.get('samples', upload_id, g.user.id).delete()
+    return ApiResponse({'message': 'Upload deleted'})
@@ -3,12 +3,16 @@ import base64
 import datetime
 import binascii
 import hashlib
+import threading
+import time
+from collections import OrderedDict
 from urllib.error import HTTPError
 from mailmanclient import MailmanConnectionError, Client
 import onetimepass
 from app import db, login_manager, config
-from sqlalchemy import desc
+from sqlalchemy import desc, event
 from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import Session, selectinload, joinedload
 from flask_sqlalchemy import BaseQuery
 from flask import current_app, request
 from sqlalchemy.ext.associationproxy import association_proxy
@@ -16,6 +20,7 @@ from werkzeug.security import check_password_hash, generate_password_hash
 from flask_login import UserMixin
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired
 from itsdangerous import BadTimeSignature, TimedJSONWebSignatureSerializer
+from app.core import audit, counts
 from app.utils.mixins import SerializerMixin
 from app.utils.inflect import pluralize
 
@@ -223,6 +228,9 @@ class User(UserMixin, Model, SerializerMixin):
     _password = db.Column('password', db.String(255), nullable=False)
     email = db.Column(db.String(255), unique=True)
     api_key = db.Column(db.String(64), nullable=True)
+    #: SHA-256 of :attr:`api_key`, set with it. API requests are
+    #: authenticated by this indexed column.
+    api_key_hash = db.Column(db.String(64), nullable=True, index=True)
     is_admin = db.Column(db.Boolean(), default=False)
     deleted = db.Column(db.Integer, default=0)
     otp_secret = db.Column(db.String(16))
@@ -356,6 +364,10 @@ class User(UserMixin, Model, SerializerMixin):
         rand = self.random_str()
         return hashlib.sha256(rand.encode()).hexdigest()
 
+    @staticmethod
+    def hash_api_key(api_key):
+        return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
     @staticmethod
     def random_str(length=64):
         return binascii.hexlify(os.urandom(length)).decode()
@@ -368,6 +380,11 @@ class User(UserMixin, Model, SerializerMixin):
         return self.can(Permission.ADMINISTER)
 
 
+@event.listens_for(User.api_key, 'set')
+def _set_api_key_hash(target, value, oldvalue, initiator):
+    target.api_key_hash = User.hash_api_key(value) if value else None
+
+
 class Permission:
     """Permissions pseudo-model. Uses 8 bits to assign permissions.
     Each permission is assigned a bit possion and for each role the
@@ -672,6 +689,15 @@ class Organization(Model, SerializerMixin):
         'order_by': abbreviation
     }
 
+    __eager__ = {
+        'ip_ranges': selectinload('ip_ranges_'),
+        'asns': selectinload('asns_'),
+        'fqdns': selectinload('fqdns_'),
+        'abuse_emails': selectinload('abuse_emails_'),
+        'contact_emails': selectinload('contact_emails').joinedload('email_'),
+        'group': joinedload('group')
+    }
+
     @staticmethod
     def from_collab(customer):
         """Import organization from collab
@@ -720,10 +746,86 @@ class Organization(Model, SerializerMixin):
         org.group_id = 1
         return org
 
+    def update_collections(self, ip_ranges=None, asns=None, fqdns=None,
+                           abuse_emails=None, contact_emails=None):
+        """Update related collections to the given values. Only rows of
+        added or removed values are inserted or deleted, and contact
+        e-mails are updated in place. ``None`` leaves a collection as is.
+
+        :param contact_emails: List of ``{'email': ..., 'cp': ...,
+            'fmb': ...}`` dictionaries
+        """
+        if ip_ranges is not None:
+            _sync_collection(self.ip_ranges_, 'ip_range', ip_ranges,
+                             lambda r: IpRange(ip_range=r))
+        if asns is not None:
+            _sync_collection(self.asns_, 'asn', asns, lambda a: Asn(asn=a))
+        if fqdns is not None:
+            _sync_collection(self.fqdns_, 'fqdn', fqdns,
+                             lambda f: Fqdn(fqdn=f))
+        removed = []
+        if abuse_emails is not None:
+            _, stale = _sync_collection(
+                self.abuse_emails_, 'email', abuse_emails,
+                lambda e: Email(email=e))
+            removed.extend(stale)
+        if contact_emails is not None:
+            current, stale = _sync_collection(
+                self.contact_emails, 'email',
+                [e['email'] for e in contact_emails],
+                lambda e: ContactEmail(email_=Email(email=e)))
+            removed.extend(c.email_ for c in stale)
+            for e in contact_emails:
+                contact = current[e['email']]
+                for attr in ('cp', 'fmb'):
+                    value = bool(e.get(attr, 0))
+                    if getattr(contact, attr) is None or \
+                            bool(getattr(contact, attr)) != value:
+                        setattr(contact, attr, value)
+        _delete_unused_emails(removed)
+
     def __repr__(self):
         return '{} #{}'.format(self.__class__.__name__, self.abbreviation)
 
 
+def _sync_collection(collection, key, values, creator):
+    """Make ``collection`` hold one item per value of ``values``, matched
+    on attribute ``key``. Items of other values are removed and missing
+    values are added with ``creator``.
+
+    :return: ``(items, removed)`` tuple. ``items`` maps values to items.
+    """
+    wanted = set(values)
+    items, removed = {}, []
+    for item in list(collection):
+        value = getattr(item, key)
+        if value in wanted and value not in items:
+            items[value] = item
+        else:
+            collection.remove(item)
+            removed.append(item)
+    for value in values:
+        if value not in items:
+            items[value] = creator(value)
+            collection.append(items[value])
+    return items, removed
+
+
+def _delete_unused_emails(emails):
+    """Delete ``emails`` which are neither abuse nor contact e-mails of
+    any organization
+    """
+    for email in emails:
+        if email is None or email.id is None:
+            continue
+        used = db.session.query(emails_organizations.c.id).filter(
+            emails_organizations.c.email_id == email.id).first() or \
+            db.session.query(ContactEmail.id).filter(
+                ContactEmail.email_id == email.id).first()
+        if not used:
+            db.session.delete(email)
+
+
 class Tag(Model, SerializerMixin):
     __tablename__ = 'tags'
     __public__ = ('id', 'name')
@@ -1018,6 +1120,92 @@ class Contact(Model):
     deleted = db.Column(db.Integer, default=0)
 
 
+class AuditEntry(Model, SerializerMixin):
+    """Audit log entry of a request. Entries are only ever inserted, by
+    the audit log writer, see :mod:`app.core.audit`.
+    """
+    __tablename__ = 'audit_log'
+    __public__ = ('id', 'created', 'module', 'user', 'email', 'action',
+                  'data', 'url', 'endpoint', 'ip', 'status')
+    id = db.Column(db.Integer, primary_key=True)
+    created = db.Column(db.DateTime, index=True,
+                        default=datetime.datetime.utcnow)
+    module = db.Column(db.String(20))
+    user = db.Column(db.String(255), index=True)
+    email = db.Column(db.String(255), index=True)
+    action = db.Column(db.String(20), index=True)
+    data = db.Column(db.Text)
+    url = db.Column(db.Text)
+    endpoint = db.Column(db.String(255), index=True)
+    ip = db.Column(db.String(45), index=True)
+    status = db.Column(db.Integer, index=True)
+
+    __mapper_args__ = {'order_by': desc(id)}
+
+    @classmethod
+    def store(cls, app, records):
+        """Insert queued audit log ``records`` with one statement
+
+        :param app: Application, records are stored by a background thread
+        :param records: Records queued by :class:`app.core.audit.AuditLog`
+        """
+        rows = []
+        for record in records:
+            values = audit.fields(record)
+            rows.append({
+                'created': datetime.datetime.utcfromtimestamp(
+                    record['created']),
+                'updated': None,
+                'module': values['module'],
+                'user': values['user'],
+                'email': values['email'],
+                'action': values['action'],
+                'data': values['data'],
+                'url': values['url'],
+                'endpoint': values['endpoint'],
+                'ip': values['ip'],
+                'status': int(values['status'].split()[0])
+            })
+        with app.app_context():
+            db.engine.execute(cls.__table__.insert(), rows)
+        # Inserted without a session, so cached counts are not dropped
+        counts.invalidate({cls.__tablename__})
+
+
+@event.listens_for(Session, 'before_flush')
+def _touch_organizations(session, flush_context, instances):
+    """Keep :attr:`Organization.updated` in sync with changes of its IP
+    ranges, AS numbers, FQDNs and e-mails. Collection changes and hard
+    deletes of related rows do not update the organization row otherwise.
+    """
+    now = datetime.datetime.utcnow()
+    touched = session.info.setdefault('touched_organizations', set())
+    for obj in session.dirty:
+        if isinstance(obj, Organization) and session.is_modified(obj):
+            obj.updated = now
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (IpRange, Asn, Fqdn, ContactEmail)) and \
+                obj.organization_id:
+            touched.add(obj.organization_id)
+
+
+def touch_organizations(session, ids):
+    """Set :attr:`Organization.updated` of organizations ``ids`` to now,
+    e.g. after bulk inserts of related rows, which bypass flush events.
+    """
+    session.execute(
+        Organization.__table__.update().
+        where(Organization.id.in_(ids)).
+        values(updated=datetime.datetime.utcnow()))
+
+
+@event.listens_for(Session, 'after_flush')
+def _touch_related_organizations(session, flush_context):
+    touched = session.info.pop('touched_organizations', None)
+    if touched:
+        touch_organizations(session, touched)
+
+
 @login_manager.user_loader
 def load_user(user_id):
     """
@@ -1080,6 +1268,85 @@ def load_token(token):
     return None
 
 
+#: Maximum number of cached API users
+API_KEY_CACHE_SIZE = 1024
+
+_api_users = OrderedDict()
+_api_users_lock = threading.Lock()
+
+
+def load_api_user(api_key):
+    """Return the user of ``api_key``, or ``None``.
+
+    Users are looked up by :attr:`User.api_key_hash` and kept, with their
+    role, for ``API_KEY_CACHE_TTL`` seconds. Cached users are loaded in a
+    separate session and merged into the request session without loading
+    them again, so cached requests do not query the database. Entries are
+    dropped when a session changing the user or any role is committed in
+    this process. Changes made by other processes are picked up when
+    entries expire.
+    """
+    key_hash = User.hash_api_key(api_key)
+    ttl = current_app.config.get('API_KEY_CACHE_TTL', 0)
+    now = time.time()
+    entry = _api_users.get(key_hash)
+    if ttl and entry is not None and entry[0] > now:
+        return db.session.merge(entry[1], load=False)
+    if not ttl:
+        return User.query.filter_by(api_key_hash=key_hash).first()
+    session = db.session.session_factory()
+    try:
+        user = session.query(User).options(joinedload(User.role)).\
+            filter_by(api_key_hash=key_hash).first()
+    finally:
+        session.close()
+    if user is None:
+        return None
+    with _api_users_lock:
+        _api_users[key_hash] = (now + ttl, user)
+        _api_users.move_to_end(key_hash)
+        while len(_api_users) > API_KEY_CACHE_SIZE:
+            _api_users.popitem(last=False)
+    return db.session.merge(user, load=False)
+
+
+def invalidate_api_users(user_ids=None):
+    """Drop cached API users ``user_ids``, or all cached API users"""
+    with _api_users_lock:
+        if user_ids is None:
+            _api_users.clear()
+            return
+        for key in [k for k, e in _api_users.items()
+                    if e[1].id in user_ids]:
+            del _api_users[key]
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_api_users(session, flush_context):
+    users = session.info.get('api_users', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if users is None:
+            break
+        if isinstance(obj, Role):
+            # Drop all users, as their permissions may have changed
+            users = None
+        elif isinstance(obj, User):
+            users.add(obj.id)
+    if users is None or users:
+        session.info['api_users'] = users
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_api_users(session):
+    if 'api_users' in session.info:
+        invalidate_api_users(session.info.pop('api_users'))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_api_users(session, previous_transaction):
+    session.info.pop('api_users', None)
+
+
 @login_manager.request_loader
 def load_user_from_request(request):
     """Login users using api_key for header values
@@ -1091,7 +1358,7 @@ def load_user_from_request(request):
     # first, try to login using the api_key url arg
     api_key = request.args.get('api_authorization')
     if api_key:
-        user = User.query.filter_by(api_key=api_key).first()
+        user = load_api_user(api_key)
         if user:
             current_app.log.warn(
                 "{} logged in using URL parameter".format(user.name)
@@ -1101,7 +1368,7 @@ def load_user_from_request(request):
     # next, try to login using an API key
     api_key = request.headers.get('API-Authorization')
     if api_key:
-        user = User.query.filter_by(api_key=api_key).first()
+        user = load_api_user(api_key)
         if user:
             return user
 
@@ -1,5 +1,6 @@
 import subprocess
 from app import celery, gpg
+from app.core import uploads
 
 
 def popen(*args, **kwargs):
@@ -21,3 +22,12 @@ def send_to_ks(ks, fingerprints):
     :return:
     """
     gpg.gnupg.send_keys(ks, *fingerprints)
+
+
+@celery.task
+def clean_uploads():
+    """Remove stale resumable uploads, see :func:`app.core.uploads.clean`
+
+    :return: Number of removed files
+    """
+    return uploads.clean()
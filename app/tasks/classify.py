@@ -0,0 +1,281 @@
+"""
+    Bulk indicator classification tasks
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Attribute large feed files (CSV or NDJSON) to constituents.
+    Input files are streamed line by line and results are spooled to disk,
+    so memory usage does not depend on the size of the feed.
+
+    Each job is stored in ``CLASSIFY_JOBS_PATH`` as:
+
+    * ``<job_id>.in``: uploaded feed, removed when the job is done
+    * ``<job_id>.json``: job status
+    * ``<job_id>.zip``: result archive with one CSV file per organization
+
+    Jobs expire ``CLASSIFY_JOBS_TTL`` seconds after their status was last
+    written, and their files are removed by :func:`clean_jobs`.
+"""
+import os
+import io
+import csv
+import json
+import shutil
+import tempfile
+import time
+import zipfile
+import datetime
+from collections import defaultdict
+from flask import current_app
+from werkzeug.utils import secure_filename
+from app import celery
+from app.constituency import Classifier
+
+#: Update the job status every this many indicators
+PROGRESS_INTERVAL = 10000
+#: Flush results to disk once this many are buffered
+BUFFER_SIZE = 50000
+#: Archive member holding indicators not attributed to any organization
+UNATTRIBUTED = '_unattributed'
+
+FORMATS = ('csv', 'ndjson')
+
+
+def job_path(job_id, ext):
+    """Return the path of a job file
+
+    :param job_id: Job unique ID
+    :param ext: File extension: ``in``, ``json`` or ``zip``
+    """
+    return os.path.join(current_app.config['CLASSIFY_JOBS_PATH'],
+                        '{}.{}'.format(job_id, ext))
+
+
+def _expired(path):
+    """Return ``True`` if job file ``path`` is older than
+    ``CLASSIFY_JOBS_TTL``
+    """
+    ttl = current_app.config['CLASSIFY_JOBS_TTL']
+    return os.path.getmtime(path) < time.time() - ttl
+
+
+def read_status(job_id):
+    """Return job status or ``None`` if the job doesn't exist or has
+    expired
+    """
+    path = job_path(job_id, 'json')
+    try:
+        if _expired(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_status(job_id, status):
+    path = job_path(job_id, 'json')
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(status, f)
+    os.replace(tmp, path)
+
+
+def create_job(job_id, file, fmt, field=None, header=False):
+    """Save uploaded ``file`` and write the initial job status
+
+    :param job_id: Job unique ID
+    :param file: :class:`~werkzeug.datastructures.FileStorage`
+    :param fmt: Input format. One of :data:`FORMATS`
+    :param field: CSV column index or NDJSON object key holding
+        the indicator
+    :param header: The first CSV row is a header
+    :return: Job status
+    """
+    os.makedirs(current_app.config['CLASSIFY_JOBS_PATH'], exist_ok=True)
+    path = job_path(job_id, 'in')
+    file.save(path)
+    status = {
+        'id': job_id,
+        'state': 'PENDING',
+        'filename': file.filename,
+        'format': fmt,
+        'field': field,
+        'header': header,
+        'created': datetime.datetime.utcnow().isoformat(),
+        'size': os.path.getsize(path),
+        'read': 0,
+        'processed': 0,
+        'attributed': 0
+    }
+    write_status(job_id, status)
+    return status
+
+
+def read_indicators(f, fmt, field=None, header=False):
+    """Yield indicators from text file ``f``
+
+    :param f: File object
+    :param fmt: ``csv`` or ``ndjson``
+    :param field: CSV column index (default 0) or NDJSON object key
+        (default ``indicator``). NDJSON lines can also be plain strings.
+    :param header: Skip the first CSV row
+    """
+    if fmt == 'ndjson':
+        key = field or 'indicator'
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(item, dict):
+                item = item.get(key)
+            if isinstance(item, str):
+                yield item
+    else:
+        column = int(field or 0)
+        reader = csv.reader(f)
+        if header:
+            next(reader, None)
+        for row in reader:
+            if len(row) > column:
+                yield row[column]
+
+
+class _ResultSpool(object):
+    """Buffer results per organization and append them to per-organization
+    CSV files in ``workdir``.
+    """
+
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self.buffers = defaultdict(list)
+        self.buffered = 0
+        self.files = {}
+        self.counts = defaultdict(int)
+
+    def add(self, abbreviation, indicator, type_):
+        self.buffers[abbreviation].append((indicator, type_))
+        self.counts[abbreviation] += 1
+        self.buffered += 1
+        if self.buffered >= BUFFER_SIZE:
+            self.flush()
+
+    def _filename(self, abbreviation):
+        if abbreviation not in self.files:
+            name = base = secure_filename(abbreviation) or 'organization'
+            used = set(self.files.values())
+            suffix = 1
+            while name in used:
+                name = '{}-{}'.format(base, suffix)
+                suffix += 1
+            self.files[abbreviation] = name
+        return self.files[abbreviation]
+
+    def flush(self):
+        for abbreviation, rows in self.buffers.items():
+            path = os.path.join(self.workdir,
+                                self._filename(abbreviation) + '.csv')
+            with open(path, 'a', newline='') as f:
+                csv.writer(f).writerows(rows)
+        self.buffers.clear()
+        self.buffered = 0
+
+    def archive(self, path):
+        self.flush()
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name in sorted(self.files.values()):
+                zf.write(os.path.join(self.workdir, name + '.csv'),
+                         name + '.csv')
+
+
+@celery.task
+def classify_indicators(job_id):
+    """Attribute all indicators of job ``job_id`` to organizations.
+    Results are written to a ZIP archive with one ``<abbreviation>.csv``
+    file (columns: indicator, type) per organization. Indicators that
+    could not be attributed are saved to ``_unattributed.csv``.
+
+    :param job_id: Job unique ID
+    """
+    status = read_status(job_id)
+    if status is None:
+        # Expired before a worker picked it up
+        return None
+    status['state'] = 'PROGRESS'
+    write_status(job_id, status)
+    input_path = job_path(job_id, 'in')
+    workdir = tempfile.mkdtemp(dir=current_app.config['CLASSIFY_JOBS_PATH'])
+    try:
+        classifier = Classifier()
+        spool = _ResultSpool(workdir)
+        with open(input_path, 'rb') as raw:
+            text = io.TextIOWrapper(raw, encoding='utf-8', errors='replace',
+                                    newline='')
+            indicators = read_indicators(
+                text, status['format'], status['field'],
+                status.get('header', False))
+            for indicator in indicators:
+                type_, abbreviation = classifier.classify(indicator)
+                status['processed'] += 1
+                if abbreviation is None:
+                    spool.add(UNATTRIBUTED, indicator, type_ or '')
+                else:
+                    status['attributed'] += 1
+                    spool.add(abbreviation, indicator, type_)
+                if status['processed'] % PROGRESS_INTERVAL == 0:
+                    status['read'] = raw.tell()
+                    write_status(job_id, status)
+        result_path = job_path(job_id, 'zip')
+        spool.archive(result_path + '.tmp')
+        os.replace(result_path + '.tmp', result_path)
+        status['read'] = status['size']
+        status['organizations'] = {
+            k: v for k, v in spool.counts.items() if k != UNATTRIBUTED}
+        status['state'] = 'SUCCESS'
+    except Exception as e:
+        current_app.log.exception(e)
+        status['state'] = 'FAILURE'
+        status['error'] = str(e)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        try:
+            os.remove(input_path)
+        except FileNotFoundError:
+            pass
+        write_status(job_id, status)
+    return status['state']
+
+
+@celery.task
+def clean_jobs():
+    """Remove the files of expired jobs, and work directories left by
+    interrupted jobs
+
+    :return: Number of removed jobs
+    """
+    jobs_path = current_app.config['CLASSIFY_JOBS_PATH']
+    if not os.path.isdir(jobs_path):
+        return 0
+    removed = 0
+    for name in os.listdir(jobs_path):
+        path = os.path.join(jobs_path, name)
+        try:
+            if os.path.isdir(path):
+                if _expired(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+            job_id, ext = os.path.splitext(name)
+            if ext != '.json' or not _expired(path):
+                continue
+        except FileNotFoundError:
+            continue
+        for ext in ('in', 'zip', 'zip.tmp', 'json'):
+            try:
+                os.remove(job_path(job_id, ext))
+            except FileNotFoundError:
+                pass
+        removed += 1
+    return removed
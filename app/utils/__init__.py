@@ -4,10 +4,11 @@ import re
 import binascii
 import os
 import hashlib
+import tempfile
 from datetime import datetime, date
 from collections import namedtuple
 import ssdeep
-from app.utils.mixins import SerializerMixin
+from app.utils.mixins import SerializerMixin, get_fieldset
 
 _HTTP_METHOD_TO_AUDIT_MAP = {
     'post': 'add',
@@ -25,7 +26,7 @@ class JSONEncoder(BaseJSONEncoder):
         elif isinstance(o, datetime) or isinstance(o, date):
             return str(o)
         elif isinstance(o, SerializerMixin):
-            return o.serialize()
+            return o.serialize(**get_fieldset())
         return super(JSONEncoder, self).default(o)
 
 
@@ -54,13 +55,94 @@ def random_ascii(length=8):
     return binascii.hexlify(os.urandom(length)).decode('ascii')
 
 
+#: Size of the chunks read from uploads and sample files
+CHUNK_SIZE = 1024 * 1024
+
+Digests = namedtuple('Digests', 'md5 sha1 sha256 sha512 ctph')
+
+
+class Hashes:
+    """Compute the MD5, SHA1, SHA256, SHA512 and CTPH digests of data fed
+    in chunks, in a single pass.
+    """
+    def __init__(self):
+        self._hashes = [hashlib.md5(), hashlib.sha1(), hashlib.sha256(),
+                        hashlib.sha512(), ssdeep.Hash()]
+
+    def update(self, buf):
+        for h in self._hashes:
+            h.update(buf)
+
+    def digests(self):
+        """Return the :class:`Digests` of the data fed so far"""
+        return Digests._make(
+            [h.hexdigest() for h in self._hashes[:4]] +
+            [self._hashes[4].digest()])
+
+
 def get_hashes(buf):
-    hexdigests = namedtuple('Digests', 'md5 sha1 sha256 sha512 ctph')
+    """Return the :class:`Digests` of ``buf``
+
+    :param buf: Bytes, or the path of a file, read in chunks
+    """
+    hashes = Hashes()
     if isinstance(buf, str):
-        buf = open(buf, 'rb').read()
-    md5 = hashlib.md5(buf).hexdigest()
-    sha1 = hashlib.sha1(buf).hexdigest()
-    sha256 = hashlib.sha256(buf).hexdigest()
-    sha512 = hashlib.sha512(buf).hexdigest()
-    ctph = ssdeep.hash(buf)
-    return hexdigests._make((md5, sha1, sha256, sha512, ctph))
+        with open(buf, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                hashes.update(chunk)
+    else:
+        hashes.update(buf)
+    return hashes.digests()
+
+
+def remove_file(path):
+    """Remove file ``path``, if it exists"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def store_sample(path, digests, samples_dir):
+    """Move the sample file at ``path`` to ``samples_dir``, using its
+    SHA-256 as file name. The file is renamed, so partial files never show
+    up in ``samples_dir``. Existing files are not overwritten.
+
+    :param path: Sample file, on the same file system as ``samples_dir``
+    :param digests: :class:`Digests` of the file
+    :param samples_dir: Samples directory
+    """
+    hash_path = os.path.join(samples_dir, digests.sha256)
+    if os.path.isfile(hash_path):
+        os.unlink(path)
+    else:
+        os.chmod(path, 0o644)
+        os.replace(path, hash_path)
+
+
+def save_sample(stream, samples_dir, tmp_dir):
+    """Save the file read from ``stream`` in ``samples_dir``, see
+    :func:`store_sample`. The file is hashed while it is written to
+    ``tmp_dir``, so only one chunk is held in memory.
+
+    :param stream: File-like object
+    :param samples_dir: Samples directory
+    :param tmp_dir: Temporary directory, on the same file system as
+        ``samples_dir``
+    :return: :class:`Digests` of the file
+    """
+    os.makedirs(tmp_dir, exist_ok=True)
+    hashes = Hashes()
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                hashes.update(chunk)
+                f.write(chunk)
+        digests = hashes.digests()
+        store_sample(tmp_path, digests, samples_dir)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return digests
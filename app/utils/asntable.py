@@ -0,0 +1,142 @@
+"""
+    Prefix to origin AS table
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compact IP to AS number lookup table loaded from an offline RIB dump in
+    the `pyasn <https://github.com/hadiasghari/pyasn>`_ ``ipasn`` format::
+
+        ; IP-ASN32-DAT file
+        1.0.0.0/24	13335
+        1.0.4.0/22	38803
+
+    Prefixes are flattened into sorted, non-overlapping intervals (more
+    specific prefixes override less specific ones) and looked up with a
+    binary search.
+"""
+import re
+from array import array
+from bisect import bisect_right
+from app.utils.radix import parse_ip, parse_prefix
+
+_ASN_RE = re.compile(r'^\{?(?:AS)?(\d+)')
+
+
+def _flatten(prefixes):
+    """Turn nested ``(start, end, asn)`` prefixes into disjoint intervals.
+
+    :param prefixes: List of ``(start, end, asn)`` tuples
+    :return: Sorted list of ``(start, end, asn)`` tuples
+    """
+    prefixes.sort(key=lambda p: (p[0], -p[1]))
+    out = []
+
+    def emit(start, end, asn):
+        if start > end:
+            return
+        if out and out[-1][2] == asn and out[-1][1] + 1 == start:
+            out[-1] = (out[-1][0], end, asn)
+        else:
+            out.append((start, end, asn))
+
+    stack = []
+    pos = 0
+    for start, end, asn in prefixes:
+        while stack and stack[-1][0] < start:
+            top_end, top_asn = stack.pop()
+            emit(pos, top_end, top_asn)
+            pos = top_end + 1
+        if stack:
+            emit(pos, start - 1, stack[-1][1])
+        pos = start
+        stack.append((end, asn))
+    while stack:
+        top_end, top_asn = stack.pop()
+        emit(pos, top_end, top_asn)
+        pos = top_end + 1
+    return out
+
+
+class _Intervals(object):
+
+    def __init__(self, intervals, typecode=None):
+        if typecode:
+            self.starts = array(typecode, (i[0] for i in intervals))
+            self.ends = array(typecode, (i[1] for i in intervals))
+        else:
+            self.starts = [i[0] for i in intervals]
+            self.ends = [i[1] for i in intervals]
+        self.asns = array('I', (i[2] for i in intervals))
+
+    def __len__(self):
+        return len(self.asns)
+
+    def search(self, key):
+        idx = bisect_right(self.starts, key) - 1
+        if idx >= 0 and key <= self.ends[idx]:
+            return self.asns[idx]
+        return None
+
+
+class AsnTable(object):
+    """IP address to origin AS number table.
+
+    >>> t = AsnTable.from_lines(['10.0.0.0/8 1', '10.1.0.0/16 2'])
+    >>> t.lookup('10.1.0.1'), t.lookup('10.2.0.1'), t.lookup('11.0.0.1')
+    (2, 1, None)
+
+    :param prefixes: Iterable of ``(cidr, asn)`` tuples
+    :param skip_invalid: Skip invalid prefixes instead of raising
+        :class:`ValueError`
+    """
+
+    def __init__(self, prefixes, skip_invalid=False):
+        families = {4: [], 6: []}
+        for cidr, asn in prefixes:
+            try:
+                version, start, end = parse_prefix(cidr)
+            except ValueError:
+                if skip_invalid:
+                    continue
+                raise
+            families[version].append((start, end, int(asn)))
+        self._tables = {
+            4: _Intervals(_flatten(families[4]), 'I'),
+            6: _Intervals(_flatten(families[6]))
+        }
+
+    def __len__(self):
+        return sum(len(t) for t in self._tables.values())
+
+    @classmethod
+    def from_lines(cls, lines):
+        """Parse ``ipasn`` formatted lines. Comments (``;`` or ``#``) and
+        malformed lines are skipped. For AS sets the first AS is used.
+        """
+        def parse():
+            for line in lines:
+                line = line.strip()
+                if not line or line[0] in ';#':
+                    continue
+                fields = line.split()
+                if len(fields) < 2:
+                    continue
+                m = _ASN_RE.match(fields[1])
+                if m is None:
+                    continue
+                yield fields[0], int(m.group(1))
+        return cls(parse(), skip_invalid=True)
+
+    @classmethod
+    def from_file(cls, path):
+        """Load table from ``ipasn`` file ``path``"""
+        with open(path) as f:
+            return cls.from_lines(f)
+
+    def lookup(self, ip):
+        """Return the origin AS number of ``ip`` or ``None``
+
+        :param str ip: IPv4 or IPv6 address
+        :raises: :class:`ValueError` if ``ip`` is not a valid IP address
+        """
+        version, key = parse_ip(ip)
+        return self._tables[version].search(key)
@@ -0,0 +1,134 @@
+"""
+    IP range overlap analysis
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Sort-and-sweep analysis of a list of CIDR networks owned by different
+    parties, in O(n log n).
+
+    CIDR networks never partially overlap: two networks are either disjoint,
+    identical or one contains the other. After sorting by start address (and
+    largest network first), a stack of the enclosing networks is enough to
+    find, for each network, all networks containing it.
+"""
+from app.utils.radix import parse_prefix
+
+
+class _Node(object):
+    """Distinct network and all the entries registering it"""
+    __slots__ = ('version', 'start', 'end', 'entries', 'covered')
+
+    def __init__(self, version, start, end):
+        self.version = version
+        self.start = start
+        self.end = end
+        self.entries = []
+        #: Number of addresses covered by more specific networks
+        self.covered = 0
+
+    @property
+    def size(self):
+        return self.end - self.start + 1
+
+
+def _group(parsed):
+    """Group sorted ``(version, start, -end, priority, owner, item)``
+    tuples into :class:`_Node` instances
+    """
+    nodes = []
+    for version, start, end, _, owner, item in parsed:
+        end = -end
+        node = nodes[-1] if nodes else None
+        if node is None or (node.version, node.start, node.end) != \
+                (version, start, end):
+            node = _Node(version, start, end)
+            nodes.append(node)
+        node.entries.append((owner, item))
+    return nodes
+
+
+def _enclosing(owner, stack):
+    """Return the items of the most specific enclosing networks of the
+    same and of a different owner
+    """
+    same = other = None
+    for parent in reversed(stack):
+        for parent_owner, parent_item in parent.entries:
+            if same is None and parent_owner == owner:
+                same = parent_item
+            elif other is None and parent_owner != owner:
+                other = parent_item
+        if same is not None and other is not None:
+            break
+    return same, other
+
+
+def find_conflicts(ranges):
+    """Analyze CIDR networks and report conflicts.
+
+    ``ranges`` must be given in lookup priority order: when the same network
+    is registered more than once, the first entry wins.
+
+    The report is a dictionary with the following keys:
+
+    * ``invalid``: list of items which are not valid networks
+    * ``duplicates``: list of lists of items registering the same network
+    * ``overlaps``: list of ``(item, enclosing_item)`` tuples, where
+      ``item`` is inside a larger network of the same owner
+    * ``nested``: list of ``(item, enclosing_item)`` tuples, where ``item``
+      is inside a larger network of a different owner. Only the most
+      specific enclosing network is reported.
+    * ``unreachable``: list of ``(item, reason)`` tuples of networks which
+      never match in a longest-prefix lookup. ``reason`` is ``duplicate``
+      when the network is registered by an entry with higher priority, or
+      ``covered`` when more specific networks cover all of its addresses.
+
+    >>> r = find_conflicts([('10.0.0.0/8', 'A', 1), ('10.1.0.0/16', 'B', 2),
+    ...                     ('10.1.0.0/16', 'C', 3), ('x', 'D', 4)])
+    >>> r['invalid'], r['duplicates'], r['nested']
+    ([4], [[2, 3]], [(2, 1), (3, 1)])
+    >>> r['unreachable']
+    [(3, 'duplicate')]
+
+    :param ranges: Iterable of ``(cidr, owner, item)`` tuples. ``item`` is
+        returned in the report as is.
+    :return: Report dictionary
+    """
+    report = {'invalid': [], 'duplicates': [], 'overlaps': [], 'nested': [],
+              'unreachable': []}
+    parsed = []
+    for priority, (cidr, owner, item) in enumerate(ranges):
+        try:
+            version, start, end = parse_prefix(cidr.strip())
+        except (ValueError, AttributeError):
+            report['invalid'].append(item)
+            continue
+        parsed.append((version, start, -end, priority, owner, item))
+    parsed.sort(key=lambda p: p[:4])
+    nodes = _group(parsed)
+
+    def close(node):
+        winner = node.entries[0][1]
+        if len(node.entries) > 1:
+            report['duplicates'].append([item for _, item in node.entries])
+            report['unreachable'].extend(
+                (item, 'duplicate') for _, item in node.entries[1:])
+        if node.covered == node.size:
+            report['unreachable'].append((winner, 'covered'))
+
+    stack = []
+    for node in nodes:
+        while stack and (stack[-1].version != node.version or
+                         stack[-1].end < node.start):
+            close(stack.pop())
+        if stack:
+            stack[-1].covered += node.size
+            for owner, item in node.entries:
+                same, other = _enclosing(owner, stack)
+                if same is not None:
+                    report['overlaps'].append((item, same))
+                if other is not None:
+                    report['nested'].append((item, other))
+        stack.append(node)
+    while stack:
+        close(stack.pop())
+    return report
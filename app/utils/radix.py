@@ -0,0 +1,176 @@
+"""
+    Radix tree
+    ~~~~~~~~~~
+
+    Path-compressed binary (Patricia) tree used for longest-prefix-match
+    lookups of IPv4 and IPv6 addresses.
+"""
+import ipaddress
+import socket
+
+
+def parse_ip(ip):
+    """Parse an IP address string into a ``(version, int)`` tuple.
+    Uses :func:`socket.inet_pton` which is considerably faster than
+    :func:`ipaddress.ip_address` for large batches.
+
+    :param str ip: IPv4 or IPv6 address
+    :raises: :class:`ValueError` if ``ip`` is not a valid IP address
+    """
+    ip = ip.strip()
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+    except OSError:
+        pass
+    try:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+    except OSError:
+        raise ValueError(
+            '{!r} does not appear to be an IPv4 or IPv6 address'.format(ip))
+
+
+def parse_prefix(cidr):
+    """Parse a network string into a ``(version, start, end)`` tuple of
+    its first and last addresses. Host bits are ignored.
+
+    :param str cidr: IPv4 or IPv6 network, e.g. ``10.0.0.0/8``. A bare
+        address is a single host network.
+    :raises: :class:`ValueError` if ``cidr`` is not a valid network
+    """
+    address, _, prefixlen = cidr.partition('/')
+    version, key = parse_ip(address)
+    bits = 32 if version == 4 else 128
+    prefixlen = int(prefixlen) if prefixlen else bits
+    if not 0 <= prefixlen <= bits:
+        raise ValueError('Invalid prefix length in {!r}'.format(cidr))
+    host_bits = bits - prefixlen
+    start = (key >> host_bits) << host_bits
+    return version, start, start + (1 << host_bits) - 1
+
+
+class _Node(object):
+    __slots__ = ('key', 'prefixlen', 'value', 'children')
+
+    def __init__(self, key, prefixlen, value=None):
+        self.key = key
+        self.prefixlen = prefixlen
+        self.value = value
+        self.children = [None, None]
+
+
+class _Tree(object):
+    """Patricia tree for one address family.
+
+    :param bits: Address size in bits (32 or 128)
+    """
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.root = _Node(0, 0)
+        self.size = 0
+
+    def _bit(self, key, pos):
+        return (key >> (self.bits - 1 - pos)) & 1
+
+    def _mask(self, key, prefixlen):
+        shift = self.bits - prefixlen
+        return (key >> shift) << shift
+
+    def insert(self, key, prefixlen, value, replace=True):
+        node = self.root
+        while True:
+            if node.prefixlen == prefixlen:
+                if node.value is None:
+                    self.size += 1
+                elif not replace:
+                    return
+                node.value = value
+                return
+            bit = self._bit(key, node.prefixlen)
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = _Node(key, prefixlen, value)
+                self.size += 1
+                return
+            common = min(child.prefixlen, prefixlen,
+                         self.bits - (child.key ^ key).bit_length())
+            if common == child.prefixlen:
+                node = child
+                continue
+            if common == prefixlen:
+                new = _Node(key, prefixlen, value)
+                new.children[self._bit(child.key, prefixlen)] = child
+                node.children[bit] = new
+                self.size += 1
+                return
+            glue = _Node(self._mask(key, common), common)
+            glue.children[self._bit(key, common)] = \
+                _Node(key, prefixlen, value)
+            glue.children[self._bit(child.key, common)] = child
+            node.children[bit] = glue
+            self.size += 1
+            return
+
+    def search(self, key):
+        bits = self.bits
+        node = self.root
+        best = node.value
+        while node is not None:
+            plen = node.prefixlen
+            if (key ^ node.key) >> (bits - plen):
+                break
+            if node.value is not None:
+                best = node.value
+            if plen == bits:
+                break
+            node = node.children[(key >> (bits - 1 - plen)) & 1]
+        return best
+
+
+class RadixTree(object):
+    """Longest-prefix-match table for IPv4 and IPv6 networks.
+
+    >>> rt = RadixTree()
+    >>> rt.add('10.0.0.0/8', 'A')
+    >>> rt.add('10.1.0.0/16', 'B')
+    >>> rt.lookup('10.1.2.3')
+    'B'
+    >>> rt.lookup('10.2.0.1')
+    'A'
+    >>> rt.lookup('192.168.0.1') is None
+    True
+    """
+
+    def __init__(self):
+        self._trees = {4: _Tree(32), 6: _Tree(128)}
+
+    def __len__(self):
+        return sum(t.size for t in self._trees.values())
+
+    def add(self, cidr, value, replace=True):
+        """Add network ``cidr`` to the table.
+
+        :param cidr: CIDR string or :class:`ipaddress.IPv4Network` /
+            :class:`ipaddress.IPv6Network`
+        :param value: Value returned by :meth:`lookup`. Must not be ``None``.
+        :param replace: Replace the value of an already existing network
+        :raises: :class:`ValueError` if ``cidr`` is not a valid network
+        """
+        if not isinstance(cidr, (ipaddress.IPv4Network,
+                                 ipaddress.IPv6Network)):
+            cidr = ipaddress.ip_network(cidr.strip(), strict=False)
+        self._trees[cidr.version].insert(
+            int(cidr.network_address), cidr.prefixlen, value, replace)
+
+    def lookup(self, ip):
+        """Return the value of the most specific network containing ``ip``
+        or ``None``.
+
+        :param ip: IP address string or :class:`ipaddress.IPv4Address` /
+            :class:`ipaddress.IPv6Address`
+        :raises: :class:`ValueError` if ``ip`` is not a valid IP address
+        """
+        if isinstance(ip, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+            return self._trees[ip.version].search(int(ip))
+        version, key = parse_ip(ip)
+        return self._trees[version].search(key)
@@ -0,0 +1,91 @@
+"""
+    Domain suffix trie
+    ~~~~~~~~~~~~~~~~~~
+
+    Trie of reversed domain name labels used to find the longest registered
+    domain suffix of a hostname.
+"""
+from urllib.parse import urlsplit
+
+
+def hostname(value):
+    """Extract the lower-cased hostname from a URL or a bare hostname.
+    Scheme, credentials, port, path and trailing dot are discarded.
+
+    >>> hostname('https://user@WWW.cert.europa.eu:443/path?q=1')
+    'www.cert.europa.eu'
+    >>> hostname('cert.europa.eu.')
+    'cert.europa.eu'
+
+    :param str value: URL or hostname
+    :return: Hostname or ``None``
+    """
+    value = value.strip()
+    if '://' not in value:
+        value = '//' + value
+    try:
+        host = urlsplit(value).hostname
+    except ValueError:
+        return None
+    if not host:
+        return None
+    return host.rstrip('.')
+
+
+class SuffixTrie(object):
+    """Map domain names to values, matching on whole labels.
+
+    >>> st = SuffixTrie()
+    >>> st.add('europa.eu', 'EU')
+    >>> st.add('cert.europa.eu', 'CERT-EU')
+    >>> st.lookup('www.cert.europa.eu')
+    'CERT-EU'
+    >>> st.lookup('ec.europa.eu')
+    'EU'
+    >>> st.lookup('noteuropa.eu') is None
+    True
+    """
+    #: Key of the value stored on a node
+    _VALUE = None
+
+    def __init__(self):
+        self._root = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def _labels(name):
+        return reversed(name.lower().rstrip('.').split('.'))
+
+    def add(self, name, value, replace=True):
+        """Add domain ``name`` to the trie.
+
+        :param str name: Domain name
+        :param value: Value returned by :meth:`lookup`. Must not be ``None``.
+        :param replace: Replace the value of an already existing domain
+        """
+        node = self._root
+        for label in self._labels(name):
+            node = node.setdefault(label, {})
+        if self._VALUE not in node:
+            self._size += 1
+        elif not replace:
+            return
+        node[self._VALUE] = value
+
+    def lookup(self, name):
+        """Return the value of the longest domain ``name`` is equal to or
+        a subdomain of, or ``None``.
+
+        :param str name: Domain name
+        """
+        node = self._root
+        best = None
+        for label in self._labels(name):
+            node = node.get(label)
+            if node is None:
+                break
+            best = node.get(self._VALUE, best)
+        return best
@@ -70,10 +70,22 @@ class Config:
     APP_DATA = os.path.join(APP_STATIC, 'data')
     #: Uploaded files will be stored here
     APP_UPLOADS = os.path.join(APP_DATA, 'uploads')
+    #: Chunks of resumable uploads of trusted files are stored here
+    APP_UPLOADS_TMP = os.path.join(APP_UPLOADS, '.tmp')
     #: Uploaded malware samples will be store here.
     #: In production this is on a different disk mounted with noexec options
     APP_UPLOADS_SAMPLES = os.path.join(APP_DATA, 'samples')
     APP_UPLOADS_SAMPLES_TMP = os.path.join(APP_UPLOADS_SAMPLES, 'tmp')
+    #: Maximum size of files sent with resumable uploads, in bytes
+    UPLOAD_MAX_SIZE = 4 * 1024 ** 3
+    #: Resumable uploads not written to for this many seconds are removed,
+    #: with the other files left in the temporary upload directories
+    UPLOAD_SESSION_TTL = 24 * 3600
+    #: Bulk indicator classification jobs (uploaded feeds and results)
+    CLASSIFY_JOBS_PATH = os.path.join(APP_DATA, 'jobs')
+    #: Bulk classification jobs expire this many seconds after their last
+    #: status update
+    CLASSIFY_JOBS_TTL = 7 * 24 * 3600
     LOG_DIR = os.path.join(ROOT, 'logs')
     MISC_DIR = os.path.join(ROOT, 'misc')
     MIGRATIONS_DIR = os.path.join(MISC_DIR, 'migrations')
@@ -129,11 +141,20 @@ class Config:
     #: Accepted content
     CELERY_ACCEPT_CONTENT = ['pickle', 'json']
     #: Modules that are expected to use Celery
-    CELERY_IMPORTS = ['app.tasks']
+    CELERY_IMPORTS = ['app.tasks', 'app.tasks.classify']
     #: http://docs.celeryproject.org/en/latest/userguide/periodic-tasks.html
     #: Scheduled tasks require beat running:
     #: venv/bin/celery beat -A tasks.celery -l debug
-    CELERYBEAT_SCHEDULE = {}
+    CELERYBEAT_SCHEDULE = {
+        'clean-uploads': {
+            'task': 'app.tasks.clean_uploads',
+            'schedule': timedelta(hours=1)
+        },
+        'clean-classify-jobs': {
+            'task': 'app.tasks.classify.clean_jobs',
+            'schedule': timedelta(hours=1)
+        }
+    }
     CELERY_TIMEZONE = 'Europe/Brussels'
 
     #: Mailman API version to use (3.0 or 3.1)
@@ -220,6 +241,76 @@ class Config:
     #: Customer portal web root URL
     CP_WEB_ROOT = ''
 
+    #: Prefix to origin AS table (pyasn ``ipasn`` format) used for
+    #: AS based attribution of IP addresses.
+    #: See :http:put:`/api/1.0/organizations/check/asns`
+    ASN_DB_PATH = None
+
+    #: Cache total counts of paginated collections for this many seconds.
+    #: Set to 0 to disable. See :mod:`app.core.counts`
+    COUNT_CACHE_TTL = 30
+
+    #: JSON backend of API responses: ``auto``, ``orjson`` or ``json``.
+    #: See :mod:`app.core.encoding`
+    JSON_BACKEND = 'auto'
+
+    #: Compress responses with gzip or deflate when accepted by the client.
+    #: See :mod:`app.core.compression`
+    COMPRESS_ENABLED = True
+    #: Content types of compressed responses
+    COMPRESS_MIMETYPES = ['application/json', 'text/html', 'text/css',
+                          'text/plain', 'application/javascript']
+    #: Smaller responses are sent uncompressed
+    COMPRESS_MIN_SIZE = 1024
+    #: zlib compression level, from 1 (fastest) to 9 (smallest)
+    COMPRESS_LEVEL = 6
+    #: Number of compressed immutable responses kept in memory
+    COMPRESS_CACHE_SIZE = 64
+
+    #: Cache reference data, e.g. organization groups and tags.
+    #: See :mod:`app.core.caching`
+    CACHE_ENABLED = True
+    #: Flask-Cache backend: ``app.core.caching.lru`` (in-process),
+    #: ``filesystem`` (with ``CACHE_DIR``) or ``redis`` (with
+    #: ``CACHE_REDIS_URL``)
+    CACHE_TYPE = 'app.core.caching.lru'
+    #: Writes only invalidate the in-process cache of the worker which
+    #: commits them, so other workers may serve stale lists for this many
+    #: seconds. With a shared backend writes are seen by all workers at
+    #: once, and a longer timeout, e.g. 3600, can be used.
+    CACHE_DEFAULT_TIMEOUT = 60
+    #: Maximum number of entries of in-process caches
+    CACHE_THRESHOLD = 500
+    CACHE_KEY_PREFIX = 'do_cache_'
+
+    #: Keep users authenticated by API key for this many seconds.
+    #: Set to 0 to disable. See :func:`app.models.load_api_user`
+    API_KEY_CACHE_TTL = 60
+
+    #: Rate limit API, customer portal and authentication requests.
+    #: See :mod:`app.core.ratelimit`
+    RATELIMIT_ENABLED = True
+    #: Rate limit buckets storage: ``memory://`` (per process),
+    #: ``sqlite:////dev/shm/do-ratelimit.db`` (per host) or
+    #: ``redis://localhost:6379/0`` (shared)
+    RATELIMIT_STORAGE_URL = 'memory://'
+    #: Limits of single endpoints, as ``(limit, period)`` tuples, e.g.
+    #: ``{'api.add_sample': (10, 60)}``
+    RATELIMIT_ENDPOINTS = {}
+
+    #: Request bodies larger than this are logged as their SHA-256 digest
+    #: in the audit log. See :mod:`app.core.audit`
+    AUDIT_LOG_MAX_DATA = 4096
+    #: Write the audit log on a background thread
+    AUDIT_LOG_BACKGROUND = True
+    #: Maximum number of audit records written at once
+    AUDIT_LOG_BATCH_SIZE = 100
+    #: Maximum number of queued audit records
+    AUDIT_LOG_QUEUE_SIZE = 10000
+    #: Also store audit records in the ``audit_log`` table, searchable
+    #: with :http:get:`/api/1.0/audit-log`
+    AUDIT_LOG_STORE = True
+
     #: Password user for archiving infected files
     INFECTED_PASSWD = 'infected'
 
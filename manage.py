@@ -5,17 +5,20 @@ import json
 from collections import namedtuple
 import requests
 import datetime
+import timeit
 import click
 
 from app import create_app
 from flask import current_app
 from flask.cli import FlaskGroup
 from flask_gnupg import fetch_gpg_key
-from app import db
+from app import db, models
 from app.models import User, Organization, IpRange, Fqdn, Asn, Email
 from app.models import OrganizationGroup, Vulnerability, Tag
 from app.models import ContactEmail, emails_organizations, tags_vulnerabilities
 from app.models import Role, ReportType
+from app.constituency import ip_range_conflicts
+from app.core import encoding
 
 
 def create_cli_app(info):
@@ -178,6 +181,29 @@ def delorg(oid):
     db.session.commit()
 
 
+@cli.command()
+def check_ip_ranges():
+    """Report duplicated, overlapping and unreachable IP ranges"""
+    report = ip_range_conflicts()
+
+    def fmt(r):
+        return '{ip_range} ({organization}, #{id})'.format(**r)
+
+    for r in report['invalid']:
+        click.echo('Invalid: {}'.format(fmt(r)))
+    for group in report['duplicates']:
+        click.echo('Duplicate: {}'.format(', '.join(fmt(r) for r in group)))
+    for key, label in (('overlaps', 'Overlap'), ('nested', 'Nested')):
+        for c in report[key]:
+            click.echo('{}: {} in {}'.format(
+                label, fmt(c['ip_range']), fmt(c['enclosing'])))
+    for u in report['unreachable']:
+        click.echo('Unreachable ({}): {}'.format(
+            u['reason'], fmt(u['ip_range'])))
+    click.echo('{} conflicts found'.format(
+        sum(len(v) for v in report.values())))
+
+
 @cli.command()
 @click.argument('filename', required=True)
 def import_hof(filename):
@@ -246,6 +272,56 @@ def import_hof(filename):
         print('Done')
 
 
+@cli.command()
+@click.argument('model', default='Organization')
+@click.option('-n', '--number', default=10, help='Number of repetitions')
+def bench_serializers(model, number):
+    """Benchmark compiled vs. uncompiled serializers on all rows of MODEL"""
+    cls = getattr(models, model)
+    rows = cls.query.all()
+    # Load relationships before timing
+    expected = [r._serialize_attrs() for r in rows]
+    if [r.serialize() for r in rows] != expected:
+        click.echo('Compiled serializer output differs!', err=True)
+        sys.exit(1)
+    click.echo('{} {} rows, {} repetitions'.format(len(rows), model, number))
+    for label, method in (('uncompiled', cls._serialize_attrs),
+                          ('compiled', cls.serialize)):
+        elapsed = timeit.timeit(
+            lambda: [method(r) for r in rows], number=number)
+        click.echo('{:>10}: {:.3f}s ({:.1f}us/row)'.format(
+            label, elapsed,
+            elapsed * 1e6 / ((len(rows) or 1) * number)))
+
+
+@cli.command()
+@click.argument('payload', default='organizations',
+                type=click.Choice(['organizations', 'samples']))
+@click.option('-n', '--number', default=10, help='Number of repetitions')
+@click.option('-l', '--limit', default=1000,
+              help='Number of samples in the samples payload')
+def bench_json(payload, number, limit):
+    """Benchmark the JSON backends on an API response PAYLOAD"""
+    if payload == 'organizations':
+        orgs = models.Organization.query.options(
+            *models.Organization.eager_options()).all()
+        body = {'organizations': orgs}
+    else:
+        samples = models.Sample.query.limit(limit).all()
+        body = {'items': [s.serialize() for s in samples]}
+    expected = json.loads(encoding.get_backend('json')(body).decode('utf-8'))
+    click.echo('{} payload, {} repetitions'.format(payload, number))
+    for name in sorted(encoding.backends):
+        dumps = encoding.get_backend(name)
+        rv = dumps(body)
+        if json.loads(rv.decode('utf-8')) != expected:
+            click.echo('{} output differs!'.format(name), err=True)
+            sys.exit(1)
+        elapsed = timeit.timeit(lambda: dumps(body), number=number)
+        click.echo('{:>10}: {:.3f}s ({:.1f}MB/s)'.format(
+            name, elapsed, len(rv) * number / (elapsed or 1) / 1e6))
+
+
 @cli.command()
 @click.argument('emails', required=True)
 def fetchkeys(emails):
@@ -0,0 +1,48 @@
+"""Add api_key_hash to users table
+
+Revision ID: 4c1f0e8a7b2d
+Revises: 662bb61952bd
+Create Date: 2026-10-17 20:12:41.308417
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4c1f0e8a7b2d'
+down_revision = '662bb61952bd'
+
+import hashlib
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column(
+        'users',
+        sa.Column('api_key_hash', sa.String(length=64), nullable=True)
+    )
+    op.create_index(
+        op.f('ix_users_api_key_hash'),
+        'users',
+        ['api_key_hash'],
+        unique=False
+    )
+    users = sa.table(
+        'users',
+        sa.column('id', sa.Integer),
+        sa.column('api_key', sa.String),
+        sa.column('api_key_hash', sa.String)
+    )
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.select([users.c.id, users.c.api_key]).
+        where(users.c.api_key.isnot(None))).fetchall()
+    for id_, api_key in rows:
+        conn.execute(
+            users.update().where(users.c.id == id_).values(
+                api_key_hash=hashlib.sha256(
+                    api_key.encode('utf-8')).hexdigest()))
+
+
+def downgrade():
+    op.drop_index(op.f('ix_users_api_key_hash'), table_name='users')
+    op.drop_column('users', 'api_key_hash')
@@ -0,0 +1,48 @@
+"""Add audit_log table
+
+Revision ID: b7e2d95a0c31
+Revises: 4c1f0e8a7b2d
+Create Date: 2026-10-17 21:04:17.552086
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2d95a0c31'
+down_revision = '4c1f0e8a7b2d'
+
+from alembic import op
+import sqlalchemy as sa
+
+INDEXES = ('created', 'user', 'email', 'action', 'endpoint', 'ip', 'status')
+
+
+def upgrade():
+    op.create_table(
+        'audit_log',
+        sa.Column('created', sa.DateTime(), nullable=True),
+        sa.Column('updated', sa.DateTime(), nullable=True),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('module', sa.String(length=20), nullable=True),
+        sa.Column('user', sa.String(length=255), nullable=True),
+        sa.Column('email', sa.String(length=255), nullable=True),
+        sa.Column('action', sa.String(length=20), nullable=True),
+        sa.Column('data', sa.Text(), nullable=True),
+        sa.Column('url', sa.Text(), nullable=True),
+        sa.Column('endpoint', sa.String(length=255), nullable=True),
+        sa.Column('ip', sa.String(length=45), nullable=True),
+        sa.Column('status', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    for column in INDEXES:
+        op.create_index(
+            op.f('ix_audit_log_' + column),
+            'audit_log',
+            [column],
+            unique=False
+        )
+
+
+def downgrade():
+    for column in INDEXES:
+        op.drop_index(op.f('ix_audit_log_' + column), table_name='audit_log')
+    op.drop_table('audit_log')
@@ -9,6 +9,8 @@ from flask import Response
 from flask.testing import FlaskClient
 from app import create_app
 from app import db as _db
+from app.core import counts
+from app.core.caching import cache
 from app.models import User, OrganizationGroup, ReportType, Role
 from app.models import Organization, ContactEmail
 from app.utils import bosh_client
@@ -28,8 +30,8 @@ class TestClient(FlaskClient):
         if 'json' in kwargs:
             kwargs['data'] = json.dumps(kwargs.pop('json'))
 
-        kwargs['headers'].update({'API-Authorization': self.test_user.api_key,
-                                  'Accept': 'application/json'})
+        kwargs['headers'].update({'API-Authorization': self.test_user.api_key})
+        kwargs['headers'].setdefault('Accept', 'application/json')
         if 'content_type' not in kwargs:
             kwargs['content_type'] = 'application/json'
 
@@ -53,6 +55,8 @@ def db(request, app):
     _db.drop_all()
     # Create the tables based on the current model
     _db.create_all()
+    counts.invalidate()
+    cache.clear()
 
     user = User.create_test_user()
     TestClient.test_user = user
@@ -1,4 +1,5 @@
 from io import BytesIO
+import pytest
 from flask import url_for
 from .conftest import assert_msg
 
@@ -27,6 +28,56 @@ def test_add_sample(client, malware_sample):
     assert rv.status_code == 201
 
 
+def test_add_sample_upload(client, app, malware_sample, tmpdir, monkeypatch):
+    monkeypatch.setitem(app.config, 'APP_UPLOADS_SAMPLES', str(tmpdir))
+    monkeypatch.setitem(app.config, 'APP_UPLOADS_SAMPLES_TMP',
+                        str(tmpdir.join('tmp')))
+    data = b'clean'
+    rv = client.post(url_for('api.add_sample_upload'),
+                     json={'filename': malware_sample.filename,
+                           'size': len(data)})
+    assert rv.status_code == 201
+    upload_id = rv.json['id']
+    url = url_for('api.update_sample_upload', upload_id=upload_id)
+
+    def put(start, stop):
+        return client.put(url, data=data[start:stop],
+                          content_type='application/octet-stream',
+                          headers={'Content-Range': 'bytes {}-{}/{}'.format(
+                              start, stop - 1, len(data))})
+
+    assert_msg(put(0, 2), key='offset', value=2)
+    assert put(1, 3).status_code == 409
+    rv = client.post(url_for('api.finalize_sample_upload',
+                             upload_id=upload_id))
+    assert rv.status_code == 409
+    assert_msg(client.get(url), key='offset', value=2)
+    assert_msg(put(2, len(data)), key='offset', value=len(data))
+    rv = client.post(url_for('api.finalize_sample_upload',
+                             upload_id=upload_id))
+    assert rv.status_code == 201
+    assert rv.json['files'][0]['sha256'] == malware_sample.sha256
+    assert rv.json['files'][0]['ctph'] == malware_sample.ctph
+    assert tmpdir.join(malware_sample.sha256).read_binary() == data
+    assert tmpdir.join('tmp').listdir() == []
+    assert client.get(url).status_code == 404
+
+
+def test_finalize_upload_move_failure(client, app, tmpdir, monkeypatch):
+    monkeypatch.setitem(app.config, 'APP_UPLOADS_TMP', str(tmpdir))
+    rv = client.post(url_for('api.add_upload'),
+                     json={'filename': 'feed.csv', 'size': 3})
+    upload_id = rv.json['id']
+    client.put(url_for('api.update_upload', upload_id=upload_id),
+               data=b'a,b', content_type='application/octet-stream',
+               headers={'Content-Range': 'bytes 0-2/3'})
+    # The move fails as the uploads directory does not exist
+    monkeypatch.setitem(app.config, 'APP_UPLOADS', str(tmpdir.join('x')))
+    with pytest.raises(OSError):
+        client.post(url_for('api.finalize_upload', upload_id=upload_id))
+    assert tmpdir.listdir() == []
+
+
 def test_404(client):
     rv = client.get('/api/1.0/non-existent-resource')
     assert rv.status_code == 404
@@ -40,3 +91,17 @@ def test_teapot(client):
 def test_honeytoken(client):
     rv = client.get(url_for('api.api_honeytoken'))
     assert_msg(rv, value='No such user')
+
+
+def test_rate_limit(client, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'RATELIMIT_ENDPOINTS',
+                        {'api.teapot': (2, 60)})
+    for remaining in ('1', '0'):
+        rv = client.get(url_for('api.teapot'))
+        assert rv.status_code == 418
+        assert rv.headers['DO-RateLimit-Limit'] == '2'
+        assert rv.headers['DO-RateLimit-Remaining'] == remaining
+
+    rv = client.get(url_for('api.teapot'))
+    assert rv.status_code == 429
+    assert 'Retry-After' in rv.headers
@@ -3,7 +3,7 @@ import pytest
 from flask import url_for
 from .conftest import assert_msg
 
-from app.models import User
+from app.models import User, load_api_user
 
 
 def test_login_logout(client):
@@ -73,6 +73,17 @@ def test_reset_api_key(client):
     assert_msg(rv, value='Your API key has been reset')
 
 
+def test_api_key_cache(client):
+    old_key = client.test_user.api_key
+    assert load_api_user(old_key).id == client.test_user.id
+
+    rv = client.get(url_for('auth.reset_api_key'))
+    assert rv.status_code == 200
+    assert load_api_user(old_key) is None
+    assert load_api_user(client.test_user.api_key).id == \
+        client.test_user.id
+
+
 def test_set_password(client):
     token = client.test_user.generate_reset_token()
     rv = client.post(
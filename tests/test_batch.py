@@ -0,0 +1,53 @@
+from flask import url_for
+from app.models import Asn
+
+
+def _asns(*numbers):
+    return Asn.query.filter(Asn.asn.in_(numbers)).count()
+
+
+def test_batch(client):
+    rv = client.post(url_for('api.batch'), json={'requests': [
+        {'method': 'POST', 'url': '/api/1.0/asns',
+         'body': {'asn': 64512, 'organization_id': 1}},
+        {'method': 'GET', 'url': '/api/1.0/asns?fields=asn'},
+        {'method': 'GET', 'url': '/api/1.0/nosuchendpoint'},
+        {'method': 'POST', 'url': '/api/1.0/asns', 'body': {}},
+        {'method': 'POST', 'url': '/api/1.0/batch', 'body': {}}
+    ]})
+    assert rv.status_code == 200
+    responses = rv.json['responses']
+    assert [r['status'] for r in responses] == [201, 200, 404, 422, 404]
+    assert responses[0]['location']
+    assert {'asn': 64512} in responses[1]['body']['asns']
+    assert rv.json['committed']
+    assert _asns(64512) == 1
+
+
+def test_batch_atomic(client):
+    rv = client.post(url_for('api.batch'), json={'atomic': True, 'requests': [
+        {'method': 'POST', 'url': '/api/1.0/asns',
+         'body': {'asn': 64513, 'organization_id': 1}},
+        {'method': 'POST', 'url': '/api/1.0/asns', 'body': {}},
+        {'method': 'GET', 'url': '/api/1.0/asns'}
+    ]})
+    assert [r['status'] for r in rv.json['responses']] == [201, 422, 424]
+    assert not rv.json['committed']
+    assert _asns(64513) == 0
+
+    rv = client.post(url_for('api.batch'), json={'atomic': True, 'requests': [
+        {'method': 'POST', 'url': '/api/1.0/asns',
+         'body': {'asn': 64514, 'organization_id': 1}},
+        {'method': 'POST', 'url': '/api/1.0/asns',
+         'body': {'asn': 64515, 'organization_id': 1}}
+    ]})
+    assert [r['status'] for r in rv.json['responses']] == [201, 201]
+    assert rv.json['committed']
+    assert _asns(64514, 64515) == 2
+
+
+def test_batch_invalid(client):
+    rv = client.post(url_for('api.batch'), json={'requests': [
+        {'method': 'PATCH', 'url': '/api/1.0/asns'}
+    ]})
+    assert rv.status_code == 422
@@ -1,4 +1,8 @@
+import time
 from flask import url_for
+from werkzeug.http import http_date
+from app import db
+from app.models import Organization, IpRange
 from .conftest import assert_msg
 
 
@@ -10,6 +14,30 @@ def test_create_ip_range(client):
     assert_msg(rv, value='IP range added', response_code=201)
 
 
+def test_create_ip_ranges_bulk(client):
+    ranges = ['10.1.{}.0/24'.format(i) for i in range(3)]
+    rv = client.post(
+        url_for('api.add_ip_range'),
+        json=[dict(ip_range=r, organization_id=1) for r in ranges] + [
+            dict(ip_range='not a range', organization_id=1),
+            dict(ip_range='10.2.0.0/24', organization_id=666)]
+    )
+    assert rv.status_code == 201
+    assert rv.json['added'] == 3
+    assert [e['index'] for e in rv.json['errors']] == [3, 4]
+    rv = client.get(url_for('api.get_ip_ranges'))
+    added = [i['ip_range'] for i in rv.json['ip_ranges']]
+    assert all(r in added for r in ranges)
+
+    rv = client.post(
+        url_for('api.add_ip_range', strict=1),
+        json=[dict(ip_range='10.3.0.0/24', organization_id=1),
+              dict(organization_id=1)]
+    )
+    assert rv.status_code == 422
+    assert rv.json['added'] == 0
+
+
 def test_update_ip_range(client):
     rv = client.put(
         url_for('api.update_ip_range', range_id=1),
@@ -26,9 +54,76 @@ def test_read_ip_range(client):
     assert_msg(rv, key='ip_range')
 
 
+def test_read_ip_range_conditional(client):
+    rv = client.get(url_for('api.get_ip_ranges'))
+    etag = rv.headers['ETag']
+    assert etag.startswith('W/')
+    assert 'Last-Modified' not in rv.headers
+
+    rv = client.get(url_for('api.get_ip_ranges'),
+                    headers={'If-None-Match': etag})
+    assert rv.status_code == 304
+    assert not rv.data
+
+    client.post(
+        url_for('api.add_ip_range'),
+        json=dict(ip_range='10.11.12.0/24', organization_id=1)
+    )
+    rv = client.get(url_for('api.get_ip_ranges'),
+                    headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+    assert rv.headers['ETag'] != etag
+
+    rv = client.get(url_for('api.get_ip_range', range_id=1))
+    etag = rv.headers['ETag']
+    rv = client.get(url_for('api.get_ip_range', range_id=1),
+                    headers={'If-None-Match': etag})
+    assert rv.status_code == 304
+
+
+def test_read_ip_range_hard_deleted(client):
+    rv = client.get(url_for('api.get_ip_ranges'))
+    etag = rv.headers['ETag']
+    ip_range = IpRange.query.first()
+    deleted = ip_range.ip_range
+    db.session.delete(ip_range)
+    db.session.commit()
+
+    # max(updated) is unchanged, so only the ETag notices the deletion
+    rv = client.get(url_for('api.get_ip_ranges'),
+                    headers={'If-Modified-Since': http_date(time.time())})
+    assert rv.status_code == 200
+    assert deleted not in [
+        i['ip_range'] for i in rv.json['ip_ranges']]
+    rv = client.get(url_for('api.get_ip_ranges'),
+                    headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+
+
 def test_delete_ip_range(client):
     rv = client.delete(url_for('api.delete_ip_range', range_id=1))
     assert_msg(rv, value='IP range deleted')
 
     rv = client.delete(url_for('api.delete_ip_range', range_id=666))
     assert rv.status_code == 404
+
+
+def test_ip_range_conflicts(client):
+    a = Organization(abbreviation='A',
+                     ip_ranges=['10.200.0.0/16', '10.201.0.0/24'])
+    b = Organization(abbreviation='B', ip_ranges=['10.201.0.0/24'])
+    db.session.add_all([a, b])
+    db.session.commit()
+    client.post(
+        url_for('api.add_ip_range'),
+        json=dict(ip_range='10.200.1.0/24', organization_id=a.id)
+    )
+    rv = client.get(url_for('api.get_ip_range_conflicts'))
+    assert rv.status_code == 200
+    overlap, = [o for o in rv.json['overlaps']
+                if o['ip_range']['ip_range'] == '10.200.1.0/24']
+    assert overlap['enclosing']['ip_range'] == '10.200.0.0/16'
+    assert overlap['enclosing']['organization_id'] == a.id
+    duplicate, = [d for d in rv.json['duplicates']
+                  if d[0]['ip_range'] == '10.201.0.0/24']
+    assert sorted(r['organization_id'] for r in duplicate) == [a.id, b.id]
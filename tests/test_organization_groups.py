@@ -34,3 +34,17 @@ def test_delete_group(client):
 
     rv = client.delete(url_for('api.delete_group', group_id=666))
     assert rv.status_code == 404
+
+
+def test_read_groups_cached(client):
+    rv = client.get(url_for('api.get_groups'))
+    names = [g['name'] for g in rv.json['organization_groups']]
+    assert 'Cached Group' not in names
+
+    rv = client.put(url_for('api.update_group', group_id=1),
+                    json=dict(name='Cached Group', color='#ffff00'))
+    assert rv.status_code == 200
+
+    rv = client.get(url_for('api.get_groups'))
+    names = [g['name'] for g in rv.json['organization_groups']]
+    assert 'Cached Group' in names
@@ -1,4 +1,13 @@
+import os
+import zipfile
+import json
+from io import BytesIO
 from flask import url_for
+from sqlalchemy import event
+from app import db
+from app.models import Organization
+from app.tasks import classify
+from app.utils import mixins
 from .conftest import assert_msg
 
 
@@ -32,6 +41,41 @@ def test_update_org(client):
     assert rv.status_code == 200
 
 
+def test_update_org_keeps_unchanged_rows(client):
+    def put(**kwargs):
+        data = dict(abbreviation="CERT-EU",
+                    ip_ranges=["212.8.189.16/28"],
+                    abuse_emails=["cert-eu@ec.europa.eu"],
+                    contact_emails=[{"email": "cert-eu-new@ec.europa.eu"}],
+                    asns=[5400],
+                    fqdns=["cert.europa.eu"])
+        data.update(kwargs)
+        rv = client.put(url_for('api.update_organization', org_id=1),
+                        json=data)
+        assert rv.status_code == 200
+        db.session.expire_all()
+        return Organization.query.get(1)
+
+    org = put()
+    range_ids = {r.ip_range: r.id for r in org.ip_ranges_}
+    contact_id = org.contact_emails[0].id
+    abuse_id = org.abuse_emails_[0].id
+
+    org = put(ip_ranges=["212.8.189.16/28", "212.8.190.0/24"],
+              contact_emails=[{"email": "cert-eu-new@ec.europa.eu",
+                               "cp": True}])
+    ids = {r.ip_range: r.id for r in org.ip_ranges_}
+    assert ids["212.8.189.16/28"] == range_ids["212.8.189.16/28"]
+    assert "212.8.190.0/24" in ids
+    assert org.contact_emails[0].id == contact_id
+    assert org.contact_emails[0].cp
+    assert org.abuse_emails_[0].id == abuse_id
+
+    org = put(ip_ranges=["212.8.190.0/24"], asns=[])
+    assert [r.ip_range for r in org.ip_ranges_] == ["212.8.190.0/24"]
+    assert org.asns == []
+
+
 def test_return_orgs(client):
     rv = client.get(url_for('api.get_organizations'))
     assert_msg(rv, key='organizations')
@@ -45,6 +89,63 @@ def test_return_orgs(client):
     assert_msg(rv, key='abbreviation')
 
 
+def test_return_orgs_fieldset(client):
+    rv = client.get(url_for('api.get_organizations',
+                            fields='id,abbreviation'))
+    org = rv.json['organizations'][0]
+    assert sorted(org) == ['abbreviation', 'id']
+
+    rv = client.get(url_for('api.get_organizations', expand='ip_ranges'))
+    org = rv.json['organizations'][0]
+    assert org['ip_ranges'] == ['212.8.189.16/28']
+    assert org['abbreviation'] == 'CERT-EU'
+    assert 'fqdns' not in org
+    assert 'group' not in org
+
+
+def test_return_orgs_ndjson(client):
+    rv = client.get(url_for('api.get_organizations'))
+    ids = sorted(o['id'] for o in rv.json['organizations'])
+
+    rv = client.get(url_for('api.get_organizations', fields='id'),
+                    headers={'Accept': 'application/x-ndjson'})
+    assert rv.status_code == 200
+    assert rv.mimetype == 'application/x-ndjson'
+    lines = rv.data.decode('utf-8').splitlines()
+    orgs = [json.loads(line) for line in lines]
+    assert [o['id'] for o in orgs] == ids
+    assert all(sorted(o) == ['id'] for o in orgs)
+
+    rv = client.get(url_for('api.get_organization', org_id=1),
+                    headers={'Accept': 'application/x-ndjson'})
+    assert rv.status_code == 406
+
+
+def test_return_orgs_query_count(client):
+    def count_queries():
+        queries = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            queries.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
+        rv = client.get(url_for('api.get_organizations'))
+        event.remove(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
+        return len(rv.json['organizations']), len(queries)
+
+    orgs, queries = count_queries()
+    for i in range(3):
+        db.session.add(Organization(
+            abbreviation='ORG{}'.format(i),
+            ip_ranges=['10.0.{}.0/24'.format(i)],
+            fqdns=['org{}.tld'.format(i)], asns=[i + 1],
+            abuse_emails=['abuse@org{}.tld'.format(i)]))
+    db.session.commit()
+    assert count_queries() == (orgs + 3, queries)
+
+
 def test_org_queries(client):
     rv = client.post(url_for('api.query'))
     assert rv.status_code == 501
@@ -60,9 +161,194 @@ def test_is_constituent(client):
     assert rv.json['response']['212.8.189.18'] == 'CERT-EU'
 
 
+def test_is_constituent_most_specific(client):
+    rv = client.post(
+        url_for('api.add_organization'),
+        json=dict(abbreviation="CERT-EU-LAB",
+                  full_name="CERT-EU Lab",
+                  ip_ranges=["212.8.189.16/30", "2001:db8::/32"],
+                  contact_emails=[])
+    )
+    assert rv.status_code == 201
+
+    rv = client.put(
+        url_for('api.check_constituents'),
+        json=["212.8.189.17", "212.8.189.20", "2001:db8::1"]
+    )
+    assert rv.status_code == 200
+    assert rv.json['response']['212.8.189.17'] == 'CERT-EU-LAB'
+    assert rv.json['response']['212.8.189.20'] == 'CERT-EU'
+    assert rv.json['response']['2001:db8::1'] == 'CERT-EU-LAB'
+
+
+def test_check_fqdns(client):
+    rv = client.put(
+        url_for('api.check_fqdns'),
+        json=["https://www.cert.europa.eu/path?q=1", "CERT.europa.eu",
+              "notcert.europa.eu", "example.com"]
+    )
+    assert rv.status_code == 200
+    assert rv.json['response'] == {
+        'https://www.cert.europa.eu/path?q=1': 'CERT-EU',
+        'CERT.europa.eu': 'CERT-EU'
+    }
+
+
+def test_check_asns(client, app, tmpdir):
+    rv = client.put(url_for('api.check_asns'), json=["212.8.189.18"])
+    assert rv.status_code == 501
+
+    ipasn = tmpdir.join('ipasn.dat')
+    ipasn.write('; IP-ASN32-DAT file\n'
+                '212.8.189.0/24\t5400\n'
+                '1.1.1.0/24\t13335\n')
+    app.config['ASN_DB_PATH'] = str(ipasn)
+    try:
+        rv = client.put(
+            url_for('api.check_asns'),
+            json=["212.8.189.18", "1.1.1.1", "127.0.0.1"]
+        )
+    finally:
+        app.config['ASN_DB_PATH'] = None
+    assert rv.status_code == 200
+    assert rv.json['response'] == {
+        '212.8.189.18': {'asn': 5400, 'organization': 'CERT-EU'},
+        '1.1.1.1': {'asn': 13335, 'organization': None}
+    }
+
+
+def test_check_job(client):
+    feed = b'212.8.189.19,x\nhttps://www.cert.europa.eu/a,y\n1.2.3.4,z\n'
+    rv = client.post(
+        url_for('api.add_check_job'),
+        data=dict(file=(BytesIO(feed), 'feed.csv')),
+        content_type='multipart/form-data'
+    )
+    assert rv.status_code == 202
+    job_id = rv.json['job']['id']
+
+    rv = client.get(url_for('api.get_check_job', job_id=job_id))
+    assert rv.status_code == 200
+    assert rv.json['state'] == 'SUCCESS'
+    assert rv.json['processed'] == 3
+    assert rv.json['organizations'] == {'CERT-EU': 2}
+
+    rv = client.get(url_for('api.get_check_job_result', job_id=job_id))
+    assert rv.status_code == 200
+    with zipfile.ZipFile(BytesIO(rv.data)) as zf:
+        assert zf.read('CERT-EU.csv').decode().splitlines() == [
+            '212.8.189.19,ip', 'https://www.cert.europa.eu/a,fqdn']
+        assert zf.read('_unattributed.csv').decode().splitlines() == [
+            '1.2.3.4,ip']
+
+
+def test_check_job_csv_options(client):
+    feed = b'time,indicator\nx,212.8.189.19\ny,1.2.3.4\n'
+    rv = client.post(
+        url_for('api.add_check_job'),
+        data=dict(file=(BytesIO(feed), 'feed.csv'), field='1', header='1'),
+        content_type='multipart/form-data'
+    )
+    assert rv.status_code == 202
+    rv = client.get(url_for('api.get_check_job', job_id=rv.json['job']['id']))
+    assert rv.json['state'] == 'SUCCESS'
+    assert rv.json['processed'] == 2
+    assert rv.json['organizations'] == {'CERT-EU': 1}
+
+    for field in ('indicator', '-1', '\u00b2'):
+        rv = client.post(
+            url_for('api.add_check_job'),
+            data=dict(file=(BytesIO(feed), 'feed.csv'), field=field),
+            content_type='multipart/form-data'
+        )
+        assert rv.status_code == 400
+
+
+def test_check_job_not_found(client):
+    job_id = '00000000-0000-0000-0000-000000000000'
+    rv = client.get(url_for('api.get_check_job', job_id=job_id))
+    assert rv.status_code == 404
+
+
+def test_check_job_expired(client, app, monkeypatch):
+    rv = client.post(
+        url_for('api.add_check_job'),
+        data=dict(file=(BytesIO(b'212.8.189.19\n'), 'feed.csv')),
+        content_type='multipart/form-data'
+    )
+    job_id = rv.json['job']['id']
+    assert not os.path.exists(classify.job_path(job_id, 'in'))
+
+    monkeypatch.setitem(app.config, 'CLASSIFY_JOBS_TTL', -1)
+    rv = client.get(url_for('api.get_check_job', job_id=job_id))
+    assert rv.status_code == 404
+    rv = client.get(url_for('api.get_check_job_result', job_id=job_id))
+    assert rv.status_code == 404
+    assert classify.clean_jobs() >= 1
+    assert not os.path.exists(classify.job_path(job_id, 'zip'))
+    assert not os.path.exists(classify.job_path(job_id, 'json'))
+
+
+def test_check_job_result_names(tmpdir):
+    spool = classify._ResultSpool(str(tmpdir))
+    names = [spool._filename(a) for a in ('foo-1', 'foo', 'foo/', '..')]
+    assert names == ['foo-1', 'foo', 'foo-2', 'organization']
+
+
+def test_snapshot(client):
+    rv = client.get(url_for('api.get_organizations_snapshot'))
+    assert rv.status_code == 200
+    orgs = rv.json['organizations']
+    assert orgs[0]['abbreviation'] == 'CERT-EU'
+    assert orgs[0]['ip_ranges'] == ['212.8.189.16/28']
+    etag = rv.headers['ETag']
+
+    rv = client.get(url_for('api.get_organizations_snapshot'),
+                    headers={'If-None-Match': etag})
+    assert rv.status_code == 304
+
+    rv = client.get(url_for('api.get_organizations_snapshot',
+                            since='2100-01-01T00:00:00'))
+    assert rv.json['organizations'] == []
+    assert rv.json['deleted'] == []
+
+    org = Organization(abbreviation='DELETED')
+    db.session.add(org)
+    db.session.commit()
+    client.delete(url_for('api.delete_organization', org_id=org.id))
+    rv = client.get(url_for('api.get_organizations_snapshot',
+                            since='2000-01-01T00:00:00'))
+    assert rv.json['deleted'] == [org.id]
+
+    rv = client.get(url_for('api.get_organizations_snapshot', since='x'))
+    assert rv.status_code == 400
+
+
 def test_del_org(client):
     rv = client.delete(url_for('api.delete_organization', org_id=1))
     assert_msg(rv, value='Organization deleted')
 
     rv = client.delete(url_for('api.delete_organization', org_id=666))
     assert rv.status_code == 404
+
+
+def test_compiled_serializer(client):
+    org = Organization.query.first()
+    assert org.serialize() == org._serialize_attrs()
+    assert org.serialize(exclude=('id',)) == \
+        org._serialize_attrs(exclude=('id',))
+    assert 'id' not in org.serialize(exclude=('id',))
+
+
+def test_serializer_fieldsets_cache(client, monkeypatch):
+    org = Organization.query.first()
+    assert org.serialize(fields=frozenset(['id', 'nope'])) == {'id': org.id}
+    size = len(mixins._fieldsets)
+    for i in range(10):
+        org.serialize(fields=frozenset(['id', 'nope{}'.format(i)]))
+    assert len(mixins._fieldsets) == size
+
+    monkeypatch.setattr(mixins, 'FIELDSETS_CACHE_SIZE', 2)
+    for name in ('id', 'abbreviation', 'full_name'):
+        assert name in org.serialize(fields=frozenset([name]))
+    assert len(mixins._fieldsets) == 2
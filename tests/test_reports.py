@@ -1,4 +1,10 @@
+import gzip
+import json
+import zlib
 from flask import url_for
+from app import db
+from app.core import compression
+from app.models import Report
 from .conftest import assert_msg
 
 
@@ -15,3 +21,73 @@ def test_read_sample_report(client):
         url_for('api.get_sample_report', sha256='NA1eeb2b09a4bf6c87b273305')
     )
     assert rv.status_code == 404
+
+
+def test_read_reports_keyset(client):
+    for i in range(5):
+        db.session.add(Report(type_id=1, report='{}'))
+    db.session.commit()
+
+    ids = []
+    rv = client.get(url_for('api.get_reports', after='', per_page=2))
+    while True:
+        assert 'count' not in rv.json
+        ids.extend(r['id'] for r in rv.json['items'])
+        if not rv.json['next']:
+            break
+        assert 'rel="Next"' in rv.headers['Link']
+        rv = client.get(url_for('api.get_reports', after=rv.json['next'],
+                                per_page=2))
+    assert ids == [5, 4, 3, 2, 1]
+
+    rv = client.get(url_for('api.get_reports', after='', count=1))
+    assert rv.json['count'] == 5
+
+    rv = client.get(url_for('api.get_reports', after='invalid'))
+    assert rv.status_code == 400
+
+
+def test_read_reports_count_cache(client):
+    rv = client.get(url_for('api.get_reports', per_page=1))
+    total = rv.json['count']
+    db.session.add(Report(type_id=1, report='{}'))
+    db.session.commit()
+    rv = client.get(url_for('api.get_reports', per_page=1))
+    assert rv.json['count'] == total + 1
+    assert 'estimated' not in rv.json
+
+
+def test_read_report_compressed(client):
+    report = Report(type_id=1, report=json.dumps({'hex': '00 ' * 2048}))
+    db.session.add(report)
+    db.session.commit()
+    url = url_for('api.get_report', report_id=report.id)
+
+    rv = client.get(url)
+    assert 'Content-Encoding' not in rv.headers
+    assert 'immutable' in rv.headers['Cache-Control']
+    expected = rv.json
+
+    compression.clear_cache()
+    rv = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert rv.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in rv.headers['Vary']
+    assert json.loads(gzip.decompress(rv.data).decode('utf-8')) == expected
+    assert len(compression._cache) == 1
+    cached = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert cached.data == rv.data
+
+    rv = client.get(url, headers={'Accept-Encoding': 'deflate'})
+    assert rv.headers['Content-Encoding'] == 'deflate'
+    assert json.loads(zlib.decompress(rv.data).decode('utf-8')) == expected
+
+    # A different body of the same length is not served from cache
+    report.report = json.dumps({'hex': '11 ' * 2048})
+    db.session.commit()
+    rv = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    rv = json.loads(gzip.decompress(rv.data).decode('utf-8'))
+    assert rv['report'] == report.report
+
+    rv = client.get(url_for('api.get_reports', per_page=1, fields='id'),
+                    headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in rv.headers
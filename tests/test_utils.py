@@ -1,4 +1,17 @@
+import io
+import json
+import logging
+import pytest
+from datetime import datetime
+from decimal import Decimal
+from flask import url_for
 from app import utils
+from app.core import encoding
+from app.models import Organization
+from app.utils.asntable import AsnTable
+from app.utils.overlaps import find_conflicts
+from app.utils.radix import RadixTree, parse_prefix
+from app.utils.suffixtrie import SuffixTrie, hostname
 
 
 def test_email_validation():
@@ -16,3 +29,150 @@ def test_calc_hashes():
     assert digests.sha1 == '92cfceb39d57d914ed8b14d0e37643de0797ae56'
     assert digests.sha256 == \
         '73475cb40a568e8da8a045ced110137e159f890ac4da883b6b17dc651b3a8049'
+
+
+def test_save_sample(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, 'CHUNK_SIZE', 7)
+    buf = b'MZ' + bytes(range(256)) * 4
+    digests = utils.save_sample(io.BytesIO(buf), str(tmpdir),
+                                str(tmpdir.join('tmp')))
+    assert digests == utils.get_hashes(buf)
+    assert tmpdir.join(digests.sha256).read_binary() == buf
+    assert tmpdir.join('tmp').listdir() == []
+    utils.save_sample(io.BytesIO(buf), str(tmpdir), str(tmpdir.join('tmp')))
+    assert len(tmpdir.listdir()) == 2
+
+
+def test_radix_longest_prefix_match():
+    rt = RadixTree()
+    rt.add('10.0.0.0/8', 'A')
+    rt.add('10.1.0.0/16', 'B')
+    rt.add('10.1.1.0/24', 'C')
+    rt.add('2001:db8::/32', 'D')
+    assert len(rt) == 4
+    assert rt.lookup('10.1.1.1') == 'C'
+    assert rt.lookup('10.1.2.1') == 'B'
+    assert rt.lookup('10.2.0.1') == 'A'
+    assert rt.lookup('11.0.0.1') is None
+    assert rt.lookup('2001:db8:1::1') == 'D'
+    assert rt.lookup('2001:db9::1') is None
+
+    rt.add('10.0.0.0/8', 'E', replace=False)
+    assert rt.lookup('10.2.0.1') == 'A'
+
+    with pytest.raises(ValueError):
+        rt.lookup('10.1.1')
+
+
+def test_parse_prefix():
+    assert parse_prefix('10.1.2.3/16') == (4, 0x0a010000, 0x0a01ffff)
+    assert parse_prefix('10.1.2.3') == (4, 0x0a010203, 0x0a010203)
+    assert parse_prefix('2001:db8::/32') == (
+        6, 0x20010db8 << 96, (0x20010db9 << 96) - 1)
+    for cidr in ('10.1.2.3/33', '10.1.2/8', '10.0.0.0/x'):
+        with pytest.raises(ValueError):
+            parse_prefix(cidr)
+
+
+def test_suffix_trie():
+    st = SuffixTrie()
+    st.add('europa.eu', 'EU')
+    st.add('cert.europa.eu', 'CERT-EU')
+    assert len(st) == 2
+    assert st.lookup('cert.europa.eu') == 'CERT-EU'
+    assert st.lookup('www.CERT.europa.eu') == 'CERT-EU'
+    assert st.lookup('ec.europa.eu') == 'EU'
+    assert st.lookup('noteuropa.eu') is None
+    assert st.lookup('eu') is None
+
+
+def test_hostname():
+    assert hostname('https://user:pw@WWW.cert.eu:8443/a?b=1') == 'www.cert.eu'
+    assert hostname('cert.eu/path') == 'cert.eu'
+    assert hostname('cert.eu.') == 'cert.eu'
+    assert hostname('http://') is None
+
+
+def test_asn_table():
+    t = AsnTable.from_lines([
+        '; IP-ASN32-DAT file',
+        '10.0.0.0/8\t1',
+        '10.1.0.0/16\t2',
+        '10.1.1.0/24\t{3,4}',
+        '2001:db8::/32\t5',
+        'invalid\t6',
+    ])
+    assert t.lookup('10.0.0.1') == 1
+    assert t.lookup('10.1.0.1') == 2
+    assert t.lookup('10.1.1.1') == 3
+    assert t.lookup('10.1.2.1') == 2
+    assert t.lookup('10.255.255.255') == 1
+    assert t.lookup('11.0.0.0') is None
+    assert t.lookup('2001:db8::1') == 5
+
+
+def test_find_conflicts():
+    report = find_conflicts([
+        ('10.0.0.0/24', 'A', 1),
+        ('10.0.0.0/25', 'B', 2),
+        ('10.0.0.128/25', 'A', 3),
+        ('10.0.0.128/25', 'B', 4),
+        ('2001:db8::/32', 'C', 5),
+        ('10.0.0.0/26', 'B', 6),
+    ])
+    assert report['duplicates'] == [[3, 4]]
+    assert sorted(report['overlaps']) == [(3, 1), (6, 2)]
+    assert sorted(report['nested']) == [(2, 1), (4, 1), (6, 1)]
+    assert sorted(report['unreachable']) == [
+        (1, 'covered'), (4, 'duplicate')]
+
+
+def test_json_backends(client):
+    body = {'organizations': Organization.query.all(),
+            'created': datetime(2016, 11, 4, 15, 22, 39),
+            'price': Decimal('1.50'), 'name': 'CERT-EU \u20ac',
+            'big': 2 ** 70}
+    expected = json.loads(encoding.get_backend('json')(body).decode('utf-8'))
+    assert expected['created'] == '2016-11-04 15:22:39'
+    assert expected['price'] == '1.50'
+    assert expected['organizations'][0]['abbreviation']
+    for name in encoding.backends:
+        rv = encoding.get_backend(name)(body)
+        assert json.loads(rv.decode('utf-8')) == expected
+    with pytest.raises(ValueError):
+        encoding.get_backend('nosuchbackend')
+
+
+def test_audit_log(client, app, monkeypatch):
+    entries = []
+    handler = logging.Handler()
+    handler.emit = lambda record: entries.append(record.getMessage())
+    monkeypatch.setattr(app.audit_log, 'background', False)
+    monkeypatch.setattr(app.audit_log, 'max_data', 64)
+    app.audit_log.logger.addHandler(handler)
+    try:
+        client.post(url_for('api.add_asn'),
+                    json={'asn': 64600, 'organization_id': 1})
+        client.post(url_for('api.add_asn'),
+                    json={'asn': 64601, 'organization_id': 1,
+                          'as_name': 'x' * 100})
+    finally:
+        app.audit_log.logger.removeHandler(handler)
+    assert 'action="add"' in entries[0]
+    assert '\\"asn\\": 64600' in entries[0]
+    assert 'data="sha256=' in entries[1]
+
+
+def test_audit_log_store(client, app, monkeypatch):
+    monkeypatch.setattr(app.audit_log, 'background', False)
+    client.post(url_for('api.add_asn'),
+                json={'asn': 64602, 'organization_id': 1})
+    rv = client.get(url_for('api.get_audit_log', endpoint='api.add_asn',
+                            action='add', after=''))
+    assert rv.status_code == 200
+    entry = rv.json['items'][0]
+    assert entry['module'] == 'api'
+    assert entry['status'] == 201
+    assert '64602' in entry['data']
+    rv = client.get(url_for('api.get_audit_log', status='ok'))
+    assert rv.status_code == 400